@@ -0,0 +1,398 @@
+import io
+import json
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from device_protocol import RawFrame
+from preprocessing import open_rgb
+
+# Telegram rejects photo captions longer than this
+CAPTION_LIMIT = 1024
+# sendMediaGroup takes 2-10 items
+MEDIA_GROUP_MAX = 10
+
+
+class TelegramError(Exception):
+    """A failed Bot API call. `status` is the HTTP status, or None if no response came back."""
+
+    def __init__(self, message, status=None):
+        super().__init__(message)
+        self.status = status
+
+    @property
+    def retryable(self):
+        # Network errors, timeouts, 429 and 5xx may succeed later; any other 4xx never will
+        return self.status is None or self.status == 429 or self.status >= 500
+
+
+class TelegramRateLimited(TelegramError):
+    def __init__(self, retry_after):
+        super().__init__(f"Telegram rate limit reached; retry after {retry_after}s.", status=429)
+        self.retry_after = retry_after
+
+
+class TokenBucket:
+    """Allows `rate` calls per second on average, in bursts of up to `burst` (rate 0: unlimited).
+
+    `pause()` empties the bucket for a while, which is how a 429's retry_after is honoured by
+    every thread sharing the bucket instead of only the one that received it.
+    """
+
+    def __init__(self, rate=1.0, burst=3):
+        self.rate = float(rate)
+        self.burst = max(float(burst), 1.0)
+        self._tokens = self.burst
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+        self._lock = threading.Lock()
+
+    def acquire(self, timeout=None):
+        """Takes one token, waiting for it up to `timeout` seconds. Returns False on timeout."""
+        if self.rate <= 0 and not self._paused_until:
+            return True
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if now >= self._paused_until and (self.rate <= 0 or self._tokens >= 1.0):
+                    self._tokens -= 1.0
+                    return True
+                refill_wait = (1.0 - self._tokens) / self.rate if self.rate > 0 else 0.0
+                wait = max(self._paused_until - now, refill_wait, 0.001)
+            if deadline is not None:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return False
+                wait = min(wait, remaining)
+            time.sleep(wait)
+
+    def pause(self, seconds):
+        with self._lock:
+            self._paused_until = max(self._paused_until, time.monotonic() + float(seconds))
+            self._tokens = 0.0
+
+
+class TelegramClient:
+    """Bot API client over one pooled HTTPS session, rate-limited by a shared token bucket.
+
+    `transport(url, data, files, timeout)` makes the HTTPS POST and returns (status code, body
+    text), raising OSError when no response comes back. It defaults to the pooled `requests`
+    session; the ASGI server swaps in its async client (see asgi_app.py).
+    """
+
+    API_URL = "https://api.telegram.org/bot{token}/{method}"
+
+    def __init__(self, token, chat_id, rate_limiter=None, timeout=10.0, max_wait=60.0, pool_size=4):
+        self.token = token
+        self.chat_id = chat_id
+        self.rate_limiter = rate_limiter or TokenBucket()
+        self.timeout = float(timeout)
+        self.max_wait = float(max_wait)
+        self.session = requests.Session()
+        self.session.mount('https://', HTTPAdapter(pool_connections=1, pool_maxsize=pool_size))
+        self.transport = self.post
+        self._lock = threading.Lock()
+        self.sent = 0
+        self.failed = 0
+        self.rate_limited = 0
+        self.bytes_uploaded = 0
+
+    @property
+    def configured(self):
+        return bool(self.token) and self.token != 'YOUR_TELEGRAM_BOT_TOKEN'
+
+    def call(self, method, data, files=None):
+        """Calls a Bot API method. Raises TelegramError (TelegramRateLimited on 429) on failure."""
+        if not self.rate_limiter.acquire(self.max_wait):
+            raise TelegramError(f"Timed out after {self.max_wait}s waiting for the Telegram rate limiter.")
+        data = dict(data, chat_id=self.chat_id)
+        upload = sum(len(file[1]) for file in (files or {}).values())
+        try:
+            status, text = self.transport(self.API_URL.format(token=self.token, method=method), data, files,
+                                          self.timeout)
+        except OSError as e:  # requests' exceptions are OSErrors too
+            with self._lock:
+                self.failed += 1
+            raise TelegramError(f"{method} failed due to network error: {e}")
+
+        if status == 429:
+            try:
+                retry_after = float(json.loads(text).get('parameters', {}).get('retry_after', 5))
+            except ValueError:
+                retry_after = 5.0
+            self.rate_limiter.pause(retry_after)
+            with self._lock:
+                self.rate_limited += 1
+            raise TelegramRateLimited(retry_after)
+        if status != 200:
+            with self._lock:
+                self.failed += 1
+            raise TelegramError(f"{method} failed. Status: {status}, Response: {text}", status=status)
+
+        with self._lock:
+            self.sent += 1
+            self.bytes_uploaded += upload
+        return json.loads(text)
+
+    def post(self, url, data, files, timeout):
+        """The default transport: one POST over the pooled `requests` session."""
+        response = self.session.post(url, data=data, files=files, timeout=timeout)
+        return response.status_code, response.text
+
+    def send_message(self, text):
+        return self.call('sendMessage', {'text': text, 'parse_mode': 'HTML'})
+
+    def send_photo(self, photo, caption):
+        return self.call('sendPhoto', {'caption': truncate_caption(caption), 'parse_mode': 'HTML'},
+                         files={'photo': ('photo.jpg', photo, 'image/jpeg')})
+
+    def send_media_group(self, photos, caption):
+        """Sends 2-10 photos as one album, with `caption` on the first."""
+        media, files = [], {}
+        for i, photo in enumerate(photos):
+            item = {'type': 'photo', 'media': f'attach://photo{i}'}
+            if i == 0:
+                item.update(caption=truncate_caption(caption), parse_mode='HTML')
+            media.append(item)
+            files[f'photo{i}'] = (f'photo{i}.jpg', photo, 'image/jpeg')
+        return self.call('sendMediaGroup', {'media': json.dumps(media)}, files=files)
+
+    def stats(self):
+        with self._lock:
+            return {"sent": self.sent, "failed": self.failed, "rate_limited": self.rate_limited,
+                    "bytes_uploaded": self.bytes_uploaded}
+
+
+# An HTML caption is a run of tags, character entities and plain text
+CAPTION_TOKEN = re.compile(r'(<[^>]*>|&#?\w+;)')
+
+def truncate_caption(caption, limit=CAPTION_LIMIT):
+    """Shortens an HTML caption to `limit` visible characters, closing the tags left open.
+
+    Telegram counts the text after parsing the markup, so tags are free and an entity such as
+    &amp; is one character; the cut only falls inside plain text, never inside a tag or entity.
+    """
+    tokens = [token for token in CAPTION_TOKEN.split(caption) if token]
+    visible = sum(1 if token.startswith('&') else len(token) for token in tokens if not token.startswith('<'))
+    if visible <= limit:
+        return caption
+
+    parts, open_tags, budget = [], [], limit - 1
+    for token in tokens:
+        if token.startswith('<'):
+            name = token.strip('</>').split()[0].lower() if token.strip('</>') else ''
+            if token.startswith('</'):
+                if name in open_tags:
+                    open_tags.remove(name)
+            elif not token.endswith('/>'):
+                open_tags.append(name)
+            parts.append(token)
+            continue
+        size = 1 if token.startswith('&') else len(token)
+        if size > budget:
+            if not token.startswith('&'):
+                parts.append(token[:budget])
+            break
+        parts.append(token)
+        budget -= size
+    parts.append('…')
+    parts.extend(f'</{name}>' for name in reversed(open_tags))
+    return ''.join(parts)
+
+def thumbnail_jpeg(image_bytes, max_side=320, quality=70, frame=None):
+    """Downscales an uploaded photo (decoded at a reduced JPEG scale when possible) for an alert.
+
+    `frame` describes a raw device frame (RawFrame.describe()) when the bytes are not an image file.
+    """
+    if frame is not None:
+        img = RawFrame(image_bytes, **frame).to_image()
+    else:
+        img = open_rgb(io.BytesIO(image_bytes), draft_min_side=max_side)
+    img.thumbnail((max_side, max_side))
+    buffer = io.BytesIO()
+    img.save(buffer, format='JPEG', quality=quality, optimize=True)
+    return buffer.getvalue()
+
+def is_healthy(class_name):
+    return 'healthy' in class_name.lower()
+
+
+class AlertDispatcher:
+    """Decides which prediction alerts reach Telegram, and sends them.
+
+    `accepts()` runs in the request, before anything is queued: healthy results, results under
+    `min_confidence` and repeats of the same image key within `dedupe_window` are suppressed.
+    `deliver()` runs on a side-effect worker. In 'instant' mode it sends one downscaled photo
+    per alert; in 'digest' mode it keeps the thumbnail, and every `digest_interval` seconds one
+    album (sendMediaGroup) per predicted class goes out, holding up to `max_photos` of that
+    class's most confident scans. A digest that fails with a retryable error (network, 429, 5xx)
+    is kept, with the classes after it, for the next round; the rate limiter holds that round
+    back for a 429's retry_after. A digest Telegram rejects (any other 4xx) is dropped and
+    counted, and the remaining classes still go out.
+    """
+
+    def __init__(self, client, caption_fn, digest_caption_fn, mode='digest', digest_interval=300.0,
+                 max_photos=MEDIA_GROUP_MAX, thumbnail_side=320, suppress_healthy=True, min_confidence=0.0,
+                 dedupe_window=300.0, max_pending=500):
+        if mode not in ('digest', 'instant'):
+            raise ValueError(f"Unknown alert mode '{mode}'. Expected 'digest' or 'instant'.")
+        self.client = client
+        self.caption_fn = caption_fn
+        self.digest_caption_fn = digest_caption_fn
+        self.mode = mode
+        self.digest_interval = float(digest_interval)
+        self.max_photos = min(max(int(max_photos), 1), MEDIA_GROUP_MAX)
+        self.thumbnail_side = int(thumbnail_side)
+        self.suppress_healthy = suppress_healthy
+        self.min_confidence = float(min_confidence)
+        self.dedupe_window = float(dedupe_window)
+        self.max_pending = int(max_pending)
+
+        self._recent = OrderedDict()
+        self._pending = {}
+        self._pending_count = 0
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._stopping = threading.Event()
+        self._thread = None
+        self._owner = None
+        self.suppressed = {"healthy": 0, "low_confidence": 0, "duplicate": 0}
+        self.dropped = 0
+        self.digests_sent = 0
+        self.digests_rejected = 0
+        self.last_digest_at = None
+
+    # --- Rules ---
+    def accepts(self, key, predicted_class, confidence):
+        """True if an alert for this result should be queued (and remembers it for de-duplication)."""
+        if self.suppress_healthy and is_healthy(predicted_class):
+            reason = "healthy"
+        elif confidence < self.min_confidence:
+            reason = "low_confidence"
+        else:
+            reason = None
+        now = time.time()
+        with self._lock:
+            if reason is None and key is not None:
+                while self._recent and next(iter(self._recent.values())) < now - self.dedupe_window:
+                    self._recent.popitem(last=False)
+                if key in self._recent:
+                    reason = "duplicate"
+                else:
+                    self._recent[key] = now
+            if reason is not None:
+                self.suppressed[reason] += 1
+                return False
+        return True
+
+    # --- Delivery ---
+    def deliver(self, payload):
+        """Side-effect sink: sends now ('instant') or adds to the next digest. Raises on failure."""
+        if not self.client.configured:
+            print("WARNING: Telegram bot token not set. Skipping Telegram notification.")
+            return
+        thumbnail = thumbnail_jpeg(payload['photo'], self.thumbnail_side, frame=payload.get('frame'))
+        if self.mode == 'instant':
+            self.client.send_photo(thumbnail, self.caption_fn(payload))
+            print("✅ Telegram notification sent.")
+            return
+
+        alert = {key: value for key, value in payload.items() if key != 'photo'}
+        alert['thumbnail'] = thumbnail
+        with self._lock:
+            if self._pending_count >= self.max_pending:
+                self.dropped += 1
+                return
+            self._pending.setdefault(alert['predicted_class'], []).append(alert)
+            self._pending_count += 1
+        self.start()
+
+    def flush_digest(self):
+        """Sends one album per pending class. Returns the number of messages sent."""
+        with self._flush_lock:
+            with self._lock:
+                pending, self._pending, self._pending_count = self._pending, {}, 0
+            sent = 0
+            for class_name in sorted(pending, key=lambda name: -len(pending[name])):
+                alerts = pending.pop(class_name)
+                shown = sorted(alerts, key=lambda alert: -alert['confidence'])[:self.max_photos]
+                caption = self.digest_caption_fn(class_name, alerts)
+                try:
+                    if len(shown) == 1:
+                        self.client.send_photo(shown[0]['thumbnail'], caption)
+                    else:
+                        self.client.send_media_group([alert['thumbnail'] for alert in shown], caption)
+                except TelegramError as e:
+                    if not e.retryable:
+                        print(f"❌ Telegram rejected the digest for {class_name}, dropping {len(alerts)} alert(s): {e}")
+                        with self._lock:
+                            self.digests_rejected += 1
+                            self.dropped += len(alerts)
+                        continue
+                    print(f"❌ Telegram digest for {class_name} failed, keeping it for the next round: {e}")
+                    pending[class_name] = alerts
+                    self._requeue(pending)
+                    break
+                sent += 1
+            if sent:
+                with self._lock:
+                    self.digests_sent += sent
+                    self.last_digest_at = time.time()
+                print(f"✅ Telegram digest sent ({sent} message(s)).")
+            return sent
+
+    def _requeue(self, pending):
+        with self._lock:
+            for class_name, alerts in pending.items():
+                self._pending.setdefault(class_name, [])[:0] = alerts
+                self._pending_count += len(alerts)
+
+    # --- Digest thread ---
+    def start(self):
+        if self.mode != 'digest':
+            return self
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive() and self._owner == os.getpid():
+                return self
+            self._owner = os.getpid()
+            self._stopping.clear()
+            self._thread = threading.Thread(target=self._run, name="telegram-digest", daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self, flush=True, timeout=10.0):
+        self._stopping.set()
+        if self._thread is not None:
+            self._thread.join(max(timeout, 0.1))
+            self._thread = None
+        if flush and self.mode == 'digest':
+            self.flush_digest()
+
+    def _run(self):
+        while not self._stopping.wait(self.digest_interval):
+            try:
+                self.flush_digest()
+            except Exception as e:
+                print(f"Error sending the Telegram digest: {e}")
+
+    def stats(self):
+        with self._lock:
+            return {
+                "mode": self.mode,
+                "pending": self._pending_count,
+                "pending_classes": len(self._pending),
+                "suppressed": dict(self.suppressed),
+                "dropped": self.dropped,
+                "digests_sent": self.digests_sent,
+                "digests_rejected": self.digests_rejected,
+                "last_digest_at": self.last_digest_at,
+                "client": self.client.stats(),
+            }
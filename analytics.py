@@ -0,0 +1,423 @@
+"""Local prediction analytics: an append-only record log with per-hour and per-day rollups.
+
+Every prediction is appended to the log as one fixed-size 16-byte record (timestamp,
+confidence, class id, language) with a single O_APPEND write, so all workers share one log
+without locking. Each worker folds records it has not seen yet into numpy rollups (counts and
+confidence sums per hour x class and day x class, and per day x language) when it answers a
+query; crops are sums over their classes. The rollups are snapshotted next to the log with
+the log offset they cover, so a restart only replays the records written since.
+
+    python analytics.py [analytics.log] [class_indices.json] [--granularity day]
+
+prints the totals per crop for each bucket.
+"""
+import argparse
+import json
+import os
+import struct
+import tempfile
+import threading
+import time
+from datetime import datetime, timezone
+
+import numpy as np
+
+from inference import crop_of
+
+RECORD = struct.Struct('<dfH2s')
+RECORD_DTYPE = np.dtype([('ts', '<f8'), ('confidence', '<f4'), ('class_id', '<u2'), ('lang', 'S2')])
+# Predictions relabeled "Unknown" (under their crop's confidence threshold)
+UNKNOWN_CLASS = 0xFFFE
+UNKNOWN_NAME = 'Unknown'
+# Predictions of classes missing from the class table (e.g. from a model version with new classes)
+OTHER_CLASS = 0xFFFF
+OTHER_NAME = 'Other'
+# Language of predictions whose language is not one of the accepted codes (or is empty)
+OTHER_LANGUAGE = '-'
+GRANULARITIES = {'hour': 3600, 'day': 86400}
+
+
+def parse_time(value):
+    """Epoch seconds, or an ISO 8601 date/datetime (UTC unless it has an offset). None passes through."""
+    if value is None or value == '':
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    try:
+        parsed = datetime.fromisoformat(value.replace('Z', '+00:00'))
+    except ValueError:
+        raise ValueError(f"'{value}' is neither epoch seconds nor an ISO 8601 date.")
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=timezone.utc)
+    return parsed.timestamp()
+
+def bucket_label(bucket, seconds):
+    fmt = '%Y-%m-%d' if seconds >= 86400 else '%Y-%m-%dT%H'
+    return datetime.fromtimestamp(bucket * seconds, timezone.utc).strftime(fmt)
+
+
+class Rollup:
+    """Counts and confidence sums per (time bucket, column) in two growable 2-D arrays."""
+
+    def __init__(self, seconds, columns):
+        self.seconds = seconds
+        self.base = 0
+        self.counts = np.zeros((0, columns), dtype=np.int64)
+        self.confidence = np.zeros((0, columns), dtype=np.float64)
+
+    def _reserve(self, first, last, columns):
+        rows, width = self.counts.shape
+        if rows == 0:
+            self.base = first
+        new_base = min(self.base, first)
+        new_rows = max(self.base + rows, last + 1) - new_base
+        if new_base == self.base and new_rows <= rows and columns <= width:
+            return
+        # Grow with headroom so a steady stream of new buckets does not copy every time
+        capacity = max(new_rows, rows + rows // 2 + 24) if new_base == self.base else new_rows
+        counts = np.zeros((capacity, max(columns, width)), dtype=np.int64)
+        confidence = np.zeros_like(counts, dtype=np.float64)
+        offset = self.base - new_base
+        counts[offset:offset + rows, :width] = self.counts
+        confidence[offset:offset + rows, :width] = self.confidence
+        self.base, self.counts, self.confidence = new_base, counts, confidence
+
+    def add(self, timestamps, columns, confidences):
+        if not len(timestamps):
+            return
+        buckets = np.floor_divide(timestamps, self.seconds).astype(np.int64)
+        self._reserve(int(buckets.min()), int(buckets.max()), int(columns.max()) + 1)
+        rows = buckets - self.base
+        np.add.at(self.counts, (rows, columns), 1)
+        np.add.at(self.confidence, (rows, columns), confidences)
+
+    def window(self, start=None, end=None):
+        """(first bucket, counts, confidence sums) for buckets overlapping [start, end)."""
+        rows = self.counts.shape[0]
+        lo = 0 if start is None else int(np.floor(start / self.seconds)) - self.base
+        hi = rows if end is None else int(np.ceil(end / self.seconds)) - self.base
+        lo, hi = min(max(lo, 0), rows), min(max(hi, 0), rows)
+        return self.base + lo, self.counts[lo:hi], self.confidence[lo:hi]
+
+    def state(self, prefix):
+        return {f'{prefix}_base': np.int64(self.base), f'{prefix}_counts': self.counts,
+                f'{prefix}_confidence': self.confidence}
+
+    def restore(self, state, prefix):
+        self.base = int(state[f'{prefix}_base'])
+        self.counts = state[f'{prefix}_counts']
+        self.confidence = state[f'{prefix}_confidence']
+
+
+class PredictionAnalytics:
+    """Prediction log plus rollups, shared by every worker through the log file.
+
+    `sync_fn(updates)`, if given, receives {"day/<date>": rollup, "hour/<date>T<hour>": rollup}
+    for the buckets that changed since the last sync (e.g. one Realtime Database update), every
+    `sync_interval` seconds, from a background thread started by `start()`. With `languages`,
+    any other language code is recorded as OTHER_LANGUAGE, so an arbitrary ?lang= value is
+    never stored as (the first two letters of) a real language.
+    """
+
+    def __init__(self, path, class_names, snapshot_interval=300.0, sync_fn=None, sync_interval=0.0, languages=None):
+        self.path = path
+        self.snapshot_path = path + '.npz'
+        self.synced_path = path + '.synced'
+        self.snapshot_interval = float(snapshot_interval)
+        self.sync_fn = sync_fn
+        self.sync_interval = float(sync_interval)
+        self.accepted_languages = frozenset(languages) if languages is not None else None
+
+        size = max(class_names) + 1 if class_names else 0
+        # Model classes, then the two reserved columns
+        self.class_names = [class_names.get(i, f'class_{i}') for i in range(size)] + [UNKNOWN_NAME, OTHER_NAME]
+        self.class_ids = {name: i for i, name in enumerate(self.class_names[:size])}
+        self.class_ids.setdefault(UNKNOWN_NAME, UNKNOWN_CLASS)
+        self._unknown_column, self._other_column = size, size + 1
+        self.crops = sorted({crop_of(name) for name in self.class_names})
+        # (classes + unknown + other) x crops one-hot matrix: class counts @ crop_matrix = crop counts
+        self.crop_matrix = np.zeros((len(self.class_names), len(self.crops)), dtype=np.int64)
+        for i, name in enumerate(self.class_names):
+            self.crop_matrix[i, self.crops.index(crop_of(name))] = 1
+
+        self.hourly = Rollup(GRANULARITIES['hour'], len(self.class_names))
+        self.daily = Rollup(GRANULARITIES['day'], len(self.class_names))
+        self.daily_languages = Rollup(GRANULARITIES['day'], 1)
+        self.languages = []
+        self.offset = 0
+        self.syncs = 0
+        self.sync_errors = 0
+        self.last_refresh_ms = None
+        self._language_ids = {}
+        self._fd = None
+        self._fd_owner = None
+        self._last_snapshot = time.monotonic()
+        self._lock = threading.Lock()
+        self._stopping = threading.Event()
+        self._thread = None
+        self._owner = None
+        self._load_snapshot()
+        self.refresh()
+
+    # --- Writing ---
+    def record(self, class_name, confidence, lang, timestamp=None):
+        """Appends one prediction to the log (one write, no lock shared with other processes)."""
+        class_id = self.class_ids.get(class_name, OTHER_CLASS)
+        if self.accepted_languages is not None and lang not in self.accepted_languages:
+            lang = OTHER_LANGUAGE
+        data = RECORD.pack(time.time() if timestamp is None else timestamp, confidence, class_id,
+                           (lang or '').encode('ascii', 'ignore')[:2])
+        os.write(self._log_fd(), data)
+
+    def _log_fd(self):
+        if self._fd is None or self._fd_owner != os.getpid():
+            # A descriptor inherited over fork would work too, but is never closed by the worker
+            self._fd = os.open(self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+            self._fd_owner = os.getpid()
+        return self._fd
+
+    # --- Rollups ---
+    def _read(self, start, end):
+        count = (end - start) // RECORD.size
+        if count <= 0:
+            return np.zeros(0, dtype=RECORD_DTYPE)
+        with open(self.path, 'rb') as f:
+            return np.fromfile(f, dtype=RECORD_DTYPE, count=count, offset=start)
+
+    def refresh(self):
+        """Folds records appended since the last refresh into the rollups. Returns how many."""
+        started = time.perf_counter()
+        with self._lock:
+            try:
+                size = os.path.getsize(self.path)
+            except FileNotFoundError:
+                size = 0
+            if size < self.offset:
+                print(f"⚠️ {self.path} is shorter than before; rebuilding the analytics rollups.")
+                self._reset()
+            records = self._read(self.offset, size)
+            if len(records):
+                self._fold(records)
+                self.offset += len(records) * RECORD.size
+            self.last_refresh_ms = (time.perf_counter() - started) * 1000.0
+            snapshot_due = len(records) and time.monotonic() - self._last_snapshot >= self.snapshot_interval
+        if snapshot_due:
+            self.snapshot()
+        return len(records)
+
+    def _fold(self, records):
+        class_ids = records['class_id'].astype(np.int64)
+        columns = np.where(class_ids == UNKNOWN_CLASS, self._unknown_column,
+                           np.where(class_ids < self._unknown_column, class_ids, self._other_column))
+        timestamps = records['ts']
+        confidences = records['confidence'].astype(np.float64)
+        self.hourly.add(timestamps, columns, confidences)
+        self.daily.add(timestamps, columns, confidences)
+        codes, inverse = np.unique(records['lang'], return_inverse=True)
+        codes = [code.decode('ascii', 'ignore') or OTHER_LANGUAGE for code in codes]
+        for code in codes:
+            if code not in self._language_ids:
+                self._language_ids[code] = len(self.languages)
+                self.languages.append(code)
+        language_columns = np.array([self._language_ids[code] for code in codes], dtype=np.int64)[inverse.ravel()]
+        self.daily_languages.add(timestamps, language_columns, confidences)
+
+    def _reset(self):
+        self.hourly = Rollup(GRANULARITIES['hour'], len(self.class_names))
+        self.daily = Rollup(GRANULARITIES['day'], len(self.class_names))
+        self.daily_languages = Rollup(GRANULARITIES['day'], 1)
+        self.languages, self._language_ids, self.offset = [], {}, 0
+
+    # --- Snapshots ---
+    def snapshot(self):
+        """Saves the rollups and the log offset they cover (atomically; any worker may do it)."""
+        with self._lock:
+            state = dict(self.hourly.state('hourly'), **self.daily.state('daily'),
+                         **self.daily_languages.state('languages'))
+            state.update(offset=np.int64(self.offset), class_names=np.array(json.dumps(self.class_names)),
+                         language_codes=np.array(json.dumps(self.languages)))
+            self._last_snapshot = time.monotonic()
+        directory = os.path.dirname(os.path.abspath(self.snapshot_path))
+        fd, tmp_path = tempfile.mkstemp(prefix='.analytics-', suffix='.npz', dir=directory)
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                np.savez(f, **state)
+            os.replace(tmp_path, self.snapshot_path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+    def _load_snapshot(self):
+        try:
+            with np.load(self.snapshot_path) as state:
+                state = {name: state[name] for name in state.files}
+        except FileNotFoundError:
+            return
+        except Exception as e:
+            print(f"⚠️ Ignoring unreadable analytics snapshot {self.snapshot_path}: {e}")
+            return
+        try:
+            size = os.path.getsize(self.path)
+        except FileNotFoundError:
+            size = 0
+        if json.loads(str(state['class_names'])) != self.class_names or int(state['offset']) > size:
+            print(f"ℹ️ Analytics snapshot {self.snapshot_path} does not match the log or classes; rebuilding.")
+            return
+        self.hourly.restore(state, 'hourly')
+        self.daily.restore(state, 'daily')
+        self.daily_languages.restore(state, 'languages')
+        self.languages = json.loads(str(state['language_codes']))
+        self._language_ids = {code: i for i, code in enumerate(self.languages)}
+        self.offset = int(state['offset'])
+
+    # --- Queries ---
+    def query(self, start=None, end=None, granularity='day', class_name=None, crop=None):
+        """Totals per class, crop and language, and a per-bucket series, for [start, end)."""
+        if granularity not in GRANULARITIES:
+            raise ValueError(f"Unknown granularity '{granularity}'. Expected one of {', '.join(GRANULARITIES)}.")
+        self.refresh()
+        with self._lock:
+            rollup = self.hourly if granularity == 'hour' else self.daily
+            first, counts, confidence = rollup.window(start, end)
+            counts, confidence = counts.copy(), confidence.copy()
+            day_first, day_counts, _ = self.daily_languages.window(start, end)
+            language_totals = day_counts.sum(axis=0)
+            languages = list(self.languages)
+
+        selected = np.ones(len(self.class_names), dtype=bool)
+        if class_name is not None:
+            selected &= np.array([name == class_name for name in self.class_names])
+        if crop is not None:
+            selected &= self.crop_matrix[:, self.crops.index(crop)].astype(bool) if crop in self.crops else False
+        counts[:, ~selected] = 0
+        confidence[:, ~selected] = 0.0
+
+        class_totals = counts.sum(axis=0)
+        confidence_totals = confidence.sum(axis=0)
+        crop_totals = class_totals @ self.crop_matrix
+        bucket_totals = counts.sum(axis=1)
+        bucket_crops = counts @ self.crop_matrix
+        total = int(class_totals.sum())
+        return {
+            "from": start,
+            "to": end,
+            "granularity": granularity,
+            "total": total,
+            "mean_confidence": float(confidence_totals.sum() / total) if total else None,
+            "classes": {self.class_names[i]: {"count": int(class_totals[i]),
+                                              "mean_confidence": float(confidence_totals[i] / class_totals[i])}
+                        for i in np.flatnonzero(class_totals)},
+            "crops": {self.crops[i]: int(crop_totals[i]) for i in np.flatnonzero(crop_totals)},
+            # Languages are rolled up per day only, and not narrowed by the class or crop filter
+            "languages": {languages[i]: int(language_totals[i]) for i in np.flatnonzero(language_totals)},
+            "series": [
+                {"bucket": bucket_label(first + row, rollup.seconds), "start": int(first + row) * rollup.seconds,
+                 "total": int(bucket_totals[row]),
+                 "crops": {self.crops[i]: int(bucket_crops[row, i]) for i in np.flatnonzero(bucket_crops[row])}}
+                for row in np.flatnonzero(bucket_totals)
+            ],
+        }
+
+    # --- Firebase Sync ---
+    def _bucket_rollup(self, rollup, bucket):
+        row = bucket - rollup.base
+        counts, confidence = rollup.counts[row], rollup.confidence[row]
+        total = int(counts.sum())
+        crops = counts @ self.crop_matrix
+        return {
+            "total": total,
+            "mean_confidence": float(confidence.sum() / total) if total else None,
+            "classes": {self.class_names[i]: int(counts[i]) for i in np.flatnonzero(counts)},
+            "crops": {self.crops[i]: int(crops[i]) for i in np.flatnonzero(crops)},
+        }
+
+    def sync(self):
+        """Sends the rollups of every bucket with records since the last sync. Returns how many."""
+        self.refresh()
+        try:
+            with open(self.synced_path, 'r') as f:
+                synced = int(json.load(f).get('offset', 0))
+        except (FileNotFoundError, ValueError):
+            synced = 0
+        with self._lock:
+            if synced > self.offset:
+                synced = 0  # the log was reset
+            if synced == self.offset:
+                return 0
+            timestamps = self._read(synced, self.offset)['ts']
+            updates = {}
+            for label, rollup in (('hour', self.hourly), ('day', self.daily)):
+                for bucket in np.unique(np.floor_divide(timestamps, rollup.seconds).astype(np.int64)):
+                    updates[f"{label}/{bucket_label(int(bucket), rollup.seconds)}"] = self._bucket_rollup(rollup, int(bucket))
+            offset = self.offset
+        self.sync_fn(updates)
+        # Several workers may sync the same buckets; the values are identical, so that is harmless
+        tmp_path = f"{self.synced_path}.{os.getpid()}"
+        with open(tmp_path, 'w') as f:
+            json.dump({"offset": offset, "synced_at": time.time()}, f)
+        os.replace(tmp_path, self.synced_path)
+        self.syncs += 1
+        return len(updates)
+
+    def start(self):
+        if self.sync_fn is None or self.sync_interval <= 0:
+            return self
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive() and self._owner == os.getpid():
+                return self
+            self._owner = os.getpid()
+            self._stopping.clear()
+            self._thread = threading.Thread(target=self._run, name="analytics-sync", daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self):
+        self._stopping.set()
+        try:
+            self.refresh()
+            self.snapshot()
+        except Exception as e:
+            print(f"Error saving the analytics snapshot: {e}")
+
+    def _run(self):
+        while not self._stopping.wait(self.sync_interval):
+            try:
+                self.sync()
+            except Exception as e:
+                self.sync_errors += 1
+                print(f"Error syncing analytics rollups: {e}")
+
+    def stats(self):
+        with self._lock:
+            return {
+                "path": self.path,
+                "records": self.offset // RECORD.size,
+                "hour_buckets": self.hourly.counts.shape[0],
+                "day_buckets": self.daily.counts.shape[0],
+                "rollup_bytes": self.hourly.counts.nbytes * 2 + self.daily.counts.nbytes * 2,
+                "last_refresh_ms": self.last_refresh_ms,
+                "syncs": self.syncs,
+                "sync_errors": self.sync_errors,
+            }
+
+
+if __name__ == '__main__':
+    from inference import load_class_names
+
+    parser = argparse.ArgumentParser(description="Print prediction counts per crop from the analytics log.")
+    parser.add_argument('path', nargs='?', default='analytics.log')
+    parser.add_argument('class_indices', nargs='?', default='class_indices.json')
+    parser.add_argument('--granularity', choices=sorted(GRANULARITIES), default='day')
+    parser.add_argument('--from', dest='start', help="Epoch seconds or ISO 8601 date.")
+    parser.add_argument('--to', dest='end', help="Epoch seconds or ISO 8601 date.")
+    args = parser.parse_args()
+
+    analytics = PredictionAnalytics(args.path, load_class_names(args.class_indices))
+    report = analytics.query(parse_time(args.start), parse_time(args.end), args.granularity)
+    for bucket in report["series"]:
+        crops = ', '.join(f"{crop} {count}" for crop, count in sorted(bucket["crops"].items(), key=lambda item: -item[1]))
+        print(f"{bucket['bucket']}: {bucket['total']} ({crops})")
+    print(f"Total: {report['total']} predictions.")
@@ -1,12 +1,9 @@
 import os
+import hmac
+import html
 import numpy as np
-from flask import Flask, request, jsonify, render_template_string
-from tensorflow.keras.models import load_model
-import tensorflow as tf
-from tensorflow.keras.preprocessing import image
-from PIL import Image, ImageStat 
-import cv2 
-import requests 
+from flask import Flask, request, jsonify, render_template_string, g
+import time
 from flask_cors import CORS 
 import json
 import firebase_admin
@@ -14,8 +11,36 @@ from firebase_admin import credentials, db
 from googletrans import Translator 
 from io import BytesIO
 import base64 
+import shutil
+import tempfile
+import uuid
+import zipfile
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+from flask import Response, stream_with_context
+from batching import MicroBatcher
+from side_effects import SideEffectPipeline, StubSink
+from write_behind import InMemoryDatabase, WriteBehindLog
+from alerts import AlertDispatcher, TelegramClient, TelegramError, TokenBucket
+from translation_store import StubTranslator, TranslationStore
+from recommendations_store import RecommendationsStore
+from analytics import PredictionAnalytics, parse_time
+from autotune import apply_tuning
+from model_registry import ModelBundle, ModelRegistry, RegistryError, bundle_paths
+from response_templates import ResponseTemplates
+from result_cache import ResultCache, content_hash, perceptual_hash
+from ingest import (IngestRequest, IngestStats, PayloadTooLarge, check_content_length, measure_peak,
+                    read_json_image, read_multipart_image, read_raw_body)
+from device_protocol import (FRAME_TYPE, RAW_IMAGE_TYPES, RESPONSE_MIMETYPES, FrameError, RawFrame, encode_result,
+                             negotiate, open_device_upload)
+from resources import WorkerLifecycle
+import metrics
+from metrics import stage
+from inference import Calibration, load_inference_model, load_class_names, preload_model_content, top_k
+from preprocessing import IMG_HEIGHT, IMG_WIDTH, LOW_QUALITY_ERROR, NO_LEAF_ERROR, ImagePipeline, open_rgb
 
 app = Flask(__name__)
+app.request_class = IngestRequest
 CORS(app) 
 
 # --- Firebase & Telegram Config ---
@@ -28,8 +53,188 @@ TELEGRAM_CHAT_ID = '1206974757'
 MODEL_PATH = 'best_agrosense_model.h5'
 CLASS_INDICES_PATH = 'class_indices.json'
 RECOMMENDATIONS_PATH = 'recommendations.json' 
-IMG_HEIGHT = 224
-IMG_WIDTH = 224
+# recommendations.json is validated against the classes and compiled (indexed by class id) to
+# RECOMMENDATIONS_COMPILED_PATH, which all workers memory-map. Edits to recommendations.json
+# are picked up within RECOMMENDATIONS_RELOAD_INTERVAL_SECONDS (0 disables), without a restart.
+RECOMMENDATIONS_COMPILED_PATH = os.environ.get('RECOMMENDATIONS_COMPILED_PATH', 'recommendations.bin')
+RECOMMENDATIONS_RELOAD_INTERVAL_SECONDS = float(os.environ.get('RECOMMENDATIONS_RELOAD_INTERVAL_SECONDS', 5))
+# The model input size (IMG_HEIGHT x IMG_WIDTH) lives next to the preprocessing in preprocessing.py
+
+# --- Startup ---
+# How long /predict waits for a worker that is still loading before answering 503 + Retry-After
+READY_WAIT_SECONDS = float(os.environ.get('READY_WAIT_SECONDS', 30))
+
+# --- CPU Tuning ---
+# `python autotune.py` measures worker count, TensorFlow intra-/inter-op threads and oneDNN on
+# this host and saves the best configuration under a latency SLO to TUNING_PATH (gunicorn.conf.py
+# can also run it at startup with AUTOTUNE=startup). Its settings fill in whichever of
+# WEB_CONCURRENCY, TF_INTRA_OP_THREADS, TF_INTER_OP_THREADS, OMP_NUM_THREADS and
+# TF_ENABLE_ONEDNN_OPTS are not set; TF_*_OP_THREADS=0 keeps TensorFlow's own pool sizes.
+TUNING_PATH = os.environ.get('TUNING_PATH', 'tuning.json')
+tuning = apply_tuning(TUNING_PATH)
+TF_INTRA_OP_THREADS = int(os.environ.get('TF_INTRA_OP_THREADS', 0)) or None
+TF_INTER_OP_THREADS = int(os.environ.get('TF_INTER_OP_THREADS', 0)) or None
+
+# --- Model Runtime ---
+# 'keras' loads MODEL_PATH with full TensorFlow. 'tflite' / 'savedmodel' serve an artifact
+# produced by export_model.py (only if its accuracy check passed), which starts faster and
+# uses less memory per worker; TFLITE_NUM_THREADS sets the interpreter's thread count
+# (default: TF_INTRA_OP_THREADS).
+MODEL_RUNTIME = os.environ.get('MODEL_RUNTIME', 'keras')
+MODEL_ARTIFACT_PATH = os.environ.get('MODEL_ARTIFACT_PATH', {
+    'tflite': 'best_agrosense_model.tflite',
+    'savedmodel': 'best_agrosense_model_savedmodel'
+}.get(MODEL_RUNTIME))
+TFLITE_NUM_THREADS = int(os.environ.get('TFLITE_NUM_THREADS', 0)) or TF_INTRA_OP_THREADS
+
+# --- Model Registry ---
+# Versioned models in MODEL_REGISTRY_DIR (see model_registry.py), switched without a restart via
+# the /admin/models endpoints: every worker checks the registry's desired state every
+# MODEL_REGISTRY_POLL_SECONDS and retires a replaced model once its in-flight requests finish
+# (waiting at most MODEL_SWAP_DRAIN_SECONDS). A shadow version scores a sample of /predict
+# traffic in the background; at most SHADOW_MAX_PENDING shadow images wait at once.
+MODEL_REGISTRY_DIR = os.environ.get('MODEL_REGISTRY_DIR', 'models')
+MODEL_REGISTRY_POLL_SECONDS = float(os.environ.get('MODEL_REGISTRY_POLL_SECONDS', 5))
+MODEL_SWAP_DRAIN_SECONDS = float(os.environ.get('MODEL_SWAP_DRAIN_SECONDS', 30))
+SHADOW_MAX_PENDING = int(os.environ.get('SHADOW_MAX_PENDING', 8))
+# Bearer token for the /admin endpoints; they are disabled (404) when unset
+ADMIN_TOKEN = os.environ.get('ADMIN_TOKEN')
+
+# --- Inference Mode ---
+# 'deterministic' (default): dropout disabled, compiled fixed-signature forward pass.
+# 'mc': the original behaviour, with dropout active on every prediction.
+# Either way, /predict?uncertainty=1 returns the mean and variance of MC_SAMPLES dropout passes.
+INFERENCE_MODE = os.environ.get('INFERENCE_MODE', 'deterministic')
+MC_SAMPLES = int(os.environ.get('MC_SAMPLES', 8))
+
+# --- Prediction Output ---
+# CALIBRATION_PATH: temperature and per-crop "Unknown" thresholds (see inference.Calibration);
+# without the file, probabilities are reported as-is and the threshold is 0.4 for every crop.
+# /predict?top_k=N adds the N most probable classes (at most TOP_K_MAX) from the same forward pass.
+CALIBRATION_PATH = os.environ.get('CALIBRATION_PATH', 'calibration.json')
+TOP_K_MAX = int(os.environ.get('TOP_K_MAX', 5))
+
+# --- Image Pre-checks ---
+# Brightness/contrast and green-ratio checks run on a view whose longer side is at most
+# PRECHECK_MAX_SIDE pixels (0 = full resolution, identical to the original checks).
+PRECHECK_MIN_BRIGHTNESS = float(os.environ.get('PRECHECK_MIN_BRIGHTNESS', 20))
+PRECHECK_MIN_CONTRAST = float(os.environ.get('PRECHECK_MIN_CONTRAST', 10))
+PRECHECK_MIN_GREEN_RATIO = float(os.environ.get('PRECHECK_MIN_GREEN_RATIO', 0.05))
+PRECHECK_MAX_SIDE = int(os.environ.get('PRECHECK_MAX_SIDE', 512))
+
+# --- Inference Batching ---
+# Concurrent /predict requests are grouped into one forward pass of at most
+# BATCH_MAX_SIZE images, waiting no longer than BATCH_MAX_WAIT_MS for the batch to fill.
+BATCH_MAX_SIZE = int(os.environ.get('BATCH_MAX_SIZE', 16))
+BATCH_MAX_WAIT_MS = float(os.environ.get('BATCH_MAX_WAIT_MS', 5))
+
+# --- Side Effects (Firebase writes, Telegram alerts) ---
+# These run on background workers so /predict returns as soon as the answer is ready.
+# Set SIDE_EFFECT_SINKS=stub to replace both sinks with local in-process stubs.
+SIDE_EFFECT_SINKS = os.environ.get('SIDE_EFFECT_SINKS', 'live')
+SIDE_EFFECT_QUEUE_SIZE = int(os.environ.get('SIDE_EFFECT_QUEUE_SIZE', 1000))
+SIDE_EFFECT_WORKERS = int(os.environ.get('SIDE_EFFECT_WORKERS', 2))
+SIDE_EFFECT_MAX_RETRIES = int(os.environ.get('SIDE_EFFECT_MAX_RETRIES', 3))
+DEAD_LETTER_PATH = os.environ.get('DEAD_LETTER_PATH', 'dead_letter.jsonl')
+
+# --- Firebase Write-Behind ---
+# Prediction and batch-job records are appended to a local SQLite outbox (no network call in
+# the request) and written to the Realtime Database as one multi-location update per batch,
+# once FIREBASE_FLUSH_SIZE records are waiting or every FIREBASE_FLUSH_INTERVAL_SECONDS.
+# Unsent records survive a restart and are replayed. A record the database keeps rejecting on its
+# own (FIREBASE_OUTBOX_MAX_ATTEMPTS times) moves to the outbox's dead_letter table.
+# FIREBASE_WRITE_BEHIND=0 restores one push per record through the side-effect workers.
+FIREBASE_WRITE_BEHIND = os.environ.get('FIREBASE_WRITE_BEHIND', '1') == '1'
+FIREBASE_OUTBOX_PATH = os.environ.get('FIREBASE_OUTBOX_PATH', 'firebase_outbox.sqlite3')
+FIREBASE_FLUSH_SIZE = int(os.environ.get('FIREBASE_FLUSH_SIZE', 200))
+FIREBASE_FLUSH_INTERVAL_SECONDS = float(os.environ.get('FIREBASE_FLUSH_INTERVAL_SECONDS', 2))
+FIREBASE_FLUSH_MAX_BATCH = int(os.environ.get('FIREBASE_FLUSH_MAX_BATCH', 500))
+FIREBASE_OUTBOX_MAX_ATTEMPTS = int(os.environ.get('FIREBASE_OUTBOX_MAX_ATTEMPTS', 10))
+
+# --- Prediction Analytics (/stats) ---
+# Each prediction (class, confidence, language, time) is appended to a local log shared by all
+# workers and rolled up per hour and per day, so /stats answers from in-memory arrays. With
+# ANALYTICS_FIREBASE_SYNC_SECONDS > 0 the changed rollups are written under
+# ANALYTICS_FIREBASE_PATH at that interval; FIREBASE_RAW_PREDICTIONS=0 then stops pushing one
+# Firebase record per prediction (dashboards read the rollups instead).
+ANALYTICS_ENABLED = os.environ.get('ANALYTICS_ENABLED', '1') == '1'
+ANALYTICS_PATH = os.environ.get('ANALYTICS_PATH', 'analytics.log')
+ANALYTICS_SNAPSHOT_SECONDS = float(os.environ.get('ANALYTICS_SNAPSHOT_SECONDS', 300))
+ANALYTICS_FIREBASE_SYNC_SECONDS = float(os.environ.get('ANALYTICS_FIREBASE_SYNC_SECONDS', 0))
+ANALYTICS_FIREBASE_PATH = os.environ.get('ANALYTICS_FIREBASE_PATH', '/prediction_rollups')
+FIREBASE_RAW_PREDICTIONS = os.environ.get('FIREBASE_RAW_PREDICTIONS', '1') == '1'
+
+# --- Telegram Alerts ---
+# Healthy results (ALERT_SUPPRESS_HEALTHY), results under ALERT_MIN_CONFIDENCE and repeats of
+# the same image within ALERT_DEDUPE_WINDOW_SECONDS raise no alert. ALERT_MODE=digest (default)
+# sends one album of thumbnails per predicted class every ALERT_DIGEST_INTERVAL_SECONDS;
+# ALERT_MODE=instant sends each alert at once as a thumbnail. Every Bot API call shares one
+# pooled session and a token bucket of TELEGRAM_RATE_PER_SECOND (bursts of TELEGRAM_BURST).
+ALERT_MODE = os.environ.get('ALERT_MODE', 'digest')
+ALERT_DIGEST_INTERVAL_SECONDS = float(os.environ.get('ALERT_DIGEST_INTERVAL_SECONDS', 300))
+ALERT_DIGEST_MAX_PHOTOS = int(os.environ.get('ALERT_DIGEST_MAX_PHOTOS', 10))
+ALERT_THUMBNAIL_SIDE = int(os.environ.get('ALERT_THUMBNAIL_SIDE', 320))
+ALERT_SUPPRESS_HEALTHY = os.environ.get('ALERT_SUPPRESS_HEALTHY', '1') == '1'
+ALERT_MIN_CONFIDENCE = float(os.environ.get('ALERT_MIN_CONFIDENCE', 0))
+ALERT_DEDUPE_WINDOW_SECONDS = float(os.environ.get('ALERT_DEDUPE_WINDOW_SECONDS', 300))
+TELEGRAM_RATE_PER_SECOND = float(os.environ.get('TELEGRAM_RATE_PER_SECOND', 1))
+TELEGRAM_BURST = int(os.environ.get('TELEGRAM_BURST', 3))
+
+# --- Translation Store ---
+# Translated recommendation fields are cached on disk per (class, field, language).
+# Pre-fill it with `flask --app app build-translations`; misses are translated live and stored.
+TRANSLATION_STORE_PATH = os.environ.get('TRANSLATION_STORE_PATH', 'translations.sqlite3')
+TRANSLATION_LRU_SIZE = int(os.environ.get('TRANSLATION_LRU_SIZE', 1024))
+# TRANSLATOR_BACKEND=stub replaces googletrans with an offline stub (benchmarks, local runs);
+# point TRANSLATION_STORE_PATH elsewhere so stub translations never reach the real store.
+TRANSLATOR_BACKEND = os.environ.get('TRANSLATOR_BACKEND', 'googletrans')
+TRANSLATOR_STUB_LATENCY_MS = float(os.environ.get('TRANSLATOR_STUB_LATENCY_MS', 0))
+
+# --- Result Cache ---
+# Repeated uploads of the same image (a field unit resending an unchanged frame, or a photo
+# re-uploaded in another language) reuse the cached prediction instead of running inference.
+# RESULT_CACHE_SIZE=0 disables it. With RESULT_CACHE_MAX_DISTANCE > 0, near-duplicates whose
+# perceptual hash differs by at most that many bits (of 64) also hit. A cached result only
+# re-sends its Telegram alert once RESULT_CACHE_ALERT_WINDOW_SECONDS have passed.
+RESULT_CACHE_SIZE = int(os.environ.get('RESULT_CACHE_SIZE', 2048))
+RESULT_CACHE_TTL_SECONDS = float(os.environ.get('RESULT_CACHE_TTL_SECONDS', 600))
+RESULT_CACHE_MAX_DISTANCE = int(os.environ.get('RESULT_CACHE_MAX_DISTANCE', 0))
+RESULT_CACHE_ALERT_WINDOW_SECONDS = float(os.environ.get('RESULT_CACHE_ALERT_WINDOW_SECONDS', 300))
+
+# --- Upload Ingestion (/predict) ---
+# STREAMING_INGEST=1 reads the body in chunks and base64-decodes it into one preallocated
+# buffer (STREAMING_INGEST=0 keeps the original whole-body path, for comparison). Uploads over
+# PREDICT_MAX_UPLOAD_BYTES are refused with 413 before the body is read. JPEGs at least twice
+# INGEST_DRAFT_MIN_SIDE pixels are decoded at reduced size (0 = always decode at full size).
+# INGEST_TRACE_MEMORY=1 records per-request peak allocations under /diagnostics (tracemalloc
+# slows everything down; use it with a single client to compare the two paths).
+STREAMING_INGEST = os.environ.get('STREAMING_INGEST', '1') == '1'
+PREDICT_MAX_UPLOAD_BYTES = int(os.environ.get('PREDICT_MAX_UPLOAD_BYTES', 16 * 1024 * 1024))
+INGEST_DRAFT_MIN_SIDE = int(os.environ.get('INGEST_DRAFT_MIN_SIDE', 512))
+if os.environ.get('INGEST_TRACE_MEMORY', '0') == '1':
+    tracemalloc.start()
+
+# --- Response Rendering ---
+# The /predict body and Telegram caption are pre-rendered per (class, language); a request only
+# splices in its confidence. RESPONSE_JSON_ENCODER: 'auto' (orjson when installed), 'orjson', 'json'.
+RESPONSE_JSON_ENCODER = os.environ.get('RESPONSE_JSON_ENCODER', 'auto')
+
+# --- Metrics & Tracing ---
+# /metrics serves per-stage latency histograms and prediction/error counters (Prometheus text
+# format). Requests slower than SLOW_REQUEST_MS (0 = off) are logged as one JSON line with their
+# per-stage breakdown, for a SLOW_REQUEST_SAMPLE_RATE fraction of them, to stdout or
+# SLOW_REQUEST_LOG_PATH. The trace ID is taken from X-Request-ID (or generated) and echoed back.
+SLOW_REQUEST_MS = float(os.environ.get('SLOW_REQUEST_MS', 0))
+SLOW_REQUEST_SAMPLE_RATE = float(os.environ.get('SLOW_REQUEST_SAMPLE_RATE', 1.0))
+SLOW_REQUEST_LOG_PATH = os.environ.get('SLOW_REQUEST_LOG_PATH') or None
+
+# --- Batch Prediction (/predict/batch) ---
+# Images are decoded and scored BATCH_PREDICT_CHUNK_SIZE at a time, so memory stays
+# bounded however many images a survey upload contains.
+BATCH_PREDICT_CHUNK_SIZE = int(os.environ.get('BATCH_PREDICT_CHUNK_SIZE', 16))
+BATCH_PREDICT_DECODE_WORKERS = int(os.environ.get('BATCH_PREDICT_DECODE_WORKERS', 4))
+BATCH_PREDICT_MAX_IMAGE_BYTES = int(os.environ.get('BATCH_PREDICT_MAX_IMAGE_BYTES', 20 * 1024 * 1024))
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.bmp', '.webp')
 
 # --- Global Language/Text Mapping ---
 # Dictionary for language display names
@@ -47,83 +252,241 @@ LANGUAGE_MAP = {
 
 # Dictionary for multilingual UI text 
 UI_TEXT_MAP = {
-    'Overview': { 'en': 'Overview', 'ig': 'Nleleanya' },
-    'Treatment': { 'en': 'Treatment', 'ig': 'Ọgwụgwọ' },
-    'Prevention': { 'en': 'Prevention', 'ig': 'Mgbochi' },
+    'Overview': { 'en': 'Overview', 'ig': 'Nleleanya', 'ha': 'Bayani', 'yo': 'Àkópọ̀', 'fr': 'Aperçu',
+                  'es': 'Resumen', 'sw': 'Muhtasari', 'de': 'Überblick' },
+    'Treatment': { 'en': 'Treatment', 'ig': 'Ọgwụgwọ', 'ha': 'Magani', 'yo': 'Ìtọ́jú', 'fr': 'Traitement',
+                   'es': 'Tratamiento', 'sw': 'Matibabu', 'de': 'Behandlung' },
+    'Prevention': { 'en': 'Prevention', 'ig': 'Mgbochi', 'ha': 'Rigakafi', 'yo': 'Ìdènà', 'fr': 'Prévention',
+                    'es': 'Prevención', 'sw': 'Kinga', 'de': 'Vorbeugung' },
 }
 
-# Global variables to store the loaded model and class names
-model = None
+# Global variables to store the class names and shared resources (the models live in model_registry)
+preloaded_model_content = None
 class_names = None
+calibration = None
 recommendations_db = None
-translator = Translator()
+translation_store = None
+prediction_analytics = None
+translator = StubTranslator(TRANSLATOR_STUB_LATENCY_MS / 1000.0) if TRANSLATOR_BACKEND == 'stub' else Translator()
+
+class ResourceLoadError(Exception):
+    pass
+
+# --- Resource Lifecycle ---
+# 1. load_shared_resources(): fork-safe data (class names, recommendations, translation store,
+#    and a TFLite artifact's bytes). Runs at import, i.e. once in the gunicorn master with
+#    preload_app, so workers share these pages copy-on-write.
+# 2. init_worker(): per-process handles that must not cross a fork (TensorFlow/interpreter,
+#    Firebase app, batcher thread), then a warm-up inference. Started after fork by the
+#    gunicorn.conf.py hook, or on the first request under `flask run`.
+def load_shared_resources():
+    global class_names, calibration, recommendations_db, translation_store, preloaded_model_content, prediction_analytics
+    print("Loading shared resources...")
+    try:
+        class_names = load_class_names(CLASS_INDICES_PATH)
+        print("Class names loaded successfully.")
+    except FileNotFoundError:
+        raise ResourceLoadError(f"{CLASS_INDICES_PATH} not found.")
+
+    try:
+        calibration = Calibration.load(CALIBRATION_PATH)
+    except ValueError as e:
+        raise ResourceLoadError(f"Error loading {CALIBRATION_PATH}: {e}")
+    if calibration.source:
+        print(f"Calibration loaded (temperature {calibration.temperature:g}, "
+              f"{len(calibration.crop_thresholds)} crop thresholds).")
+
+    try:
+        recommendations_db = RecommendationsStore(
+            RECOMMENDATIONS_PATH, class_names,
+            compiled_path=RECOMMENDATIONS_COMPILED_PATH,
+            check_interval=RECOMMENDATIONS_RELOAD_INTERVAL_SECONDS
+        )
+        missing = len(recommendations_db.report["missing"])
+        print(f"Recommendations loaded successfully ({len(class_names) - missing}/{len(class_names)} classes covered).")
+    except FileNotFoundError:
+        raise ResourceLoadError(f"{RECOMMENDATIONS_PATH} not found.")
+    except ValueError as e:
+        raise ResourceLoadError(f"Error loading {RECOMMENDATIONS_PATH}: {e}")
+    recommendations_db.on_reload.append(on_recommendations_reload)
 
-# --- Custom Keras Objects (Crucial for loading your model) ---
-class F1Score(tf.keras.metrics.Metric):
-    def __init__(self, name="f1_score", **kwargs):
-        super(F1Score, self).__init__(name=name, **kwargs)
-        self.precision = tf.keras.metrics.Precision()
-        self.recall = tf.keras.metrics.Recall()
+    translation_store = TranslationStore(TRANSLATION_STORE_PATH, lru_size=TRANSLATION_LRU_SIZE)
+    stale = translation_store.prune(recommendations_db)
+    print(f"Translation store opened ({stale} stale entries removed).")
+    built = response_templates.precompute(recommendations_db.items(), translation_store.has_translations)
+    print(f"Response templates pre-rendered for {built} (class, language) pairs.")
 
-    def update_state(self, y_true, y_pred, sample_weight=None):
-        self.precision.update_state(y_true, y_pred, sample_weight)
-        self.recall.update_state(y_true, y_pred, sample_weight)
+    if ANALYTICS_ENABLED:
+        prediction_analytics = PredictionAnalytics(
+            ANALYTICS_PATH, class_names,
+            snapshot_interval=ANALYTICS_SNAPSHOT_SECONDS,
+            sync_fn=sync_rollups_to_firebase,
+            sync_interval=ANALYTICS_FIREBASE_SYNC_SECONDS,
+            languages=LANGUAGE_MAP.keys()
+        )
+        print(f"Prediction analytics loaded ({prediction_analytics.stats()['records']} predictions).")
 
-    def result(self):
-        precision = self.precision.result()
-        recall = self.recall.result()
-        return 2 * (precision * recall) / (precision + recall + tf.keras.backend.epsilon())
+    preloaded_model_content = preload_model_content(MODEL_RUNTIME, MODEL_ARTIFACT_PATH)
+    if preloaded_model_content is not None:
+        print(f"TFLite artifact preloaded ({len(preloaded_model_content) / 1e6:.1f} MB, shared by workers).")
 
-    def reset_state(self):
-        self.precision.reset_state()
-        self.recall.reset_state()
+def resident_recommendation_stores():
+    """The startup recommendations plus the per-version stores of the active and shadow models."""
+    stores = [recommendations_db]
+    for bundle in (model_registry.active, model_registry.shadow):
+        if bundle is not None and all(bundle.recommendations is not s for s in stores):
+            stores.append(bundle.recommendations)
+    return stores
 
-class FixedDropout(tf.keras.layers.Dropout):
-    def call(self, inputs, training=None):
-        return super().call(inputs, training=True)
+def on_recommendations_reload(store):
+    # Cached results and templates embed the old recommendations; translations of edited fields are stale.
+    # Resident versions can have different class sets, so prune against all of them, not just `store`.
+    result_cache.clear()
+    response_templates.clear()
+    if translation_store is not None:
+        translation_store.prune(*resident_recommendation_stores())
+
+def load_model_bundle(version, directory):
+    """Loads one model version with its batcher and runs a warm-up inference (ModelRegistry load_fn).
+
+    `directory` is None for the default version: MODEL_PATH / MODEL_RUNTIME and the class names
+    loaded at startup. A version whose classes differ gets its own recommendations index.
+    """
+    started = time.perf_counter()
+    if directory is None:
+        names, bundle_calibration = class_names, calibration
+        loaded_model, runtime = load_inference_model(
+            MODEL_RUNTIME, MODEL_PATH, artifact_path=MODEL_ARTIFACT_PATH,
+            num_threads=TFLITE_NUM_THREADS, model_content=preloaded_model_content,
+            intra_op_threads=TF_INTRA_OP_THREADS, inter_op_threads=TF_INTER_OP_THREADS
+        )
+    else:
+        paths = bundle_paths(directory)
+        names = load_class_names(paths["class_indices_path"])
+        bundle_calibration = Calibration.load(paths["calibration_path"]) if paths["calibration_path"] else calibration
+        loaded_model, runtime = load_inference_model(
+            paths["runtime"], paths["keras_model_path"], artifact_path=paths["artifact_path"],
+            num_threads=TFLITE_NUM_THREADS,
+            intra_op_threads=TF_INTRA_OP_THREADS, inter_op_threads=TF_INTER_OP_THREADS
+        )
+    if names == class_names:
+        recommendations = recommendations_db
+    else:
+        recommendations = RecommendationsStore(
+            RECOMMENDATIONS_PATH, names,
+            compiled_path=f"{os.path.splitext(RECOMMENDATIONS_COMPILED_PATH)[0]}-{version}.bin",
+            check_interval=RECOMMENDATIONS_RELOAD_INTERVAL_SECONDS
+        )
+        recommendations.on_reload.append(on_recommendations_reload)
+    print(f"Model {version} loaded ({runtime} runtime, {INFERENCE_MODE} inference, "
+          f"{time.perf_counter() - started:.2f}s).")
+
+    stochastic = INFERENCE_MODE == 'mc' and loaded_model.supports_uncertainty
+    if INFERENCE_MODE == 'mc' and not stochastic:
+        print(f"WARNING: INFERENCE_MODE=mc is not available with the {runtime} runtime; using deterministic inference.")
+    predict_fn = loaded_model.predict_stochastic if stochastic else loaded_model.predict
+    batcher = MicroBatcher(
+        metrics.timed('model_predict', predict_fn),
+        max_batch_size=BATCH_MAX_SIZE,
+        max_wait_ms=BATCH_MAX_WAIT_MS,
+        name=f'inference-{version}'
+    ).start()
+
+    # Warm-up: the first call builds the graph/allocates tensors, so no real request pays for it
+    warm_up_input = np.full((1, IMG_HEIGHT, IMG_WIDTH, 3), 0.5, dtype=np.float32)
+    batcher.predict(warm_up_input)
+    return ModelBundle(version, loaded_model, runtime, names, bundle_calibration, recommendations, batcher,
+                       time.perf_counter() - started)
+
+def on_model_swap(bundle):
+    # Cached results came from the previous model
+    result_cache.clear()
+
+model_registry = ModelRegistry(
+    MODEL_REGISTRY_DIR, load_model_bundle,
+    poll_interval=MODEL_REGISTRY_POLL_SECONDS,
+    drain_timeout=MODEL_SWAP_DRAIN_SECONDS,
+    max_shadow_pending=SHADOW_MAX_PENDING
+)
+model_registry.on_swap.append(on_model_swap)
+
+def init_worker(lifecycle):
+    """Loads this process's model versions, batchers and Firebase handles (models are warmed up on load)."""
+    if class_names is None:
+        load_shared_resources()
+
+    with lifecycle.step('model_load'):
+        try:
+            model_registry.start()
+        except Exception as e:
+            raise ResourceLoadError(f"Error loading model: {e}")
+    print(f"Inference batcher started (max batch {BATCH_MAX_SIZE}, max wait {BATCH_MAX_WAIT_MS} ms).")
+
+    # Initialize Firebase Admin SDK (not needed when the sinks are stubbed out)
+    if SIDE_EFFECT_SINKS == 'stub':
+        print("Side-effect sinks are stubbed; skipping Firebase Admin SDK initialization.")
+    elif not firebase_admin._apps:
+        with lifecycle.step('firebase_init'):
+            try:
+                cred = credentials.Certificate(FIREBASE_SERVICE_ACCOUNT_KEY)
+                firebase_admin.initialize_app(cred, {
+                    'databaseURL': FIREBASE_DATABASE_URL
+                })
+                print("Firebase Admin SDK initialized successfully.")
+            except Exception as e:
+                raise ResourceLoadError(f"Error initializing Firebase Admin SDK: {e}")
+    if firebase_outbox is not None:
+        firebase_outbox.start()
+    if prediction_analytics is not None:
+        prediction_analytics.start()
 
-# --- Load Model, Class Names, and Recommendations on startup ---
 def load_resources():
-    global model, class_names, recommendations_db
-    print("Loading model and resources...")
-    try:
-        model = load_model(MODEL_PATH, custom_objects={
-            'F1Score': F1Score,
-            'swish': tf.keras.activations.swish,
-            'FixedDropout': FixedDropout
-        })
-        print("Model loaded successfully.")
-    except Exception as e:
-        print(f"Error loading model: {e}")
-        exit(1)
+    """Loads everything synchronously in this process (scripts and the Flask CLI)."""
+    if class_names is None:
+        load_shared_resources()
+    worker_lifecycle.start(background=False)
+    if not worker_lifecycle.is_ready():
+        raise ResourceLoadError(worker_lifecycle.error)
 
-    try:
-        with open(CLASS_INDICES_PATH, 'r') as f:
-            loaded_indices = json.load(f)
-            class_names = {int(k): v for k, v in loaded_indices.items()}
-        print("Class names loaded successfully.")
-    except FileNotFoundError:
-        print(f"Error: {CLASS_INDICES_PATH} not found.")
-        exit(1)
+worker_lifecycle = WorkerLifecycle(init_worker)
 
-    try:
-        with open(RECOMMENDATIONS_PATH, 'r') as f:
-            recommendations_db = json.load(f)
-        print("Recommendations loaded successfully.")
-    except FileNotFoundError:
-        print(f"Error: {RECOMMENDATIONS_PATH} not found.")
-        exit(1)
+@app.before_request
+def ensure_worker_started():
+    # No-op once this worker is initializing or ready; covers `flask run` and a failed init retry
+    worker_lifecycle.start(background=True)
 
-    # Initialize Firebase Admin SDK
-    try:
-        cred = credentials.Certificate(FIREBASE_SERVICE_ACCOUNT_KEY)
-        firebase_admin.initialize_app(cred, {
-            'databaseURL': FIREBASE_DATABASE_URL
-        })
-        print("Firebase Admin SDK initialized successfully.")
-    except Exception as e:
-        print(f"Error initializing Firebase Admin SDK: {e}")
-        exit(1)
+def require_ready():
+    """Returns a 503 response while this worker is still loading (or failed to load), else None."""
+    if worker_lifecycle.is_ready() or worker_lifecycle.wait_ready(READY_WAIT_SECONDS):
+        return None
+    metrics.ERRORS.inc('not_ready')
+    response = jsonify({
+        "error": "The prediction service is starting up. Please retry shortly.",
+        "phase": worker_lifecycle.phase
+    })
+    response.headers['Retry-After'] = '5'
+    return response, 503
+
+slow_request_log = metrics.SlowRequestLog(SLOW_REQUEST_MS, SLOW_REQUEST_SAMPLE_RATE, SLOW_REQUEST_LOG_PATH)
+
+@app.before_request
+def begin_request_trace():
+    g.trace = metrics.begin_trace(request.headers.get('X-Request-ID'))
+
+@app.after_request
+def finish_request_trace(response):
+    trace = getattr(g, 'trace', None)
+    if trace is not None:
+        endpoint = request.url_rule.rule if request.url_rule is not None else 'unmatched'
+        metrics.finish_trace(trace, endpoint, response.status_code, slow_request_log)
+        response.headers['X-Request-ID'] = trace.trace_id
+    return response
+
+def error_response(message, status, error_type):
+    """JSON error body, counted in agrosense_errors_total{type=error_type}."""
+    metrics.ERRORS.inc(error_type)
+    metrics.annotate(error_type=error_type)
+    return jsonify({"error": message}), status
 
 # --- Translation Function (Enhanced for multilingual text) ---
 def get_translated_ui_text(key, lang_code, text_map):
@@ -159,225 +522,889 @@ def translate_text(text, dest_language='en'):
         print(f"Error during translation to {dest_language}: {e}. Returning original text.")
         return text 
 
-# --- Image Pre-check Functions (Remain the same) ---
-def is_low_quality_image(pil_image):
-    try:
-        img_gray = pil_image.convert("L")
-        stat = ImageStat.Stat(img_gray)
-        mean_brightness = stat.mean[0]
-        stddev = stat.stddev[0]
-        return mean_brightness < 20 or stddev < 10
-    except Exception as e:
-        print(f"Error checking image quality: {e}")
-        return True
+def translate_live(text, dest_language):
+    """Single live translation call used on translation-store misses. Raises on failure."""
+    return translator.translate(text, dest=dest_language, src='en').text
+
+def translate_recommendations(class_name, recommendations, dest_language):
+    """Translates a recommendations entry, served from the translation store whenever possible."""
+    if translation_store is None:
+        return {
+            "overview": translate_text(recommendations["overview"], dest_language),
+            "treatment": translate_text(recommendations["treatment"], dest_language),
+            "prevention": translate_text(recommendations["prevention"], dest_language)
+        }
+    return translation_store.translate_recommendations(class_name, recommendations, dest_language, translate_live)
+
+def build_prediction_template(class_name, recommendations, lang):
+    """Translated recommendations and caption parts for one (class, language), for ResponseTemplates."""
+    translated_recommendations = translate_recommendations(class_name, recommendations, lang)
+    complete = translation_store is not None and translation_store.has_translations(class_name, recommendations, lang)
+    translated_recommendations['language'] = lang # Log code for dashboard
+    translated_recommendations['language_name'] = LANGUAGE_MAP.get(lang, lang.upper()) # Log full name
+    caption_parts = telegram_message_parts(class_name, translated_recommendations, lang)
+    return translated_recommendations, caption_parts, complete
+
+response_templates = ResponseTemplates(build_prediction_template, LANGUAGE_MAP.keys(), encoder=RESPONSE_JSON_ENCODER)
+
+# --- Shared Prediction Helpers (used by /predict and /predict/batch) ---
+def language_label(lang):
+    """`lang` as a metric label: a LANGUAGE_MAP code, or 'other', so arbitrary ?lang= values add no series."""
+    return lang if lang in LANGUAGE_MAP else 'other'
+
+def record_analytics(predicted_class_name, confidence, dest_lang):
+    """Appends the prediction to the analytics log; a failed write never fails the request."""
+    if prediction_analytics is None:
+        return
+    with stage('analytics'):
+        try:
+            prediction_analytics.record(predicted_class_name, confidence, dest_lang)
+        except Exception as e:
+            print(f"Error writing to the analytics log: {e}")
+
+image_pipeline = ImagePipeline(
+    size=(IMG_WIDTH, IMG_HEIGHT),
+    min_brightness=PRECHECK_MIN_BRIGHTNESS,
+    min_contrast=PRECHECK_MIN_CONTRAST,
+    min_green_ratio=PRECHECK_MIN_GREEN_RATIO,
+    check_max_side=PRECHECK_MAX_SIDE
+)
 
-def is_leaf_detected(pil_image):
+DEFAULT_RECOMMENDATIONS = {
+    "overview": "Information not available.",
+    "treatment": ["No specific treatment found."],
+    "prevention": ["No specific prevention methods found."]
+}
+
+result_cache = ResultCache(
+    max_entries=RESULT_CACHE_SIZE,
+    ttl_seconds=RESULT_CACHE_TTL_SECONDS,
+    max_distance=RESULT_CACHE_MAX_DISTANCE
+)
+
+def interpret_prediction(prediction, bundle):
+    """Maps one row of `bundle`'s model output to (class name, confidence, English recommendations, top classes).
+
+    Probabilities are calibrated first. The top classes are the TOP_K_MAX most probable
+    {"class", "confidence"} pairs, kept (and cached) so ?top_k= never needs another pass.
+    """
+    indices, probabilities = top_k(bundle.calibration.apply(prediction), TOP_K_MAX)
+    top_classes = [{"class": bundle.class_names.get(int(i), "Unknown"), "confidence": float(p)}
+                   for i, p in zip(indices[0], probabilities[0])]
+    predicted_class_index = int(indices[0][0])
+    predicted_class_name, confidence = top_classes[0]["class"], top_classes[0]["confidence"]
+
+    recommendations = bundle.recommendations.by_id(predicted_class_index, DEFAULT_RECOMMENDATIONS)
+
+    # Check the crop's confidence threshold for "Unknown"
+    if bundle.calibration.is_unknown(predicted_class_name, confidence):
+        predicted_class_name = "Unknown"
+        recommendations = bundle.recommendations.get("Unknown", recommendations)
+    return predicted_class_name, confidence, recommendations, top_classes
+
+def requested_top_k(value):
+    """?top_k= as a number of classes between 0 (none) and TOP_K_MAX."""
     try:
-        cv_image = np.array(pil_image)
-        cv_image = cv2.cvtColor(cv_image, cv2.COLOR_RGB2BGR)
-        hsv = cv2.cvtColor(cv_image, cv2.COLOR_BGR2HSV)
-        lower_green = np.array([20, 20, 20])
-        upper_green = np.array([90, 255, 255])
-        mask = cv2.inRange(hsv, lower_green, upper_green)
-        green_pixel_count = np.sum(mask > 0)
-        total_pixels = mask.shape[0] * mask.shape[1]
-        green_ratio = green_pixel_count / total_pixels
-        return green_ratio > 0.05
-    except Exception as e:
-        print(f"Error during leaf detection: {e}")
-        return False
+        return min(max(int(value or 0), 0), TOP_K_MAX)
+    except ValueError:
+        return 0
 
 # --- Telegram Helper Functions ---
 
+# Marks where the confidence goes, so the rest of a message can be formatted ahead of time
+CONFIDENCE_SLOT = '\x00confidence\x00'
+
+def escape_html(text):
+    """Class names and (translated) recommendations are plain text inside an HTML message."""
+    return html.escape(str(text), quote=False)
+
 def create_telegram_message(predicted_class, confidence, translated_recommendations, lang_code):
     """Formats the prediction and recommendations into a structured Telegram message."""
+    head, tail = telegram_message_parts(predicted_class, translated_recommendations, lang_code)
+    return f"{head}{confidence*100:.2f}{tail}"
+
+def telegram_message_parts(predicted_class, translated_recommendations, lang_code):
+    """The Telegram message without its confidence value, as (text before it, text after it)."""
     
     # Get translated UI strings with English in brackets
-    overview_text_ui = get_translated_ui_text('Overview', lang_code, UI_TEXT_MAP)
-    treatment_text_ui = get_translated_ui_text('Treatment', lang_code, UI_TEXT_MAP)
-    prevention_text_ui = get_translated_ui_text('Prevention', lang_code, UI_TEXT_MAP)
+    overview_text_ui = escape_html(get_translated_ui_text('Overview', lang_code, UI_TEXT_MAP))
+    treatment_text_ui = escape_html(get_translated_ui_text('Treatment', lang_code, UI_TEXT_MAP))
+    prevention_text_ui = escape_html(get_translated_ui_text('Prevention', lang_code, UI_TEXT_MAP))
 
     # Format treatment and prevention lists
-    treatment_list = "\n".join([f" • {item}" for item in translated_recommendations['treatment']])
-    prevention_list = "\n".join([f" • {item}" for item in translated_recommendations['prevention']])
+    treatment_list = "\n".join([f" • {escape_html(item)}" for item in translated_recommendations['treatment']])
+    prevention_list = "\n".join([f" • {escape_html(item)}" for item in translated_recommendations['prevention']])
     
     # Use HTML for formatting in Telegram
     message = f"""
 🌱 <b>New Plant Health Scan Alert!</b>
 ────────────────────
-🚨 <b>Disease:</b> <code>{predicted_class}</code>
-📊 <b>Confidence:</b> <b>{confidence*100:.2f}%</b>
-🌐 <b>Translated to:</b> <i>{LANGUAGE_MAP.get(lang_code, 'N/A')}</i>
+🚨 <b>Disease:</b> <code>{escape_html(predicted_class)}</code>
+📊 <b>Confidence:</b> <b>{CONFIDENCE_SLOT}%</b>
+🌐 <b>Translated to:</b> <i>{escape_html(LANGUAGE_MAP.get(lang_code, 'N/A'))}</i>
 ────────────────────
 
 📋 <b>{overview_text_ui}</b>
-{translated_recommendations['overview']}
+{escape_html(translated_recommendations['overview'])}
 
 💊 <b>{treatment_text_ui}</b> (Action Required)
 {treatment_list}
 
 🛡️ <b>{prevention_text_ui}</b> (Long-term Strategy)
 {prevention_list}
+"""
+    head, tail = message.strip().split(CONFIDENCE_SLOT)
+    return head, tail
+
+def send_telegram_message(message):
+    """Sends a text-only HTML message (used for per-job batch summaries)."""
+    if not telegram_client.configured:
+        print("WARNING: Telegram bot token not set. Skipping Telegram notification.")
+        return True
+    try:
+        telegram_client.send_message(message)
+        print("✅ Telegram summary sent.")
+        return True
+    except TelegramError as e:
+        print(f"❌ Failed to send Telegram summary: {e}")
+        return False
+
+def create_batch_telegram_message(job_id, summary, lang_code):
+    """Formats a batch job summary (image counts per predicted class) for Telegram."""
+    class_lines = "\n".join(
+        f" • <code>{escape_html(name)}</code>: {count}"
+        for name, count in sorted(summary['classes'].items(), key=lambda item: -item[1])
+    )
+    message = f"""
+🌱 <b>Field Survey Scan Complete</b>
+────────────────────
+🆔 <b>Job:</b> <code>{escape_html(job_id)}</code>
+🖼️ <b>Images:</b> {summary['total']} ({summary['predicted']} scored, {summary['rejected']} rejected)
+🌐 <b>Language:</b> <i>{escape_html(LANGUAGE_MAP.get(lang_code, 'N/A'))}</i>
+────────────────────
+
+📊 <b>Results by class</b>
+{class_lines or ' • (none)'}
 """
     return message.strip()
 
 def send_telegram_photo(photo_data, message):
-    if TELEGRAM_BOT_TOKEN == 'YOUR_TELEGRAM_BOT_TOKEN':
+    if not telegram_client.configured:
         print("WARNING: Telegram bot token not set. Skipping Telegram notification.")
         return False
-    
-    url = f"https://api.telegram.org/bot{TELEGRAM_BOT_TOKEN}/sendPhoto"
-    
-    # We use 'caption' for the message and set parse_mode to HTML
-    data = {
-        'chat_id': TELEGRAM_CHAT_ID, 
-        'caption': message,
-        'parse_mode': 'HTML'
+    try:
+        telegram_client.send_photo(photo_data, message)
+        print("✅ Telegram notification sent.")
+        return True
+    except TelegramError as e:
+        print(f"❌ Failed to send Telegram notification: {e}")
+        return False
+
+def create_digest_caption(class_name, alerts):
+    """Caption of one digest album: how many scans of a class, their confidence and languages."""
+    confidences = [alert['confidence'] for alert in alerts]
+    languages = sorted({alert['lang'] for alert in alerts})
+    shown = min(len(alerts), ALERT_DIGEST_MAX_PHOTOS)
+    message = f"""
+🌱 <b>Plant Health Digest</b>
+────────────────────
+🚨 <b>Disease:</b> <code>{escape_html(class_name)}</code>
+🖼️ <b>Scans:</b> {len(alerts)} (showing {shown})
+📊 <b>Confidence:</b> {min(confidences)*100:.1f}–{max(confidences)*100:.1f}%
+🌐 <b>Languages:</b> <i>{escape_html(', '.join(LANGUAGE_MAP.get(lang, lang) for lang in languages))}</i>
+────────────────────
+
+📋 {escape_html(alerts[0]['recommendations']['overview'])}
+"""
+    return message.strip()
+
+def prediction_alert_caption(payload):
+    if 'caption' in payload:
+        return payload['caption']
+    return create_telegram_message(
+        payload['predicted_class'],
+        payload['confidence'],
+        payload['recommendations'],
+        payload['lang']
+    )
+
+telegram_client = TelegramClient(
+    TELEGRAM_BOT_TOKEN, TELEGRAM_CHAT_ID,
+    rate_limiter=TokenBucket(TELEGRAM_RATE_PER_SECOND, TELEGRAM_BURST)
+)
+alert_dispatcher = AlertDispatcher(
+    telegram_client, prediction_alert_caption, create_digest_caption,
+    mode=ALERT_MODE,
+    digest_interval=ALERT_DIGEST_INTERVAL_SECONDS,
+    max_photos=ALERT_DIGEST_MAX_PHOTOS,
+    thumbnail_side=ALERT_THUMBNAIL_SIDE,
+    suppress_healthy=ALERT_SUPPRESS_HEALTHY,
+    min_confidence=ALERT_MIN_CONFIDENCE,
+    dedupe_window=ALERT_DEDUPE_WINDOW_SECONDS
+)
+
+# --- Background Side-Effect Sinks ---
+def push_prediction_to_firebase(firebase_data):
+    ref = db.reference('/predictions')
+    ref.push(firebase_data)
+    print("Data pushed to Firebase successfully.")
+
+def send_prediction_alert(payload):
+    """Sends (or adds to the next digest) a thumbnail alert. Raises on failure so the pipeline retries."""
+    alert_dispatcher.deliver(payload)
+
+def push_batch_job_to_firebase(job_data):
+    ref = db.reference('/prediction_jobs')
+    ref.push(job_data)
+    print("Batch job pushed to Firebase successfully.")
+
+def send_batch_summary_alert(message):
+    if not send_telegram_message(message):
+        raise RuntimeError("Telegram summary was not delivered.")
+
+side_effects = SideEffectPipeline(
+    max_queue_size=SIDE_EFFECT_QUEUE_SIZE,
+    workers=SIDE_EFFECT_WORKERS,
+    max_retries=SIDE_EFFECT_MAX_RETRIES,
+    dead_letter_path=DEAD_LETTER_PATH
+)
+# Stage name each sink's calls are timed under in /metrics
+SINK_STAGES = {
+    'firebase': 'firebase_push',
+    'telegram': 'telegram_send',
+    'firebase_job': 'firebase_job_push',
+    'telegram_summary': 'telegram_summary_send',
+}
+if SIDE_EFFECT_SINKS == 'stub':
+    sink_handlers = {name: StubSink(name) for name in SINK_STAGES}
+else:
+    sink_handlers = {
+        'firebase': push_prediction_to_firebase,
+        'telegram': send_prediction_alert,
+        'firebase_job': push_batch_job_to_firebase,
+        'telegram_summary': send_batch_summary_alert,
     }
-    files = {'photo': photo_data}
-    
+for sink_name, handler in sink_handlers.items():
+    side_effects.register(sink_name, metrics.timed(SINK_STAGES[sink_name], handler))
+
+# Realtime Database paths of the records the write-behind outbox replaces a sink for
+OUTBOX_PATHS = {'firebase': '/predictions', 'firebase_job': '/prediction_jobs'}
+firebase_db = InMemoryDatabase() if SIDE_EFFECT_SINKS == 'stub' else db
+firebase_outbox = WriteBehindLog(
+    firebase_db,
+    path=FIREBASE_OUTBOX_PATH,
+    flush_size=FIREBASE_FLUSH_SIZE,
+    flush_interval=FIREBASE_FLUSH_INTERVAL_SECONDS,
+    max_batch=FIREBASE_FLUSH_MAX_BATCH,
+    max_attempts=FIREBASE_OUTBOX_MAX_ATTEMPTS
+) if FIREBASE_WRITE_BEHIND else None
+
+def record_to_firebase(sink, record):
+    """Stores a Firebase record in the outbox (or queues it for a direct push without write-behind)."""
+    if firebase_outbox is None:
+        return side_effects.submit(sink, record)
+    with stage('firebase_enqueue'):
+        try:
+            firebase_outbox.append(OUTBOX_PATHS[sink], record)
+        except Exception as e:
+            # The outbox is local disk; if it fails, fall back to the direct push
+            print(f"Error writing to the Firebase outbox, pushing directly: {e}")
+            return side_effects.submit(sink, record)
+    return True
+
+def sync_rollups_to_firebase(updates):
+    """Writes changed analytics rollups as one multi-location update (PredictionAnalytics sync_fn)."""
+    with stage('analytics_sync'):
+        firebase_db.reference(ANALYTICS_FIREBASE_PATH).update(updates)
+
+def shutdown_worker():
+    """Drains background work before the process exits (side effects, the alert digest, the outbox,
+    the analytics snapshot)."""
+    model_registry.stop()
+    side_effects.stop()
+    alert_dispatcher.stop()
+    if firebase_outbox is not None:
+        firebase_outbox.stop()
+    if prediction_analytics is not None:
+        prediction_analytics.stop()
+
+# --- Upload Ingestion ---
+ingest_stats = IngestStats()
+
+def read_upload_legacy():
+    """Original ingestion: whole JSON body parsed into a str, or the multipart file read() into bytes."""
+    check_content_length(request.content_length, PREDICT_MAX_UPLOAD_BYTES)
+    # Check if it's JSON from Arduino (Base64)
+    if request.is_json:
+        data = request.get_json()
+        base64_img_str = data.get('file', None)
+        if not base64_img_str:
+            return None, None, error_response("No 'file' key found in JSON payload (Base64 data missing).", 400, 'missing_file')
+
+        # Decode Base64 string to bytes
+        image_bytes = base64.b64decode(base64_img_str)
+        return BytesIO(image_bytes), image_bytes, None
+
+    if 'file' in request.files:
+        file = request.files['file']
+        if file.filename == '':
+            return None, None, error_response("No selected image file.", 400, 'missing_file')
+        image_bytes = file.read()
+        return BytesIO(image_bytes), image_bytes, None
+
+    return None, None, error_response("Unsupported Media Type or no file provided. Expected JSON (Base64), multipart/form-data or a raw image body.", 415, 'unsupported_media_type')
+
+def read_device_upload():
+    """A raw image file or camera frame as the whole request body (see device_protocol)."""
+    buffer = read_raw_body(request.stream, request.content_length, PREDICT_MAX_UPLOAD_BYTES)
     try:
-        response = requests.post(url, data=data, files=files, timeout=10)
-        if response.status_code == 200:
-            print("✅ Telegram notification sent.")
-            return True
+        image_file, image_bytes = open_device_upload(buffer, request.mimetype, request.mimetype_params, image_pipeline.size)
+    except FrameError as e:
+        return None, None, error_response(str(e), 400, 'invalid_upload')
+    return image_file, image_bytes, None
+
+def read_upload():
+    """Returns (file object for the decoder, bytes-like image data, error response or None)."""
+    if request.mimetype in RAW_IMAGE_TYPES or request.mimetype == FRAME_TYPE:
+        return read_device_upload()
+    if not STREAMING_INGEST:
+        return read_upload_legacy()
+
+    if request.is_json:
+        buffer = read_json_image(request.stream, 'file', request.content_length, PREDICT_MAX_UPLOAD_BYTES)
+        if buffer is None:
+            return None, None, error_response("No 'file' key found in JSON payload (Base64 data missing).", 400, 'missing_file')
+        return buffer, buffer.getbuffer(), None
+
+    if request.mimetype == 'multipart/form-data':
+        filename, buffer = read_multipart_image(request, 'file', PREDICT_MAX_UPLOAD_BYTES)
+        if buffer is not None:
+            if filename == '':
+                return None, None, error_response("No selected image file.", 400, 'missing_file')
+            return buffer, buffer.getbuffer(), None
+
+    return None, None, error_response("Unsupported Media Type or no file provided. Expected JSON (Base64), multipart/form-data or a raw image body.", 415, 'unsupported_media_type')
+
+# --- Prediction Steps (shared by the Flask and ASGI servers) ---
+class PredictionRejected(Exception):
+    """A user-facing reason (HTTP 400) for not scoring an upload."""
+
+    def __init__(self, message, error_type='rejected'):
+        super().__init__(message)
+        self.error_type = error_type
+
+PRECHECK_ERROR_TYPES = {LOW_QUALITY_ERROR: 'low_quality', NO_LEAF_ERROR: 'no_leaf'}
+
+def decode_upload(image_file, image_bytes, use_cache=True):
+    """Returns (cache key, cached result or None, decoded RGB image or None)."""
+    # Same image bytes seen recently: skip decoding and inference altogether
+    cache_key = content_hash(image_bytes)
+    cached = result_cache.get(cache_key) if use_cache and result_cache.enabled else None
+    if cached:
+        return cache_key, cached, None
+    with stage('decode'):
+        if isinstance(image_file, RawFrame):
+            # Already at the model's input size: no decode, and the pipeline skips the resize
+            pil_img = image_file.to_image()
         else:
-            print(f"❌ Failed to send Telegram notification. Status: {response.status_code}, Response: {response.text}")
-            return False
-    except requests.exceptions.RequestException as e:
-        print(f"❌ Failed to send Telegram notification due to network error: {e}")
-        return False
+            pil_img = open_rgb(image_file, INGEST_DRAFT_MIN_SIDE if STREAMING_INGEST else 0)
+    return cache_key, cached, pil_img
+
+def uncertainty_unavailable(bundle):
+    """Why `bundle` cannot estimate uncertainty (only the Keras runtime keeps dropout), or None."""
+    if bundle is not None and not bundle.model.supports_uncertainty:
+        return f"Uncertainty estimates are not available with the {bundle.runtime} runtime."
+    return None
+
+def score_upload(cache_key, cached, pil_img, want_uncertainty=False):
+    """Pre-checks and scores a decoded upload, unless a cached result applies.
+
+    Returns (cache key, class name, confidence, English recommendations, top classes, uncertainty or None,
+    class id). The class id is the scoring version's, as used by the compact device formats.
+    """
+    uncertainty = None
+    phash = None
+    if cached is None and result_cache.enabled and not want_uncertainty and RESULT_CACHE_MAX_DISTANCE > 0:
+        # Near-duplicate frame (re-encoded or slightly shifted): reuse that result too
+        phash = perceptual_hash(pil_img)
+        cached = result_cache.get_similar(phash)
+
+    if cached is not None:
+        cache_key, (predicted_class_name, confidence, recommendations, top_classes, class_id) = cached
+        metrics.annotate(cached=True)
+        return cache_key, predicted_class_name, confidence, recommendations, top_classes, None, class_id
+
+    # Single pass: checks on a downsampled view, model input into this thread's reusable buffer
+    precheck_error, _, img_array = image_pipeline.run(pil_img, out=image_pipeline.input_buffer())
+    if precheck_error:
+        raise PredictionRejected(precheck_error, PRECHECK_ERROR_TYPES.get(precheck_error, 'precheck'))
+
+    # The model, class names and calibration of one version, even if a swap happens meanwhile
+    with model_registry.use() as bundle:
+        if want_uncertainty:
+            # Checked again here: the version that was active when the request came in may be gone
+            unavailable = uncertainty_unavailable(bundle)
+            if unavailable:
+                raise PredictionRejected(unavailable, 'uncertainty_unavailable')
+            # MC_SAMPLES stochastic passes, run as one batched call
+            with stage('inference'):
+                mean, variance = bundle.model.predict_with_uncertainty(img_array, MC_SAMPLES)
+            prediction = mean[0]
+            top_index = int(np.argmax(prediction))
+            uncertainty = {
+                "samples": MC_SAMPLES,
+                "variance": float(variance[0][top_index]),
+                "std": float(np.sqrt(variance[0][top_index])),
+                "mean_variance": float(variance[0].mean())
+            }
+        else:
+            # Scored together with any other requests that arrive within the batching window
+            with stage('inference'):
+                started = time.perf_counter()
+                prediction = bundle.batcher.predict(img_array)
+            # A sampled share of requests is also scored by the shadow version, off the request path
+            model_registry.maybe_shadow(img_array, prediction, bundle, (time.perf_counter() - started) * 1000.0)
+        predicted_class_name, confidence, recommendations, top_classes = interpret_prediction(prediction, bundle)
+        class_id = bundle.class_ids.get(predicted_class_name)
+    if not want_uncertainty and result_cache.enabled:
+        result_cache.record_miss()
+        result_cache.put(cache_key, (predicted_class_name, confidence, recommendations, top_classes, class_id),
+                         phash=phash)
+    return cache_key, predicted_class_name, confidence, recommendations, top_classes, uncertainty, class_id
+
+def publish_prediction(cache_key, image_bytes, predicted_class_name, confidence, recommendations, uncertainty, dest_lang,
+                       top_classes=None, frame=None, response_format='json', class_id=None):
+    """Queues the Firebase write and Telegram alert, returns the response body (bytes).
+
+    The body is JSON unless `response_format` is a compact device format (see device_protocol),
+    which carries `class_id`: the id of the class in the model version that scored the image.
+    `frame` is the RawFrame the image bytes came from, if any, so the alert can rebuild the photo.
+    """
+    with stage('translation'):
+        template = response_templates.get(predicted_class_name, recommendations, dest_lang)
+    translated_recommendations = template.recommendations
+    trace = metrics.current_trace()
+    metrics.PREDICTIONS.inc(predicted_class_name, language_label(dest_lang),
+                            'cache' if trace is not None and trace.attributes.get('cached') else 'model')
+    metrics.annotate(predicted_class=predicted_class_name, lang=dest_lang)
+    record_analytics(predicted_class_name, confidence, dest_lang)
+
+    # Save to Firebase (in the background)
+    if FIREBASE_RAW_PREDICTIONS:
+        firebase_data = {
+            "timestamp": time.time(),
+            "predicted_class": predicted_class_name,
+            "confidence": confidence,
+            "recommendations": translated_recommendations
+        }
+        record_to_firebase('firebase', firebase_data)
+
+    # Send to Telegram (in the background, reusing the uploaded image bytes), unless this same
+    # image already raised an alert within the alert window or the alert rules suppress it
+    if (result_cache.should_alert(cache_key, RESULT_CACHE_ALERT_WINDOW_SECONDS)
+            and alert_dispatcher.accepts(cache_key, predicted_class_name, confidence)):
+        side_effects.submit('telegram', {
+            "photo": bytes(image_bytes),
+            "predicted_class": predicted_class_name,
+            "confidence": confidence,
+            "recommendations": translated_recommendations,
+            "lang": dest_lang,
+            "caption": template.render_caption(confidence),
+            "frame": frame.describe() if frame is not None else None
+        })
+
+    worker_lifecycle.mark_prediction()
+    with stage('render_response'):
+        if response_format != 'json':
+            return encode_result(response_format, class_id, confidence)
+        return template.render_json(confidence, uncertainty, top_classes)
 
 # --- Main Prediction Endpoint ---
 @app.route('/predict', methods=['POST'])
 def predict_endpoint():
+    not_ready = require_ready()
+    if not_ready:
+        return not_ready
+
     dest_lang = request.args.get('lang', 'en').lower()
-    pil_img = None
-    img_byte_arr = None
+    want_uncertainty = request.args.get('uncertainty', '').lower() in ('1', 'true', 'yes')
+    # Rejected before the upload is read and decoded
+    unavailable = uncertainty_unavailable(model_registry.active) if want_uncertainty else None
+    if unavailable:
+        return error_response(unavailable, 400, 'uncertainty_unavailable')
+    top_k_count = requested_top_k(request.args.get('top_k'))
+    response_format = negotiate(request.headers.get('Accept'))
 
     try:
-        # Check if it's JSON from Arduino (Base64)
-        if request.is_json:
-            data = request.get_json()
-            base64_img_str = data.get('file', None)
-            if not base64_img_str:
-                return jsonify({"error": "No 'file' key found in JSON payload (Base64 data missing)."}), 400
-            
-            # Decode Base64 string to bytes
-            image_bytes = base64.b64decode(base64_img_str)
-            img_byte_arr = BytesIO(image_bytes)
-            pil_img = Image.open(img_byte_arr).convert('RGB')
-        
-        elif 'file' in request.files:
-            file = request.files['file']
-            if file.filename == '':
-                return jsonify({"error": "No selected image file."}), 400
-            
-            img_byte_arr = BytesIO(file.read())
-            img_byte_arr.seek(0) # Reset pointer
-            pil_img = Image.open(img_byte_arr).convert('RGB')
-        
+        with measure_peak() as measured:
+            with stage('parse_body'):
+                image_file, image_bytes, upload_error = read_upload()
+            if upload_error:
+                return upload_error
+            cache_key, cached, pil_img = decode_upload(image_file, image_bytes, use_cache=not want_uncertainty)
+        ingest_stats.record('streaming' if STREAMING_INGEST else 'legacy', measured.peak_bytes, measured.seconds)
+
+    except PayloadTooLarge as e:
+        return error_response(str(e), 413, 'payload_too_large')
+    except Exception as e:
+        return error_response(f"Failed to process image data: {str(e)}", 400, 'decode_failed')
+
+    try:
+        # 1. Pre-checks and prediction (or the cached result for this image)
+        cache_key, predicted_class_name, confidence, recommendations, top_classes, uncertainty, class_id = score_upload(
+            cache_key, cached, pil_img, want_uncertainty
+        )
+
+        # 2. Translate, 3. save to Firebase and 4. alert on Telegram (both in the background)
+        response = publish_prediction(
+            cache_key, image_bytes, predicted_class_name, confidence, recommendations, uncertainty, dest_lang,
+            top_classes[:top_k_count] if top_k_count else None,
+            frame=image_file if isinstance(image_file, RawFrame) else None,
+            response_format=response_format,
+            class_id=class_id
+        )
+
+        # 5. Return Response (JSON, or the compact format a device asked for)
+        return Response(response, status=200, mimetype=RESPONSE_MIMETYPES[response_format], headers={'Vary': 'Accept'})
+
+    except PredictionRejected as e:
+        return error_response(str(e), 400, e.error_type)
+    except Exception as e:
+        import traceback
+        traceback.print_exc()
+        return error_response(f"An internal server error occurred: {str(e)}", 500, 'internal')
+
+# --- Batch Prediction Endpoint (NDJSON stream) ---
+def _take_batch_files():
+    """Takes the uploaded images and .zip archives out of the request as (filename, file) pairs.
+
+    The NDJSON body is generated after the view has returned, when Flask has already closed
+    every file in request.files, so each part's stream is detached from its FileStorage here
+    and closed with the response instead. A raw application/zip body (filename None) is
+    spooled to a temporary file.
+    """
+    if request.mimetype in ('application/zip', 'application/x-zip-compressed'):
+        # ZipFile needs a seekable file; spool the body to disk instead of holding it in memory
+        spooled = tempfile.SpooledTemporaryFile(max_size=8 * 1024 * 1024)
+        shutil.copyfileobj(request.stream, spooled)
+        spooled.seek(0)
+        return [(None, spooled)]
+
+    files = []
+    for field in ('files', 'file'):
+        for upload in request.files.getlist(field):
+            if not upload.filename:
+                continue
+            files.append((upload.filename, upload.stream))
+            upload.stream = BytesIO()  # what request.close() closes now
+    return files
+
+def _close_batch_files(files):
+    for _, file in files:
+        file.close()
+
+def _iter_batch_uploads(files):
+    """Yields (name, read_fn) for every image in `files` without reading the image data yet.
+
+    Accepts multipart fields 'files'/'file' (one or more images, or .zip archives)
+    and raw application/zip request bodies (see _take_batch_files).
+    """
+    def from_zip(archive_file):
+        with zipfile.ZipFile(archive_file) as archive:
+            for member in archive.infolist():
+                if member.is_dir() or not member.filename.lower().endswith(IMAGE_EXTENSIONS):
+                    continue
+                if member.file_size > BATCH_PREDICT_MAX_IMAGE_BYTES:
+                    yield member.filename, None
+                    continue
+                # Member data is read lazily, one chunk of images at a time
+                yield member.filename, (lambda m=member: archive.read(m))
+
+    for filename, file in files:
+        if filename is None or filename.lower().endswith('.zip'):
+            yield from from_zip(file)
         else:
-            return jsonify({"error": "Unsupported Media Type or no file provided. Expected JSON (Base64) or multipart/form-data."}), 415
+            yield filename, (lambda f=file: f.read(BATCH_PREDICT_MAX_IMAGE_BYTES + 1))
 
+def _decode_for_batch(item):
+    """Decodes, pre-checks and preprocesses one batch image. Runs on the decode thread pool."""
+    name, data = item
+    if data is None or len(data) > BATCH_PREDICT_MAX_IMAGE_BYTES:
+        return {"name": name, "error": "Image exceeds the maximum allowed size."}
+    try:
+        pil_img = open_rgb(BytesIO(data))
     except Exception as e:
-        return jsonify({"error": f"Failed to process image data: {str(e)}"}), 400
+        return {"name": name, "error": f"Failed to process image data: {str(e)}"}
+    # A fresh input array per image: these are held until the whole chunk is submitted
+    precheck_error, _, img_array = image_pipeline.run(pil_img)
+    if precheck_error:
+        return {"name": name, "error": precheck_error}
+    return {"name": name, "input": img_array}
+
+def _prepend(first, rest):
+    yield first
+    yield from rest
+
+def _chunked(iterable, size):
+    chunk = []
+    for item in iterable:
+        chunk.append(item)
+        if len(chunk) == size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
 
-    if pil_img:
+@app.route('/predict/batch', methods=['POST'])
+def predict_batch_endpoint():
+    not_ready = require_ready()
+    if not_ready:
+        return not_ready
+
+    dest_lang = request.args.get('lang', 'en').lower()
+    top_k_count = requested_top_k(request.args.get('top_k'))
+    files = _take_batch_files()
+    uploads = _iter_batch_uploads(files)
+    try:
+        first = next(uploads)
+    except StopIteration:
+        _close_batch_files(files)
+        return error_response(
+            "No images provided. Expected multipart 'files' (images or a .zip) or an application/zip body.", 400,
+            'missing_file'
+        )
+    except zipfile.BadZipFile as e:
+        _close_batch_files(files)
+        return error_response(f"Invalid zip archive: {str(e)}", 400, 'invalid_upload')
+
+    job_id = uuid.uuid4().hex
+
+    def generate():
+        summary = {"total": 0, "predicted": 0, "rejected": 0, "classes": {}}
+        # English recommendations per predicted class, from the version that scored it
+        english = {}
+        pending = ((name, read() if read is not None else None) for name, read in _prepend(first, uploads))
         try:
-            # 1. Image Pre-processing and Prediction
-            if is_low_quality_image(pil_img):
-                return jsonify({"error": "Image quality is too low (e.g., too dark, too uniform). Please upload a clearer image."}), 400
-            
-            if not is_leaf_detected(pil_img):
-                return jsonify({"error": "No significant plant leaf detected in the image. Please upload an image of a plant leaf."}), 400
-
-            # ... (rest of the prediction logic remains the same) ...
-            img_resized = pil_img.resize((IMG_WIDTH, IMG_HEIGHT))
-            img_array = image.img_to_array(img_resized)
-            img_array = np.expand_dims(img_array, axis=0)
-            img_array /= 255.0
-
-            predictions = model.predict(img_array)
-            predicted_class_index = np.argmax(predictions[0])
-            confidence = float(predictions[0][predicted_class_index])
-            predicted_class_name = class_names.get(predicted_class_index, "Unknown")
-
-            recommendations = recommendations_db.get(predicted_class_name, {
-                "overview": "Information not available.",
-                "treatment": ["No specific treatment found."],
-                "prevention": ["No specific prevention methods found."]
-            })
+            with ThreadPoolExecutor(max_workers=BATCH_PREDICT_DECODE_WORKERS) as pool:
+                for chunk in _chunked(pending, BATCH_PREDICT_CHUNK_SIZE):
+                    decoded = list(pool.map(_decode_for_batch, chunk))
+                    # Valid images go through the shared batcher, which scores them together; each
+                    # chunk holds one model version, so a swap waits at most for the current chunk
+                    with model_registry.use() as bundle:
+                        futures = [bundle.batcher.submit(d["input"]) if "input" in d else None for d in decoded]
+                        for item, future in zip(decoded, futures):
+                            summary["total"] += 1
+                            if future is not None:
+                                try:
+                                    prediction = future.result()
+                                except Exception as e:
+                                    # One failed forward pass only costs the images it held
+                                    future, item = None, {"name": item["name"], "error": f"Prediction failed: {str(e)}"}
+                            if future is None:
+                                summary["rejected"] += 1
+                                line = {"name": item["name"], "error": item["error"]}
+                            else:
+                                predicted_class_name, confidence, class_recommendations, top_classes = interpret_prediction(
+                                    prediction, bundle
+                                )
+                                english.setdefault(predicted_class_name, class_recommendations)
+                                summary["predicted"] += 1
+                                metrics.PREDICTIONS.inc(predicted_class_name, language_label(dest_lang), 'batch')
+                                record_analytics(predicted_class_name, confidence, dest_lang)
+                                summary["classes"][predicted_class_name] = summary["classes"].get(predicted_class_name, 0) + 1
+                                line = {"name": item["name"], "predicted_class": predicted_class_name, "confidence": confidence}
+                                if top_k_count:
+                                    line["top_k"] = top_classes[:top_k_count]
+                            yield json.dumps(line) + "\n"
+        except zipfile.BadZipFile as e:
+            yield json.dumps({"error": f"Invalid zip archive: {str(e)}"}) + "\n"
 
-            # Check confidence threshold for "Unknown"
-            if confidence < 0.4:
-                predicted_class_name = "Unknown"
-                recommendations = recommendations_db.get("Unknown", recommendations) 
-            
-            # 2. Translate Recommendations
-            translated_recommendations = {
-                "overview": translate_text(recommendations["overview"], dest_lang),
-                "treatment": translate_text(recommendations["treatment"], dest_lang),
-                "prevention": translate_text(recommendations["prevention"], dest_lang)
-            }
-            
-            # Get the full language name for database logging
-            full_language_name = LANGUAGE_MAP.get(dest_lang, dest_lang.upper())
-            translated_recommendations['language'] = dest_lang # Log code for dashboard
-            translated_recommendations['language_name'] = full_language_name # Log full name
-
-            # 3. Save to Firebase
-            firebase_data = {
-                "timestamp": tf.timestamp().numpy().tolist(),
-                "predicted_class": predicted_class_name,
-                "confidence": confidence,
-                "recommendations": translated_recommendations
-            }
+        # Recommendations are returned once per predicted class rather than once per image
+        recommendations = {
+            class_name: translate_recommendations(class_name, english[class_name], dest_lang)
+            for class_name in summary["classes"]
+        }
 
-            try:
-                ref = db.reference('/predictions')
-                ref.push(firebase_data)
-                print("Data pushed to Firebase successfully.")
-            except Exception as e:
-                print(f"Error pushing to Firebase: {e}")
-            
-            # 4. Send to Telegram (Reuse the BytesIO object from the start)
-            # Ensure img_byte_arr is reset to the start for sending
-            img_byte_arr.seek(0)
-            
-            telegram_message = create_telegram_message(
-                predicted_class_name, 
-                confidence, 
-                translated_recommendations,
-                dest_lang
-            )
-            send_telegram_photo(img_byte_arr.getvalue(), message=telegram_message)
+        # One Firebase record and one Telegram message per job
+        if summary["predicted"]:
+            record_to_firebase('firebase_job', {
+                "job_id": job_id,
+                "timestamp": time.time(),
+                "language": dest_lang,
+                "summary": summary
+            })
+            side_effects.submit('telegram_summary', create_batch_telegram_message(job_id, summary, dest_lang))
 
-            # 5. Return Response
-            return jsonify({
-                "predicted_class": predicted_class_name,
-                "confidence": confidence,
-                "recommendations": translated_recommendations
-            }), 200
+        yield json.dumps({"job_id": job_id, "summary": summary, "recommendations": recommendations}) + "\n"
 
-        except Exception as e:
-            import traceback
-            traceback.print_exc()
-            return jsonify({"error": f"An internal server error occurred: {str(e)}"}), 500
-    
-    return jsonify({"error": "Something went wrong."}), 500
-# --- Health Check Endpoint (remains the same) ---
+    response = Response(stream_with_context(generate()), mimetype='application/x-ndjson')
+    # The uploads were taken out of request.files: they are closed once the stream is done
+    response.call_on_close(lambda: _close_batch_files(files))
+    return response
+
+# --- Health Check Endpoints ---
 @app.route('/health', methods=['GET'])
+@app.route('/health/ready', methods=['GET'])
 def health_check():
-    if model is not None and class_names is not None and recommendations_db is not None:
-        return jsonify({"status": "ok", "message": "Model and resources loaded."}), 200
-    else:
-        return jsonify({"status": "error", "message": "Model or resources not loaded."}), 503
+    """Readiness: 200 only once this worker's model is loaded and warmed up."""
+    report = worker_lifecycle.readiness()
+    if worker_lifecycle.is_ready() and class_names is not None and recommendations_db is not None:
+        report["message"] = "Model and resources loaded."
+        return jsonify(report), 200
+    report["message"] = "Model or resources not loaded."
+    return jsonify(report), 503
+
+@app.route('/health/live', methods=['GET'])
+def liveness_check():
+    """Liveness: the process is up and serving HTTP, whether or not the model has loaded."""
+    return jsonify(worker_lifecycle.liveness()), 200
+
+# --- Metrics Endpoint (Prometheus text format) ---
+metrics.REGISTRY.gauge('agrosense_inference_queue_depth', "Images waiting for the micro-batcher.",
+                       lambda: model_registry.active.batcher.queue_depth() if model_registry.active is not None else None)
+metrics.REGISTRY.gauge('agrosense_shadow_agreement_ratio', "Share of sampled requests where the shadow model agreed.",
+                       lambda: model_registry.shadow_stats.stats()["agreement"] if model_registry.shadow_stats is not None else None)
+metrics.REGISTRY.gauge('agrosense_side_effect_queue_depth', "Side-effect jobs waiting for a worker.",
+                       lambda: side_effects.stats()["queue_depth"])
+metrics.REGISTRY.gauge('agrosense_side_effects_dropped', "Side-effect jobs dropped because the queue was full.",
+                       lambda: side_effects.stats()["dropped"])
+metrics.REGISTRY.gauge('agrosense_firebase_outbox_pending', "Firebase records waiting in the write-behind outbox.",
+                       lambda: firebase_outbox.pending() if firebase_outbox is not None else None)
+metrics.REGISTRY.gauge('agrosense_alert_digest_pending', "Alerts waiting for the next Telegram digest.",
+                       lambda: alert_dispatcher.stats()["pending"])
+metrics.REGISTRY.gauge('agrosense_result_cache_entries', "Entries in the prediction result cache.",
+                       lambda: result_cache.stats()["entries"])
+metrics.REGISTRY.gauge('agrosense_result_cache_hit_ratio', "Result cache hit ratio since start.",
+                       lambda: result_cache.stats()["hit_ratio"])
+metrics.REGISTRY.gauge('agrosense_translation_hit_ratio', "Translation store hit ratio since start.",
+                       lambda: translation_store.stats()["hit_ratio"] if translation_store is not None else None)
+
+@app.route('/metrics', methods=['GET'])
+def metrics_endpoint():
+    return Response(metrics.REGISTRY.render(), content_type=metrics.CONTENT_TYPE)
+
+# --- Diagnostics Endpoint (model, batching, side-effect and translation statistics) ---
+@app.route('/diagnostics', methods=['GET'])
+def diagnostics():
+    return jsonify(diagnostics_report()), 200
+
+def diagnostics_report():
+    return {
+        "model": {"inference_mode": INFERENCE_MODE, **model_registry.status()},
+        "tuning": {
+            "settings": tuning["settings"], "tuned_at": tuning["tuned_at"], "slo_ms": tuning["slo_ms"],
+            "slo_met": tuning["slo_met"], "configurations_tried": len(tuning["sweep"])
+        } if tuning else None,
+        "threads": {name: os.environ.get(name) for name in ('WEB_CONCURRENCY', 'TF_INTRA_OP_THREADS',
+                                                            'TF_INTER_OP_THREADS', 'OMP_NUM_THREADS', 'TF_ENABLE_ONEDNN_OPTS')},
+        "batching": model_registry.active.batcher.stats() if model_registry.active is not None else None,
+        "side_effects": side_effects.stats(),
+        "firebase_outbox": firebase_outbox.stats() if firebase_outbox is not None else None,
+        "alerts": alert_dispatcher.stats(),
+        "translations": translation_store.stats() if translation_store is not None else None,
+        "recommendations": recommendations_db.stats() if recommendations_db is not None else None,
+        "calibration": calibration.describe() if calibration is not None else None,
+        "response_templates": response_templates.stats(),
+        "result_cache": result_cache.stats(),
+        "ingest": ingest_stats.stats(),
+        "analytics": prediction_analytics.stats() if prediction_analytics is not None else None
+    }
+
+# --- Stats Endpoint (prediction counts from the analytics rollups) ---
+def stats_report(args):
+    """Runs a /stats query from its parameters. Returns (body, status) for the Flask and ASGI endpoints.
+
+    from / to: epoch seconds or ISO 8601 dates (to is exclusive); granularity: hour or day;
+    class / crop: count only that class or crop.
+    """
+    if prediction_analytics is None:
+        return {"error": "Prediction analytics are disabled (ANALYTICS_ENABLED=0)."}, 404
+    try:
+        start, end = parse_time(args.get('from')), parse_time(args.get('to'))
+        with stage('analytics_query'):
+            report = prediction_analytics.query(
+                start, end, granularity=args.get('granularity', 'day'),
+                class_name=args.get('class') or None, crop=args.get('crop') or None
+            )
+    except ValueError as e:
+        metrics.ERRORS.inc('invalid_parameter')
+        return {"error": str(e)}, 400
+    return report, 200
+
+@app.route('/stats', methods=['GET'])
+def stats_endpoint():
+    body, status = stats_report(request.args)
+    return jsonify(body), status
+
+# --- Admin Endpoints (model registry; require ADMIN_TOKEN) ---
+def admin_authorized(authorization):
+    """True if an Authorization header carries ADMIN_TOKEN as a bearer token."""
+    scheme, _, token = (authorization or '').partition(' ')
+    return bool(ADMIN_TOKEN) and scheme.lower() == 'bearer' and hmac.compare_digest(token.strip(), ADMIN_TOKEN)
+
+def admin_models_action(action, version=None, sample_rate=None):
+    """Runs one registry action. Returns (body, status) for the Flask and ASGI endpoints."""
+    try:
+        if action == 'activate':
+            model_registry.request_activate(version)
+        elif action == 'shadow':
+            model_registry.request_shadow(version, float(sample_rate if sample_rate is not None else 0.1))
+        elif action == 'stop_shadow':
+            model_registry.request_shadow(None, None)
+    except (RegistryError, ValueError) as e:
+        return {"error": str(e)}, 400
+    # Other workers pick the change up within MODEL_REGISTRY_POLL_SECONDS
+    return model_registry.status(), 200 if action == 'status' else 202
+
+def require_admin():
+    if not ADMIN_TOKEN:
+        return error_response("Not found.", 404, 'not_found')
+    if not admin_authorized(request.headers.get('Authorization')):
+        return error_response("Missing or invalid admin token.", 401, 'unauthorized')
+    return None
+
+@app.route('/admin/models', methods=['GET'])
+def admin_models_endpoint():
+    denied = require_admin()
+    if denied:
+        return denied
+    body, status = admin_models_action('status')
+    return jsonify(body), status
+
+@app.route('/admin/models/<version>/activate', methods=['POST'])
+def admin_activate_endpoint(version):
+    denied = require_admin()
+    if denied:
+        return denied
+    body, status = admin_models_action('activate', version)
+    return jsonify(body), status
+
+@app.route('/admin/models/<version>/shadow', methods=['POST'])
+def admin_shadow_endpoint(version):
+    denied = require_admin()
+    if denied:
+        return denied
+    body, status = admin_models_action('shadow', version, request.args.get('sample_rate'))
+    return jsonify(body), status
+
+@app.route('/admin/models/shadow', methods=['DELETE'])
+def admin_stop_shadow_endpoint():
+    denied = require_admin()
+    if denied:
+        return denied
+    body, status = admin_models_action('stop_shadow')
+    return jsonify(body), status
+
+# --- CLI: pre-fill the translation store ---
+@app.cli.command('build-translations')
+def build_translations_command():
+    """Translates every recommendation into every language in LANGUAGE_MAP ahead of time."""
+    made = translation_store.build(recommendations_db, LANGUAGE_MAP.keys(), translate_live)
+    print(f"Translation store ready: {made} live translations made.")
 
 # --- Testing Endpoint with HTML Form (Updated Language Options) ---
-@app.route('/', methods=['GET'])
-def test_predict_form():
-    return render_template_string("""
+# (also served by asgi_app.py)
+TEST_FORM_HTML = """
 <!DOCTYPE html>
 <html lang="en">
 <head>
@@ -533,16 +1560,20 @@ def test_predict_form():
     </script>
 </body>
 </html>
-""")
+"""
+
+@app.route('/', methods=['GET'])
+def test_predict_form():
+    return render_template_string(TEST_FORM_HTML)
 
 # --- GUNICORN ENTRY POINT ---
+# Only fork-safe resources are loaded at import (once, in the master when preloading).
+# Per-worker initialization is started by gunicorn.conf.py's post_worker_init hook.
 try:
-    with app.app_context():
-        load_resources()
-    print("Application resources loaded successfully for Gunicorn.")
-# ... (rest of the block)
+    load_shared_resources()
+    print("Shared application resources loaded.")
 except Exception as e:
-    # Log the failure but don't call exit(), let Gunicorn's worker management handle it.
+    # Log the failure but don't call exit(); workers retry and report it on /health/ready.
     print(f"CRITICAL ERROR during app startup: {e}") 
 
 # Note: The "if __name__ == '__main__':" block has been fully removed.
\ No newline at end of file
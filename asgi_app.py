@@ -0,0 +1,401 @@
+"""ASGI serving mode: the /predict, /health and / routes of app.py on Starlette.
+
+    gunicorn -c gunicorn.conf.py -k uvicorn.workers.UvicornWorker asgi_app:app
+    uvicorn asgi_app:app --port 8080        (single process, for development)
+
+Request handling never blocks the event loop: decoding, pre-checks and inference run on a
+bounded thread pool (the model and micro-batcher are shared with app.py, and TensorFlow /
+TFLite release the GIL while computing) and publishing a prediction runs on a separate I/O
+pool. When the inference pool has ASGI_MAX_QUEUED jobs waiting, new uploads are refused with
+503 + Retry-After before their body is read.
+
+Outbound HTTP goes through pooled async clients on the event loop: Telegram Bot API calls
+(app.telegram_client, still rate-limited by its token bucket) over one httpx.AsyncClient, and
+live translations of translation-store misses over googletrans' async Translator. The threads
+that make these calls (side-effect workers, the digest sender, the I/O pool) only wait for
+the result. Firebase writes go through the write-behind outbox, whose flusher batches them
+over firebase_admin's own session on a background thread, exactly as in the Flask server.
+"""
+import asyncio
+import contextvars
+import inspect
+import os
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import AsyncExitStack, asynccontextmanager
+
+import httpx
+from starlette.applications import Starlette
+from starlette.middleware import Middleware
+from starlette.middleware.cors import CORSMiddleware
+from starlette.responses import HTMLResponse, JSONResponse, Response
+from starlette.routing import Route
+
+import app as core
+import metrics
+from device_protocol import (FRAME_TYPE, RAW_IMAGE_TYPES, RESPONSE_MIMETYPES, FrameError, RawFrame, negotiate,
+                             open_device_upload, parse_content_type)
+from ingest import CHUNK_SIZE, Base64FieldDecoder, IngestBuffer, PayloadTooLarge, check_content_length
+
+# --- Executors & Admission Control ---
+# ASGI_INFERENCE_WORKERS threads decode and score uploads; at most ASGI_MAX_QUEUED more may
+# wait for a thread before /predict answers 503 with Retry-After: ASGI_RETRY_AFTER_SECONDS.
+ASGI_INFERENCE_WORKERS = int(os.environ.get('ASGI_INFERENCE_WORKERS', 4))
+ASGI_MAX_QUEUED = int(os.environ.get('ASGI_MAX_QUEUED', 32))
+ASGI_IO_WORKERS = int(os.environ.get('ASGI_IO_WORKERS', 8))
+ASGI_RETRY_AFTER_SECONDS = int(os.environ.get('ASGI_RETRY_AFTER_SECONDS', 2))
+
+# --- Outbound HTTP ---
+# Telegram calls share at most HTTP_MAX_CONNECTIONS pooled connections; every outbound call
+# (Telegram or translation) times out after HTTP_TIMEOUT_SECONDS.
+HTTP_MAX_CONNECTIONS = int(os.environ.get('HTTP_MAX_CONNECTIONS', 20))
+HTTP_TIMEOUT_SECONDS = float(os.environ.get('HTTP_TIMEOUT_SECONDS', 10))
+
+
+class Overloaded(Exception):
+    pass
+
+
+class BoundedExecutor:
+    """Thread pool that refuses work once `workers + max_queued` jobs are running or waiting."""
+
+    def __init__(self, workers, max_queued, name):
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix=name)
+        self.capacity = workers + max_queued
+        self.in_flight = 0
+        self.rejected = 0
+        self.completed = 0
+
+    def full(self):
+        return self.in_flight >= self.capacity
+
+    async def run(self, fn, *args):
+        if self.full():
+            self.rejected += 1
+            raise Overloaded()
+        loop = asyncio.get_running_loop()
+        self.in_flight += 1
+        # Run in a copy of this request's context, so stage timings land in its trace
+        future = self._pool.submit(contextvars.copy_context().run, fn, *args)
+        # Released when the job really finishes, even if the client has gone away meanwhile
+        future.add_done_callback(lambda _: loop.call_soon_threadsafe(self._release))
+        return await asyncio.wrap_future(future)
+
+    def _release(self):
+        self.in_flight -= 1
+        self.completed += 1
+
+    def shutdown(self):
+        self._pool.shutdown(wait=False)
+
+    def stats(self):
+        return {"in_flight": self.in_flight, "capacity": self.capacity,
+                "rejected": self.rejected, "completed": self.completed}
+
+
+inference_executor = BoundedExecutor(ASGI_INFERENCE_WORKERS, ASGI_MAX_QUEUED, 'asgi-inference')
+io_executor = ThreadPoolExecutor(max_workers=ASGI_IO_WORKERS, thread_name_prefix='asgi-io')
+
+def run_io(fn, *args):
+    return asyncio.get_running_loop().run_in_executor(io_executor, contextvars.copy_context().run, fn, *args)
+
+# Set by the lifespan: the server's event loop and the pooled client it owns
+event_loop = None
+http_client = None
+
+def on_event_loop(coroutine_fn, timeout):
+    """Adapts an async call for app.py's blocking callers, which run on other threads: the HTTP
+    I/O runs on the event loop over the shared pool while the calling thread waits for it."""
+    def call(*args, **kwargs):
+        return asyncio.run_coroutine_threadsafe(coroutine_fn(*args, **kwargs), event_loop).result(timeout)
+    return call
+
+
+# --- Async Outbound Clients ---
+async def telegram_post(url, data, files, timeout):
+    """TelegramClient transport over the shared httpx.AsyncClient."""
+    try:
+        response = await http_client.post(url, data=data, files=files, timeout=timeout)
+    except httpx.HTTPError as e:
+        raise ConnectionError(str(e)) from e
+    return response.status_code, response.text
+
+class LoopTranslator:
+    """app.translator for this mode: the blocking translate() app.py calls on a translation-store
+    miss, served by an async translator (googletrans >= 4, one pooled httpx client) on the loop."""
+
+    def __init__(self, translator, timeout):
+        self._translate = on_event_loop(translator.translate, timeout)
+
+    def translate(self, text, dest='en', src='auto'):
+        return self._translate(text, dest=dest, src=src)
+
+def async_translator():
+    """googletrans' Translator if it is the async one, else None (older googletrans, or the stub)."""
+    if core.TRANSLATOR_BACKEND == 'stub':
+        return None
+    from googletrans import Translator
+    if not inspect.iscoroutinefunction(Translator.translate):
+        return None
+    return Translator(timeout=httpx.Timeout(HTTP_TIMEOUT_SECONDS))
+
+def error_response(message, status, error_type, retry_after=None):
+    metrics.ERRORS.inc(error_type)
+    metrics.annotate(error_type=error_type)
+    response = JSONResponse({"error": message}, status_code=status)
+    if retry_after is not None:
+        response.headers['Retry-After'] = str(retry_after)
+    return response
+
+
+# --- Upload Ingestion ---
+async def read_upload(request):
+    """Async version of app.read_upload: returns (file object, bytes-like data, error response or None)."""
+    content_length = request.headers.get('content-length')
+    content_length = int(content_length) if content_length else None
+    check_content_length(content_length, core.PREDICT_MAX_UPLOAD_BYTES)
+    content_type, params = parse_content_type(request.headers.get('content-type', ''))
+
+    if content_type in RAW_IMAGE_TYPES or content_type == FRAME_TYPE:
+        buffer = IngestBuffer(content_length or 0, max_bytes=core.PREDICT_MAX_UPLOAD_BYTES)
+        async for chunk in request.stream():
+            buffer.write(chunk)
+        buffer.seek(0)
+        try:
+            image_file, image_bytes = open_device_upload(buffer, content_type, params, core.image_pipeline.size)
+        except FrameError as e:
+            return None, None, error_response(str(e), 400, 'invalid_upload')
+        return image_file, image_bytes, None
+
+    if content_type == 'application/json' or content_type.endswith('+json'):
+        decoder = Base64FieldDecoder('file', capacity=(content_length or 0) * 3 // 4 + 3)
+        total = 0
+        async for chunk in request.stream():
+            total += len(chunk)
+            if core.PREDICT_MAX_UPLOAD_BYTES and total > core.PREDICT_MAX_UPLOAD_BYTES:
+                raise PayloadTooLarge(f"Upload exceeds the {core.PREDICT_MAX_UPLOAD_BYTES} byte limit.")
+            decoder.feed(chunk)
+            if decoder.done:
+                break
+        if decoder.found and not decoder.done:
+            raise ValueError("Truncated JSON body.")
+        buffer = decoder.result()
+        if buffer is None:
+            return None, None, error_response("No 'file' key found in JSON payload (Base64 data missing).", 400, 'missing_file')
+        return buffer, buffer.getbuffer(), None
+
+    if content_type == 'multipart/form-data':
+        async with request.form(max_files=1) as form:
+            upload = form.get('file')
+            if upload is not None and hasattr(upload, 'read'):
+                if upload.filename == '':
+                    return None, None, error_response("No selected image file.", 400, 'missing_file')
+                buffer = IngestBuffer(upload.size or 0, max_bytes=core.PREDICT_MAX_UPLOAD_BYTES)
+                while True:
+                    chunk = await upload.read(CHUNK_SIZE)
+                    if not chunk:
+                        break
+                    buffer.write(chunk)
+                buffer.seek(0)
+                return buffer, buffer.getbuffer(), None
+
+    return None, None, error_response(
+        "Unsupported Media Type or no file provided. Expected JSON (Base64) or multipart/form-data.", 415,
+        'unsupported_media_type'
+    )
+
+def decode_and_score(image_file, image_bytes, want_uncertainty):
+    """Runs on the inference executor: decode, pre-checks, inference (or a cached result)."""
+    try:
+        cache_key, cached, pil_img = core.decode_upload(image_file, image_bytes, use_cache=not want_uncertainty)
+    except Exception as e:
+        raise core.PredictionRejected(f"Failed to process image data: {str(e)}", 'decode_failed')
+    return core.score_upload(cache_key, cached, pil_img, want_uncertainty)
+
+
+# --- Routes ---
+async def predict_endpoint(request):
+    if not core.worker_lifecycle.is_ready():
+        if not await run_io(core.worker_lifecycle.wait_ready, core.READY_WAIT_SECONDS):
+            metrics.ERRORS.inc('not_ready')
+            response = JSONResponse({
+                "error": "The prediction service is starting up. Please retry shortly.",
+                "phase": core.worker_lifecycle.phase
+            }, status_code=503)
+            response.headers['Retry-After'] = '5'
+            return response
+    if inference_executor.full():
+        inference_executor.rejected += 1
+        return error_response("The prediction service is busy. Please retry shortly.", 503, 'overloaded',
+                              ASGI_RETRY_AFTER_SECONDS)
+
+    dest_lang = request.query_params.get('lang', 'en').lower()
+    want_uncertainty = request.query_params.get('uncertainty', '').lower() in ('1', 'true', 'yes')
+    unavailable = core.uncertainty_unavailable(core.model_registry.active) if want_uncertainty else None
+    if unavailable:
+        return error_response(unavailable, 400, 'uncertainty_unavailable')
+    top_k_count = core.requested_top_k(request.query_params.get('top_k'))
+    response_format = negotiate(request.headers.get('accept'))
+
+    try:
+        with metrics.stage('parse_body'):
+            image_file, image_bytes, error = await read_upload(request)
+        if error is not None:
+            return error
+    except PayloadTooLarge as e:
+        return error_response(str(e), 413, 'payload_too_large')
+    except Exception as e:
+        return error_response(f"Failed to process image data: {str(e)}", 400, 'decode_failed')
+
+    try:
+        (cache_key, predicted_class_name, confidence, recommendations, top_classes, uncertainty,
+         class_id) = await inference_executor.run(
+            decode_and_score, image_file, image_bytes, want_uncertainty
+        )
+        # Translation-store misses call the live translator, so this runs on the I/O pool
+        body = await run_io(
+            core.publish_prediction,
+            cache_key, image_bytes, predicted_class_name, confidence, recommendations, uncertainty, dest_lang,
+            top_classes[:top_k_count] if top_k_count else None,
+            image_file if isinstance(image_file, RawFrame) else None,
+            response_format, class_id
+        )
+        return Response(body, media_type=RESPONSE_MIMETYPES[response_format], headers={'Vary': 'Accept'})
+
+    except Overloaded:
+        return error_response("The prediction service is busy. Please retry shortly.", 503, 'overloaded',
+                              ASGI_RETRY_AFTER_SECONDS)
+    except core.PredictionRejected as e:
+        return error_response(str(e), 400, e.error_type)
+    except Exception as e:
+        import traceback
+        traceback.print_exc()
+        return error_response(f"An internal server error occurred: {str(e)}", 500, 'internal')
+
+async def health_check(request):
+    """Readiness: 200 only once this worker's model is loaded and warmed up."""
+    report = core.worker_lifecycle.readiness()
+    report["executor"] = inference_executor.stats()
+    if core.worker_lifecycle.is_ready() and core.class_names is not None and core.recommendations_db is not None:
+        report["message"] = "Model and resources loaded."
+        return JSONResponse(report, status_code=200)
+    report["message"] = "Model or resources not loaded."
+    return JSONResponse(report, status_code=503)
+
+async def liveness_check(request):
+    return JSONResponse(core.worker_lifecycle.liveness())
+
+async def diagnostics(request):
+    report = core.diagnostics_report()
+    report["executor"] = inference_executor.stats()
+    return JSONResponse(report)
+
+async def metrics_endpoint(request):
+    return Response(metrics.REGISTRY.render(), media_type=metrics.CONTENT_TYPE)
+
+async def admin_models(request):
+    """/admin/models routes of app.py (the action runs on the I/O pool: it writes registry.json)."""
+    if not core.ADMIN_TOKEN:
+        return error_response("Not found.", 404, 'not_found')
+    if not core.admin_authorized(request.headers.get('authorization')):
+        return error_response("Missing or invalid admin token.", 401, 'unauthorized')
+    version = request.path_params.get('version')
+    if request.method == 'GET':
+        action = 'status'
+    elif request.method == 'DELETE':
+        action = 'stop_shadow'
+    else:
+        action = 'activate' if request.url.path.endswith('/activate') else 'shadow'
+    body, status = await run_io(core.admin_models_action, action, version, request.query_params.get('sample_rate'))
+    return JSONResponse(body, status_code=status)
+
+async def stats_endpoint(request):
+    """/stats of app.py (on the I/O pool: a query first reads any new records from the analytics log)."""
+    body, status = await run_io(core.stats_report, request.query_params)
+    return JSONResponse(body, status_code=status)
+
+async def test_predict_form(request):
+    return HTMLResponse(core.TEST_FORM_HTML)
+
+
+# --- Tracing ---
+class TraceMiddleware:
+    """Starts each request's trace (X-Request-ID or generated), echoes its ID and records its latency."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            await self.app(scope, receive, send)
+            return
+        request_id = dict(scope['headers']).get(b'x-request-id', b'').decode('latin-1')
+        trace = metrics.begin_trace(request_id or None)
+        status = [500]
+
+        async def send_with_trace_id(message):
+            if message['type'] == 'http.response.start':
+                status[0] = message['status']
+                message['headers'] = list(message.get('headers', [])) + [(b'x-request-id', trace.trace_id.encode('latin-1'))]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_trace_id)
+        finally:
+            endpoint = scope['path'] if scope['path'] in ROUTE_PATHS else 'unmatched'
+            metrics.finish_trace(trace, endpoint, status[0], core.slow_request_log)
+
+
+# --- Lifecycle ---
+@asynccontextmanager
+async def lifespan(_app):
+    global event_loop, http_client
+    event_loop = asyncio.get_running_loop()
+    blocking_transport, blocking_translator = core.telegram_client.transport, core.translator
+    async with AsyncExitStack() as clients:
+        http_client = await clients.enter_async_context(httpx.AsyncClient(
+            timeout=HTTP_TIMEOUT_SECONDS,
+            limits=httpx.Limits(max_connections=HTTP_MAX_CONNECTIONS, max_keepalive_connections=HTTP_MAX_CONNECTIONS)
+        ))
+        # Bounded by twice the HTTP timeout: a connect timeout, then a read timeout
+        core.telegram_client.transport = on_event_loop(telegram_post, HTTP_TIMEOUT_SECONDS * 2)
+        translator = async_translator()
+        if translator is not None:
+            core.translator = LoopTranslator(await clients.enter_async_context(translator), HTTP_TIMEOUT_SECONDS * 2)
+
+        # No-op if gunicorn's post_worker_init hook already started it
+        core.worker_lifecycle.start(background=True)
+        print(f"ASGI mode: {ASGI_INFERENCE_WORKERS} inference threads, up to {ASGI_MAX_QUEUED} queued.")
+        try:
+            yield
+        finally:
+            # Drain side effects, the alert digest and the Firebase outbox off the loop: their
+            # HTTP calls need the loop (and the clients, closed after this) to keep running
+            await run_io(core.shutdown_worker)
+            core.telegram_client.transport, core.translator = blocking_transport, blocking_translator
+            inference_executor.shutdown()
+            io_executor.shutdown(wait=False)
+
+ROUTES = [
+    Route('/predict', predict_endpoint, methods=['POST']),
+    Route('/health', health_check, methods=['GET']),
+    Route('/health/ready', health_check, methods=['GET']),
+    Route('/health/live', liveness_check, methods=['GET']),
+    Route('/diagnostics', diagnostics, methods=['GET']),
+    Route('/metrics', metrics_endpoint, methods=['GET']),
+    Route('/stats', stats_endpoint, methods=['GET']),
+    Route('/admin/models', admin_models, methods=['GET']),
+    Route('/admin/models/shadow', admin_models, methods=['DELETE']),
+    Route('/admin/models/{version}/activate', admin_models, methods=['POST']),
+    Route('/admin/models/{version}/shadow', admin_models, methods=['POST']),
+    Route('/', test_predict_form, methods=['GET']),
+]
+ROUTE_PATHS = {route.path for route in ROUTES}
+
+app = Starlette(
+    routes=ROUTES,
+    middleware=[
+        Middleware(TraceMiddleware),
+        Middleware(CORSMiddleware, allow_origins=['*'], allow_methods=['*'], allow_headers=['*'])
+    ],
+    lifespan=lifespan
+)
@@ -0,0 +1,315 @@
+"""CPU topology auto-tuner: worker count, TensorFlow thread pools and oneDNN, measured on this host.
+
+    python autotune.py                                 # sweep, save tuning.json, print the table
+    python autotune.py --slo-ms 250 --duration 10 --workers 1,2,4
+    python autotune.py show                            # print the saved sweep
+
+Each trial starts one probe process per gunicorn worker, with that trial's thread and oneDNN
+environment, each loading the real model behind a MicroBatcher. Once every probe is warm they
+are driven together by the same total number of client threads for `duration` seconds, so the
+trials compete for the host's cores exactly like gunicorn workers would. The configuration with
+the highest throughput whose p95 inference latency (batching wait included, HTTP and image
+decoding excluded) stays under the SLO is saved; if none does, the one with the lowest p95.
+
+gunicorn.conf.py and app.py apply the saved settings for whatever is not set explicitly in the
+environment (apply_tuning). A file tuned on a host with another CPU count is ignored.
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+import numpy as np
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+TUNING_PATH = 'tuning.json'
+
+# Used when there is no tuning for this host (the values the Docker image used to hard-code)
+FALLBACK_ENVIRONMENT = {'TF_ENABLE_ONEDNN_OPTS': '0', 'OMP_NUM_THREADS': '1'}
+
+
+def available_cpus():
+    """CPUs this process may run on (the container's quota on Linux, not the host's core count)."""
+    if hasattr(os, 'sched_getaffinity'):
+        return len(os.sched_getaffinity(0))
+    return os.cpu_count() or 1
+
+def tuned_environment(settings):
+    """Environment variables that apply one configuration ({workers, intra_op_threads, inter_op_threads, onednn})."""
+    return {
+        'WEB_CONCURRENCY': str(settings['workers']),
+        'TF_INTRA_OP_THREADS': str(settings['intra_op_threads']),
+        'TF_INTER_OP_THREADS': str(settings['inter_op_threads']),
+        'OMP_NUM_THREADS': str(settings['intra_op_threads']),
+        'TF_ENABLE_ONEDNN_OPTS': '1' if settings['onednn'] else '0',
+    }
+
+
+# --- Saved Tuning ---
+def load_tuning(path):
+    """The saved tuning, or None if there is none (or it was measured on a different CPU count)."""
+    try:
+        with open(path, 'r') as f:
+            tuning = json.load(f)
+    except FileNotFoundError:
+        return None
+    except ValueError as e:
+        print(f"⚠️ Ignoring unreadable tuning file {path}: {e}")
+        return None
+    if tuning.get('cpu_count') != available_cpus():
+        print(f"⚠️ {path} was tuned for {tuning.get('cpu_count')} CPUs, this host has {available_cpus()}; "
+              f"ignoring it (run `python autotune.py` here).")
+        return None
+    return tuning
+
+def apply_tuning(path):
+    """Sets the saved (or fallback) settings for every variable not already in the environment.
+
+    Must run before TensorFlow is imported (TF_ENABLE_ONEDNN_OPTS is read at import). Returns
+    the tuning, or None when the fallback was used.
+    """
+    tuning = load_tuning(path)
+    environment = tuned_environment(tuning['settings']) if tuning else FALLBACK_ENVIRONMENT
+    applied = {name: value for name, value in environment.items() if name not in os.environ}
+    os.environ.update(applied)
+    if tuning and applied:
+        print(f"✅ CPU tuning from {path} applied: {', '.join(f'{k}={v}' for k, v in sorted(applied.items()))}.")
+    return tuning
+
+def save_tuning(path, tuning):
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, tmp_path = tempfile.mkstemp(prefix='.tuning-', suffix='.json', dir=directory)
+    try:
+        with os.fdopen(fd, 'w') as f:
+            json.dump(tuning, f, indent=2)
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+# --- Sweep ---
+def candidate_settings(cpus, runtime, workers=None, intra=None, inter=None, onednn=None):
+    """The configurations to try: worker counts up to `cpus`, each with the cores split between its
+    workers (or half that), 1-2 inter-op threads and oneDNN on and off. Explicit lists override
+    each axis. TFLite ignores the inter-op pool and oneDNN, so those axes collapse for it.
+    """
+    if workers is None:
+        workers = sorted({w for w in (1, 2, 4, 8, 16, 32) if w <= cpus} | {cpus})
+    if runtime == 'tflite':
+        inter, onednn = [1], [False]
+    candidates = []
+    for w in workers:
+        share = max(1, cpus // w)
+        for intra_threads in intra or sorted({share, max(1, share // 2)}, reverse=True):
+            for inter_threads in inter or ([1, 2] if intra_threads > 1 else [1]):
+                for onednn_on in (onednn if onednn is not None else [False, True]):
+                    candidates.append({"workers": w, "intra_op_threads": intra_threads,
+                                       "inter_op_threads": inter_threads, "onednn": onednn_on})
+    return candidates
+
+def _read_message(process):
+    """Next JSON object a probe prints (model loading may print other lines first), or None at EOF."""
+    for line in process.stdout:
+        if line.startswith('{'):
+            try:
+                return json.loads(line)
+            except ValueError:
+                continue
+    return None
+
+def run_trial(settings, args):
+    """Runs one configuration and returns its settings with throughput and latency percentiles."""
+    env = dict(os.environ, **tuned_environment(settings), TF_CPP_MIN_LOG_LEVEL='2')
+    workers = settings['workers']
+    clients = [args.clients // workers + (i < args.clients % workers) for i in range(workers)]
+    command = [sys.executable, os.path.abspath(__file__), 'probe', '--runtime', args.runtime,
+               '--model', args.model, '--duration', str(args.duration),
+               '--batch-size', str(args.batch_size), '--batch-wait-ms', str(args.batch_wait_ms)]
+    if args.artifact:
+        command += ['--artifact', args.artifact]
+    processes = []
+    try:
+        for count in clients:
+            processes.append(subprocess.Popen(command + ['--clients', str(max(count, 1))], cwd=ROOT, env=env,
+                                              stdin=subprocess.PIPE, stdout=subprocess.PIPE, text=True))
+        # Start measuring only once every worker has loaded and warmed up its model
+        for process in processes:
+            if _read_message(process) is None:
+                raise RuntimeError(f"probe exited with status {process.wait()} while loading the model")
+        for process in processes:
+            process.stdin.write('\n')
+            process.stdin.flush()
+        latencies = []
+        for process in processes:
+            message = _read_message(process)
+            if message is None:
+                raise RuntimeError(f"probe exited with status {process.wait()} during the run")
+            latencies.extend(message["latencies_ms"])
+            process.wait(30)
+    except Exception as e:
+        return dict(settings, error=str(e))
+    finally:
+        for process in processes:
+            if process.poll() is None:
+                process.kill()
+
+    ms = np.asarray(latencies, dtype=np.float64)
+    if not len(ms):
+        return dict(settings, error="no inference completed")
+    return dict(settings, images=len(ms), throughput_ips=len(ms) / args.duration,
+                mean_ms=float(ms.mean()), p50_ms=float(np.percentile(ms, 50)),
+                p95_ms=float(np.percentile(ms, 95)), p99_ms=float(np.percentile(ms, 99)))
+
+def choose(results, slo_ms):
+    """(best result, whether it meets the SLO): the highest throughput under the SLO, else the lowest p95."""
+    completed = [result for result in results if "error" not in result]
+    if not completed:
+        return None, False
+    within = [result for result in completed if result["p95_ms"] <= slo_ms]
+    if within:
+        return max(within, key=lambda result: result["throughput_ips"]), True
+    return min(completed, key=lambda result: result["p95_ms"]), False
+
+def sweep(args):
+    """Runs every candidate configuration and saves the tuning. Returns it."""
+    cpus = available_cpus()
+    candidates = candidate_settings(cpus, args.runtime, args.workers, args.intra, args.inter, args.onednn)
+    print(f"🔧 Tuning {args.runtime} inference on {cpus} CPUs: {len(candidates)} configurations, "
+          f"{args.duration:g}s each, {args.clients} clients, p95 SLO {args.slo_ms:g} ms.")
+    results = []
+    for settings in candidates:
+        result = run_trial(settings, args)
+        results.append(result)
+        if "error" in result:
+            print(f"❌ {describe(settings)}: {result['error']}")
+        else:
+            print(f"{describe(settings)}: {result['throughput_ips']:.1f} img/s, p95 {result['p95_ms']:.1f} ms")
+
+    best, slo_met = choose(results, args.slo_ms)
+    if best is None:
+        raise RuntimeError("Every tuning trial failed; see the errors above.")
+    settings = {name: best[name] for name in ("workers", "intra_op_threads", "inter_op_threads", "onednn")}
+    tuning = {
+        "tuned_at": time.time(),
+        "cpu_count": cpus,
+        "runtime": args.runtime,
+        "slo_ms": args.slo_ms,
+        "slo_met": slo_met,
+        "clients": args.clients,
+        "duration_s": args.duration,
+        "settings": settings,
+        "sweep": results,
+    }
+    save_tuning(args.output, tuning)
+    if not slo_met:
+        print(f"⚠️ No configuration met the {args.slo_ms:g} ms SLO; saved the one with the lowest p95.")
+    print(f"✅ Saved {describe(settings)} to {args.output}.")
+    return tuning
+
+def describe(settings):
+    return (f"workers={settings['workers']} intra={settings['intra_op_threads']} "
+            f"inter={settings['inter_op_threads']} onednn={'on' if settings['onednn'] else 'off'}")
+
+def print_table(tuning):
+    fmt = lambda v: f"{v:9.1f}" if v is not None else f"{'-':>9}"
+    chosen = tuning["settings"]
+    print(f"\n{'workers':>8}{'intra':>7}{'inter':>7}{'onednn':>8}{'img/s':>9}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}")
+    for result in tuning["sweep"]:
+        mark = ' *' if all(result[name] == value for name, value in chosen.items()) else ''
+        print(f"{result['workers']:>8}{result['intra_op_threads']:>7}{result['inter_op_threads']:>7}"
+              f"{'on' if result['onednn'] else 'off':>8}{fmt(result.get('throughput_ips'))}"
+              f"{fmt(result.get('p50_ms'))}{fmt(result.get('p95_ms'))}{fmt(result.get('p99_ms'))}{mark}")
+    print(f"Tuned {time.strftime('%Y-%m-%d %H:%M', time.localtime(tuning['tuned_at']))} on "
+          f"{tuning['cpu_count']} CPUs, p95 SLO {tuning['slo_ms']:g} ms ({'met' if tuning['slo_met'] else 'not met'}).")
+
+
+# --- Probe (one simulated gunicorn worker) ---
+def probe(args):
+    """Loads the model in this process, reports ready, waits for the go line, then runs the load."""
+    from batching import MicroBatcher
+    from inference import load_inference_model
+    from preprocessing import IMG_HEIGHT, IMG_WIDTH
+
+    intra = int(os.environ.get('TF_INTRA_OP_THREADS', 0)) or None
+    inter = int(os.environ.get('TF_INTER_OP_THREADS', 0)) or None
+    model, runtime = load_inference_model(args.runtime, args.model, artifact_path=args.artifact, num_threads=intra,
+                                          intra_op_threads=intra, inter_op_threads=inter)
+    batcher = MicroBatcher(model.predict, max_batch_size=args.batch_size, max_wait_ms=args.batch_wait_ms,
+                           name='autotune').start()
+    sample = np.random.default_rng(0).random((1, IMG_HEIGHT, IMG_WIDTH, 3), dtype=np.float32)
+    batcher.predict(sample)
+    print(json.dumps({"ready": True, "runtime": runtime}), flush=True)
+    sys.stdin.readline()
+
+    latencies = []
+    deadline = time.perf_counter() + args.duration
+
+    def client():
+        while time.perf_counter() < deadline:
+            started = time.perf_counter()
+            batcher.predict(sample)
+            latencies.append((time.perf_counter() - started) * 1000.0)
+
+    clients = [threading.Thread(target=client) for _ in range(args.clients)]
+    for thread in clients:
+        thread.start()
+    for thread in clients:
+        thread.join()
+    batcher.stop()
+    print(json.dumps({"latencies_ms": [round(value, 3) for value in latencies]}), flush=True)
+
+
+def parse_list(text, cast=int):
+    return [cast(item.strip()) for item in text.split(',') if item.strip()] if text else None
+
+def parse_switch(value):
+    return value.strip().lower() in ('1', 'on', 'true', 'yes')
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Find the worker and thread layout with the best throughput under a latency SLO.")
+    parser.add_argument('command', nargs='?', choices=('sweep', 'show', 'probe'), default='sweep')
+    parser.add_argument('--output', '-o', default=os.environ.get('TUNING_PATH', TUNING_PATH))
+    parser.add_argument('--runtime', default=os.environ.get('MODEL_RUNTIME', 'keras'))
+    parser.add_argument('--model', default='best_agrosense_model.h5', help="Keras model (also the fallback for artifacts).")
+    parser.add_argument('--artifact', default=os.environ.get('MODEL_ARTIFACT_PATH'))
+    parser.add_argument('--slo-ms', type=float, default=float(os.environ.get('AUTOTUNE_SLO_MS', 500)),
+                        help="p95 inference latency every saved configuration must stay under.")
+    parser.add_argument('--duration', type=float, default=float(os.environ.get('AUTOTUNE_TRIAL_SECONDS', 8)),
+                        help="Seconds of load per configuration (after model loading and warm-up).")
+    parser.add_argument('--clients', type=int, default=int(os.environ.get('AUTOTUNE_CLIENTS', 16)),
+                        help="Concurrent requests in flight, split across the workers.")
+    parser.add_argument('--batch-size', type=int, default=int(os.environ.get('BATCH_MAX_SIZE', 16)))
+    parser.add_argument('--batch-wait-ms', type=float, default=float(os.environ.get('BATCH_MAX_WAIT_MS', 5)))
+    parser.add_argument('--workers', type=parse_list, help="Comma-separated worker counts (default: powers of two up to the CPU count).")
+    parser.add_argument('--intra', type=parse_list, help="Comma-separated intra-op thread counts (default: derived per worker count).")
+    parser.add_argument('--inter', type=parse_list, help="Comma-separated inter-op thread counts (default: 1,2).")
+    parser.add_argument('--onednn', type=lambda text: parse_list(text, parse_switch), help="Comma-separated on/off (default: off,on).")
+    args = parser.parse_args(argv)
+
+    if args.command == 'probe':
+        probe(args)
+        return 0
+    if args.command == 'show':
+        try:
+            with open(args.output, 'r') as f:
+                print_table(json.load(f))
+        except FileNotFoundError:
+            print(f"❌ {args.output} not found; run `python autotune.py` first.")
+            return 1
+        return 0
+    try:
+        print_table(sweep(args))
+    except RuntimeError as e:
+        print(f"❌ {e}")
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,205 @@
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+import numpy as np
+
+# Upper bounds (in milliseconds) of the queue-wait histogram buckets
+WAIT_BUCKETS_MS = (0.5, 1, 2, 5, 10, 20, 50, 100, 250, 500, 1000)
+
+
+class BatcherStopped(RuntimeError):
+    """Raised by submit() on a stopped batcher, and set on the futures it had not scored yet."""
+
+
+class _PendingItem:
+    __slots__ = ('sample', 'future', 'enqueued_at')
+
+    def __init__(self, sample):
+        self.sample = sample
+        self.future = Future()
+        self.enqueued_at = time.perf_counter()
+
+
+class MicroBatcher:
+    """Gathers single-image inputs from concurrent requests and scores them with one forward pass.
+
+    A background thread takes the first waiting sample, then keeps collecting until either
+    `max_batch_size` samples are queued or `max_wait_ms` has passed since that first sample.
+    Each caller gets back its own row of the batch output. Once stopped, a batcher refuses new
+    samples until start() is called again, and the samples still queued fail with BatcherStopped.
+    """
+
+    def __init__(self, predict_fn, max_batch_size=16, max_wait_ms=5.0, name='inference'):
+        if max_batch_size < 1:
+            raise ValueError("max_batch_size must be at least 1.")
+        self.predict_fn = predict_fn
+        self.max_batch_size = int(max_batch_size)
+        self.max_wait = max(float(max_wait_ms), 0.0) / 1000.0
+        self.name = name
+
+        self._queue = queue.Queue()
+        self._thread = None
+        self._stopping = threading.Event()
+        self._stopped = False
+        self._batch_buffer = None
+        self._lock = threading.Lock()
+
+        # Tuning statistics
+        self._batch_sizes = [0] * (self.max_batch_size + 1)
+        self._wait_buckets = [0] * (len(WAIT_BUCKETS_MS) + 1)
+        self._wait_sum_ms = 0.0
+        self._wait_max_ms = 0.0
+        self._items_total = 0
+        self._batches_total = 0
+        self._errors_total = 0
+        self._inference_ms_total = 0.0
+
+    # --- Lifecycle ---
+    def start(self):
+        with self._lock:
+            self._stopped = False
+            self._start_thread()
+        return self
+
+    def _start_thread(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stopping.clear()
+        self._thread = threading.Thread(target=self._run, name=f"{self.name}-batcher", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout=5.0):
+        """Stops the worker after its current batch and fails every sample still queued."""
+        with self._lock:
+            self._stopped = True
+            thread = self._thread
+        self._stopping.set()
+        self._queue.put(None)  # Wake the worker up
+        # A future's done-callback may release the last user of a retired model, and so stop
+        # this batcher, from the worker thread itself
+        if thread is not None and thread is not threading.current_thread():
+            thread.join(timeout)
+        self._fail_pending()
+
+    def _fail_pending(self):
+        while True:
+            try:
+                item = self._queue.get_nowait()
+            except queue.Empty:
+                return
+            if item is not None and not item.future.done():
+                item.future.set_exception(BatcherStopped(f"The {self.name} batcher was stopped."))
+
+    # --- Public API ---
+    def submit(self, sample):
+        """Queues one preprocessed image (HxWxC or 1xHxWxC) and returns a Future for its output row.
+
+        Raises BatcherStopped once the batcher has been stopped.
+        """
+        sample = np.asarray(sample)
+        if sample.ndim == 4:
+            sample = sample[0]
+        item = _PendingItem(sample)
+        with self._lock:
+            if self._stopped:
+                raise BatcherStopped(f"The {self.name} batcher is stopped.")
+            self._start_thread()
+            self._queue.put(item)
+        return item.future
+
+    def predict(self, sample, timeout=None):
+        """Blocking helper: submits one sample and waits for its output row."""
+        return self.submit(sample).result(timeout=timeout)
+
+    def queue_depth(self):
+        return self._queue.qsize()
+
+    # --- Worker ---
+    def _collect(self, first):
+        batch = [first]
+        deadline = first.enqueued_at + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.perf_counter()
+            try:
+                item = self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is None:
+                break
+            batch.append(item)
+        return batch
+
+    def _stack(self, batch):
+        shape = batch[0].sample.shape
+        if self._batch_buffer is None or self._batch_buffer.shape[1:] != shape:
+            self._batch_buffer = np.empty((self.max_batch_size,) + shape, dtype=np.float32)
+        inputs = self._batch_buffer[:len(batch)]
+        for i, item in enumerate(batch):
+            inputs[i] = item.sample
+        return inputs
+
+    def _run(self):
+        while not self._stopping.is_set():
+            first = self._queue.get()
+            if first is None:
+                continue
+            batch = self._collect(first)
+            started = time.perf_counter()
+            try:
+                outputs = np.asarray(self.predict_fn(self._stack(batch)))
+            except Exception as e:
+                with self._lock:
+                    self._errors_total += 1
+                for item in batch:
+                    item.future.set_exception(e)
+                continue
+
+            elapsed_ms = (time.perf_counter() - started) * 1000.0
+            self._record(batch, started, elapsed_ms)
+            for i, item in enumerate(batch):
+                item.future.set_result(outputs[i])
+
+    # --- Statistics ---
+    def _record(self, batch, started, elapsed_ms):
+        with self._lock:
+            self._batches_total += 1
+            self._items_total += len(batch)
+            self._batch_sizes[len(batch)] += 1
+            self._inference_ms_total += elapsed_ms
+            for item in batch:
+                wait_ms = (started - item.enqueued_at) * 1000.0
+                self._wait_sum_ms += wait_ms
+                self._wait_max_ms = max(self._wait_max_ms, wait_ms)
+                for i, bound in enumerate(WAIT_BUCKETS_MS):
+                    if wait_ms <= bound:
+                        self._wait_buckets[i] += 1
+                        break
+                else:
+                    self._wait_buckets[-1] += 1
+
+    def stats(self):
+        """Returns batch-size and queue-wait histograms used to tune the two batching limits."""
+        with self._lock:
+            # Per-bucket (non-cumulative) counts, keyed by each bucket's upper bound
+            wait_histogram = {f"{bound}ms": count for bound, count in zip(WAIT_BUCKETS_MS, self._wait_buckets)}
+            wait_histogram['inf'] = self._wait_buckets[-1]
+            return {
+                "max_batch_size": self.max_batch_size,
+                "max_wait_ms": self.max_wait * 1000.0,
+                "queue_depth": self._queue.qsize(),
+                "batches_total": self._batches_total,
+                "items_total": self._items_total,
+                "errors_total": self._errors_total,
+                "mean_batch_size": (self._items_total / self._batches_total) if self._batches_total else 0.0,
+                "batch_size_histogram": {
+                    str(size): count for size, count in enumerate(self._batch_sizes) if size and count
+                },
+                "queue_wait_ms": {
+                    "histogram": wait_histogram,
+                    "mean": (self._wait_sum_ms / self._items_total) if self._items_total else 0.0,
+                    "max": self._wait_max_ms,
+                },
+                "inference_ms_mean": (self._inference_ms_total / self._batches_total) if self._batches_total else 0.0,
+            }
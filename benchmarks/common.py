@@ -0,0 +1,62 @@
+"""Helpers shared by the benchmark scripts: environment capture, percentiles, JSON results."""
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+# Server settings that change benchmark results, recorded with every run
+RECORDED_ENV = (
+    'MODEL_RUNTIME', 'MODEL_ARTIFACT_PATH', 'TFLITE_NUM_THREADS', 'INFERENCE_MODE',
+    'BATCH_MAX_SIZE', 'BATCH_MAX_WAIT_MS', 'PRECHECK_MAX_SIDE', 'STREAMING_INGEST', 'INGEST_DRAFT_MIN_SIDE',
+    'WEB_CONCURRENCY', 'GUNICORN_THREADS', 'OMP_NUM_THREADS', 'TF_ENABLE_ONEDNN_OPTS',
+    'TF_INTRA_OP_THREADS', 'TF_INTER_OP_THREADS', 'TUNING_PATH',
+)
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT,
+                                       stderr=subprocess.DEVNULL, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def environment():
+    return {
+        "commit": git_commit(),
+        "timestamp": time.time(),
+        "python": sys.version.split()[0],
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "env": {name: os.environ[name] for name in RECORDED_ENV if name in os.environ},
+    }
+
+def latency_summary(seconds):
+    """Latency percentiles in milliseconds for a list of durations in seconds."""
+    if not len(seconds):
+        return {"mean_ms": None, "p50_ms": None, "p95_ms": None, "p99_ms": None, "max_ms": None}
+    ms = np.asarray(seconds, dtype=np.float64) * 1000.0
+    return {
+        "mean_ms": float(ms.mean()),
+        "p50_ms": float(np.percentile(ms, 50)),
+        "p95_ms": float(np.percentile(ms, 95)),
+        "p99_ms": float(np.percentile(ms, 99)),
+        "max_ms": float(ms.max()),
+    }
+
+def write_results(path, kind, config, results):
+    """Writes one benchmark run as JSON: {kind, environment, config, results}."""
+    report = {"kind": kind, "environment": environment(), "config": config, "results": results}
+    if path:
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        with open(path, 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f"Results written to {path}")
+    return report
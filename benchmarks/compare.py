@@ -0,0 +1,82 @@
+"""Compares two benchmark result files and flags regressions.
+
+    python benchmarks/compare.py results/main.json results/branch.json --threshold 0.10
+
+Runs are matched by their parameters (stage and size for micro-benchmarks; server, size, payload
+and concurrency for load tests). A latency that grows, or a throughput that drops, by more than
+the threshold is a regression, and the exit code is then 1.
+"""
+import argparse
+import json
+import sys
+
+# Identifying fields, and {metric: True if higher is better}, per result kind
+KINDS = {
+    'loadtest': (('server', 'size', 'payload', 'concurrency'),
+                 {'throughput_rps': True, 'p50_ms': False, 'p95_ms': False, 'p99_ms': False}),
+    'microbench': (('stage', 'size'),
+                   {'p50_ms': False, 'p95_ms': False, 'mean_ms': False}),
+}
+
+
+def load(path):
+    with open(path, 'r') as f:
+        report = json.load(f)
+    if report.get('kind') not in KINDS:
+        raise ValueError(f"{path}: unknown benchmark kind '{report.get('kind')}'.")
+    return report
+
+def index(report):
+    keys, _ = KINDS[report['kind']]
+    return {tuple(result.get(key) for key in keys): result for result in report['results']}
+
+def compare(baseline, candidate, threshold):
+    """Returns a list of (run key, metric, old, new, relative change, regressed) rows."""
+    if baseline['kind'] != candidate['kind']:
+        raise ValueError(f"Cannot compare a {baseline['kind']} run with a {candidate['kind']} run.")
+    _, metrics = KINDS[baseline['kind']]
+    old_runs, new_runs = index(baseline), index(candidate)
+    rows = []
+    for key in old_runs.keys() & new_runs.keys():
+        for metric, higher_is_better in metrics.items():
+            old, new = old_runs[key].get(metric), new_runs[key].get(metric)
+            if not old or new is None:
+                continue
+            change = (new - old) / old
+            worse = -change if higher_is_better else change
+            rows.append((key, metric, old, new, change, worse > threshold))
+    return sorted(rows, key=lambda row: tuple(str(part) for part in row[0]) + (row[1],))
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Compare two AgroSense benchmark result files.")
+    parser.add_argument('baseline')
+    parser.add_argument('candidate')
+    parser.add_argument('--threshold', type=float, default=0.10,
+                        help="Relative change counted as a regression (0.10 = 10%%).")
+    parser.add_argument('--only-regressions', action='store_true')
+    args = parser.parse_args(argv)
+
+    baseline, candidate = load(args.baseline), load(args.candidate)
+    rows = compare(baseline, candidate, args.threshold)
+    print(f"Baseline {baseline['environment'].get('commit')} vs candidate {candidate['environment'].get('commit')} "
+          f"({baseline['kind']}, threshold {args.threshold:.0%})")
+    if baseline['environment'].get('cpu_count') != candidate['environment'].get('cpu_count'):
+        print("⚠️ The runs were made on machines with different CPU counts.")
+
+    regressions = 0
+    for key, metric, old, new, change, regressed in rows:
+        regressions += regressed
+        if args.only_regressions and not regressed:
+            continue
+        label = ' '.join(str(part) for part in key if part is not None)
+        flag = '❌ REGRESSION' if regressed else ''
+        print(f"{label:<40}{metric:<16}{old:12.3f}{new:12.3f}{change:+9.1%}  {flag}")
+
+    if not rows:
+        print("No matching runs to compare.")
+    print(f"\n{regressions} regression(s) in {len(rows)} comparison(s).")
+    return 1 if regressions else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,62 @@
+"""Load-test comparison of the sync (Flask/gthread) and async (Starlette/uvicorn) servers.
+
+    python benchmarks/compare_servers.py --requests 300 --concurrency 1,8,32,64
+    python benchmarks/compare_servers.py --sync-url http://host:8081 --async-url http://host:8082
+
+Without URLs, both servers are started locally under gunicorn with stubbed external services
+and the result cache disabled (see loadtest.py), so every request pays for decoding and
+inference. Each run reports throughput, latency percentiles and how many requests were shed
+with 503.
+"""
+import argparse
+import sys
+from contextlib import ExitStack
+
+from common import write_results
+from loadtest import PAYLOADS, LocalServer, parse_list, print_table, run_load, wait_ready
+from synthetic import SIZES, leaf_jpegs
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Compare the sync and async AgroSense servers under load.")
+    parser.add_argument('--sync-url', help="Use an already running sync server instead of starting one.")
+    parser.add_argument('--async-url', help="Use an already running async server instead of starting one.")
+    parser.add_argument('--sync-port', type=int, default=8081)
+    parser.add_argument('--async-port', type=int, default=8082)
+    parser.add_argument('--requests', type=int, default=200, help="Requests per concurrency level.")
+    parser.add_argument('--concurrency', default='1,8,32', help="Comma-separated client concurrency levels.")
+    parser.add_argument('--images', type=int, default=16, help="Distinct synthetic images to cycle through.")
+    parser.add_argument('--size', choices=sorted(SIZES), default='medium')
+    parser.add_argument('--payload', choices=PAYLOADS, default='multipart')
+    parser.add_argument('--ready-timeout', type=float, default=300)
+    parser.add_argument('--json', help="Also write the results to this file.")
+    args = parser.parse_args(argv)
+
+    images = leaf_jpegs(args.images, args.size)
+    levels = parse_list(args.concurrency, int)
+    targets = {'sync': (args.sync_url, args.sync_port), 'async': (args.async_url, args.async_port)}
+
+    results = []
+    for mode, (url, port) in targets.items():
+        with ExitStack() as stack:
+            if url is None:
+                url = stack.enter_context(LocalServer(mode, port)).url
+            if not wait_ready(url, args.ready_timeout):
+                print(f"❌ {mode} server at {url} did not become ready.")
+                continue
+            run_load(url, images, min(args.requests, 20), max(levels))  # warm-up
+            for level in levels:
+                run = run_load(url, images, args.requests, level, args.payload)
+                run.update(server=mode, size=args.size)
+                print(f"{mode} c={level}: {run['throughput_rps']:.2f} req/s, p95 {run['p95_ms']} ms, {run['shed_503']} shed")
+                results.append(run)
+
+    print_table(results)
+    config = {"requests": args.requests, "concurrency": levels, "images": args.images,
+              "size": args.size, "payload": args.payload}
+    write_results(args.json, 'loadtest', config, results)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
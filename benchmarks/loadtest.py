@@ -0,0 +1,214 @@
+"""Load test of /predict: throughput and p50/p95/p99 latency by concurrency, payload type and image size.
+
+    python benchmarks/loadtest.py --output results/loadtest.json
+    python benchmarks/loadtest.py --server async --concurrency 1,8,32 --sizes small,large --payloads base64
+    python benchmarks/loadtest.py --url http://127.0.0.1:8080 --requests 500
+
+Without --url the server is started locally under gunicorn with every external service stubbed
+(SIDE_EFFECT_SINKS=stub, TRANSLATOR_BACKEND=stub), a throwaway translation store, Firebase
+outbox and dead-letter file, and the result cache disabled, so each request pays for ingestion, decoding, pre-checks
+and inference. Compare two result files with benchmarks/compare.py.
+"""
+import argparse
+import base64
+import itertools
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+from common import ROOT, latency_summary, write_results
+from synthetic import SIZES, leaf_jpegs
+
+SERVERS = {
+    'sync': ['gunicorn', '-c', 'gunicorn.conf.py', 'app:app'],
+    'async': ['gunicorn', '-c', 'gunicorn.conf.py', '-k', 'uvicorn.workers.UvicornWorker', 'asgi_app:app'],
+}
+PAYLOADS = ('multipart', 'base64', 'raw')
+
+
+# --- Servers ---
+def server_env(port, workdir, **overrides):
+    """Environment for a local server whose external services are all stubbed out."""
+    env = dict(os.environ,
+               PORT=str(port),
+               SIDE_EFFECT_SINKS='stub',
+               TRANSLATOR_BACKEND='stub',
+               TRANSLATION_STORE_PATH=os.path.join(workdir, 'translations.sqlite3'),
+               DEAD_LETTER_PATH=os.path.join(workdir, 'dead_letter.jsonl'),
+               FIREBASE_OUTBOX_PATH=os.path.join(workdir, 'firebase_outbox.sqlite3'),
+               ANALYTICS_PATH=os.path.join(workdir, 'analytics.log'),
+               RESULT_CACHE_SIZE='0')
+    env.update({name: str(value) for name, value in overrides.items()})
+    return env
+
+class LocalServer:
+    """A gunicorn server started for the duration of a `with` block."""
+
+    def __init__(self, mode, port, **env_overrides):
+        self.mode = mode
+        self.url = f"http://127.0.0.1:{port}"
+        self.port = port
+        self.env_overrides = env_overrides
+        self.workdir = None
+        self.process = None
+
+    def __enter__(self):
+        self.workdir = tempfile.mkdtemp(prefix='agrosense-bench-')
+        self.process = subprocess.Popen(SERVERS[self.mode], cwd=ROOT,
+                                        env=server_env(self.port, self.workdir, **self.env_overrides))
+        return self
+
+    def __exit__(self, *exc_info):
+        self.process.terminate()
+        try:
+            self.process.wait(30)
+        except subprocess.TimeoutExpired:
+            self.process.kill()
+        shutil.rmtree(self.workdir, ignore_errors=True)
+        return False
+
+def wait_ready(base_url, timeout):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            if requests.get(f"{base_url}/health/ready", timeout=2).status_code == 200:
+                return True
+        except requests.RequestException:
+            pass
+        time.sleep(1)
+    return False
+
+
+# --- Load ---
+def request_body(payload, image_bytes):
+    """Keyword arguments for requests.post carrying one image as multipart, base64 JSON or the raw body."""
+    if payload == 'multipart':
+        return {'files': {'file': ('leaf.jpg', image_bytes, 'image/jpeg')}}
+    if payload == 'base64':
+        return {'json': {'file': base64.b64encode(image_bytes).decode('ascii')}}
+    if payload == 'raw':
+        return {'data': image_bytes, 'headers': {'Content-Type': 'image/jpeg'}}
+    raise ValueError(f"Unknown payload type '{payload}'. Expected one of {PAYLOADS}.")
+
+def run_load(base_url, images, total, concurrency, payload='multipart', lang='en'):
+    """Sends `total` requests from `concurrency` client threads, cycling through `images`."""
+    bodies = [request_body(payload, image) for image in images]
+    sessions = {}
+
+    def one(i):
+        session = sessions.setdefault(i % concurrency, requests.Session())
+        started = time.perf_counter()
+        try:
+            response = session.post(f"{base_url}/predict", params={'lang': lang}, timeout=120,
+                                    **bodies[i % len(bodies)])
+            status = response.status_code
+        except requests.RequestException:
+            status = 0
+        return status, time.perf_counter() - started
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        results = list(pool.map(one, range(total)))
+    elapsed = time.perf_counter() - started
+
+    statuses = [status for status, _ in results]
+    ok = [latency for status, latency in results if status == 200]
+    run = {
+        "payload": payload,
+        "concurrency": concurrency,
+        "requests": total,
+        "ok": len(ok),
+        "shed_503": statuses.count(503),
+        "errors": sum(1 for status in statuses if status not in (200, 503)),
+        "elapsed_s": elapsed,
+        "throughput_rps": len(ok) / elapsed if elapsed else 0.0,
+        "request_bytes": sum(len(image) for image in images) // len(images),
+    }
+    run.update(latency_summary(ok))
+    return run
+
+def run_matrix(base_url, sizes, payloads, levels, requests_per_run, images_per_size, seed=0):
+    """Runs every (size, payload, concurrency) combination once after a short warm-up."""
+    results = []
+    for size in sizes:
+        images = leaf_jpegs(images_per_size, size, seed)
+        run_load(base_url, images, min(requests_per_run, 20), max(levels))  # warm-up
+        for payload, level in itertools.product(payloads, levels):
+            run = run_load(base_url, images, requests_per_run, level, payload)
+            run["size"] = size
+            p95 = f"{run['p95_ms']:.1f}" if run['p95_ms'] is not None else '-'
+            print(f"{size} {payload} c={level}: {run['throughput_rps']:.2f} req/s, p95 {p95} ms, "
+                  f"{run['shed_503']} shed, {run['errors']} errors")
+            results.append(run)
+    return results
+
+def print_table(results):
+    fmt = lambda v: f"{v:9.1f}" if v is not None else f"{'-':>9}"
+    print(f"\n{'server':<7}{'size':<8}{'payload':<10}{'conc':>5}{'ok':>6}{'503':>5}{'err':>5}"
+          f"{'rps':>9}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}")
+    for run in results:
+        print(f"{run.get('server', '-'):<7}{run['size']:<8}{run['payload']:<10}{run['concurrency']:>5}"
+              f"{run['ok']:>6}{run['shed_503']:>5}{run['errors']:>5}{run['throughput_rps']:9.2f}"
+              f"{fmt(run['p50_ms'])}{fmt(run['p95_ms'])}{fmt(run['p99_ms'])}")
+
+
+def parse_list(text, cast=str):
+    return [cast(item.strip()) for item in text.split(',') if item.strip()]
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Load-test the AgroSense /predict endpoint.")
+    parser.add_argument('--url', help="Use an already running server instead of starting one.")
+    parser.add_argument('--server', choices=sorted(SERVERS), default='sync', help="Server to start without --url.")
+    parser.add_argument('--port', type=int, default=8090)
+    parser.add_argument('--concurrency', default='1,4,16', help="Comma-separated client concurrency levels.")
+    parser.add_argument('--payloads', default=','.join(PAYLOADS), help="Comma-separated: multipart, base64, raw.")
+    parser.add_argument('--sizes', default='small,medium,large', help=f"Comma-separated image sizes: {', '.join(SIZES)}.")
+    parser.add_argument('--requests', type=int, default=100, help="Requests per combination.")
+    parser.add_argument('--images', type=int, default=8, help="Distinct synthetic images per size.")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--ready-timeout', type=float, default=300)
+    parser.add_argument('--output', '-o', help="Write the results to this JSON file.")
+    args = parser.parse_args(argv)
+
+    config = {
+        "server": args.server if args.url is None else 'external',
+        "url": args.url,
+        "concurrency": parse_list(args.concurrency, int),
+        "payloads": parse_list(args.payloads),
+        "sizes": parse_list(args.sizes),
+        "requests": args.requests,
+        "images": args.images,
+        "seed": args.seed,
+    }
+
+    def run(url):
+        if not wait_ready(url, args.ready_timeout):
+            print(f"❌ Server at {url} did not become ready.")
+            return None
+        results = run_matrix(url, config["sizes"], config["payloads"], config["concurrency"],
+                             args.requests, args.images, args.seed)
+        for result in results:
+            result["server"] = config["server"]
+        return results
+
+    if args.url:
+        results = run(args.url)
+    else:
+        with LocalServer(args.server, args.port) as server:
+            results = run(server.url)
+    if results is None:
+        return 1
+
+    print_table(results)
+    write_results(args.output, 'loadtest', config, results)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
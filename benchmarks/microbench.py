@@ -0,0 +1,143 @@
+"""In-process micro-benchmarks of each stage of a prediction.
+
+    python benchmarks/microbench.py --output results/microbench.json
+    python benchmarks/microbench.py --sizes large --repeat 50 --skip-inference
+
+Stages: JPEG decode (full and draft), the reference and single-pass pre-checks, resize and
+normalization, model inference (batch of 1 and --batch-size) and create_telegram_message.
+Each stage is timed over --repeat calls after --warmup untimed ones. app.py is imported with
+stubbed sinks and translator, so nothing leaves the machine.
+"""
+import argparse
+import io
+import json
+import os
+import sys
+import time
+
+import numpy as np
+
+from common import ROOT, latency_summary, write_results
+from synthetic import SIZES, leaf_jpegs
+
+os.environ.setdefault('SIDE_EFFECT_SINKS', 'stub')
+os.environ.setdefault('TRANSLATOR_BACKEND', 'stub')
+
+from preprocessing import ImagePipeline, is_leaf_detected, is_low_quality_image, open_rgb  # noqa: E402
+
+
+def time_calls(fn, inputs, repeat, warmup):
+    """Calls fn on inputs (cycled) `warmup` times untimed, then `repeat` times timed."""
+    for i in range(warmup):
+        fn(inputs[i % len(inputs)])
+    durations = []
+    for i in range(repeat):
+        item = inputs[i % len(inputs)]
+        started = time.perf_counter()
+        fn(item)
+        durations.append(time.perf_counter() - started)
+    result = latency_summary(durations)
+    result["calls"] = repeat
+    result["ops_per_s"] = repeat / sum(durations) if sum(durations) else None
+    return result
+
+def image_stages(size, images, check_max_side, draft_min_side):
+    """(stage name, function, inputs) for the per-image stages at one image size."""
+    jpegs = leaf_jpegs(images, size)
+    decoded = [open_rgb(io.BytesIO(data)) for data in jpegs]
+    pipeline = ImagePipeline(check_max_side=check_max_side)
+    out = pipeline.input_buffer()
+    return [
+        ('decode_full', lambda data: open_rgb(io.BytesIO(data)), jpegs),
+        ('decode_draft', lambda data: open_rgb(io.BytesIO(data), draft_min_side), jpegs),
+        ('precheck_reference', lambda img: (is_low_quality_image(img), is_leaf_detected(img)), decoded),
+        ('precheck_pipeline', pipeline.measure, decoded),
+        ('preprocess', lambda img: pipeline.to_input(img, out), decoded),
+    ]
+
+def inference_stages(runtime, artifact_path, batch_size, num_threads):
+    """(stage name, function, inputs) for model inference, or [] when no model can be loaded."""
+    import app
+    from inference import load_inference_model
+    if artifact_path is None and runtime == app.MODEL_RUNTIME:
+        artifact_path = app.MODEL_ARTIFACT_PATH
+    if artifact_path:
+        artifact_path = os.path.join(ROOT, artifact_path)
+    try:
+        model, used = load_inference_model(runtime, os.path.join(ROOT, app.MODEL_PATH),
+                                           artifact_path=artifact_path, num_threads=num_threads)
+    except Exception as e:
+        print(f"⚠️ Skipping inference: could not load the '{runtime}' model: {e}")
+        return []
+    print(f"Benchmarking inference with the '{used}' runtime.")
+    rng = np.random.default_rng(0)
+    single = [rng.random((1, 224, 224, 3), dtype=np.float32)]
+    batch = [rng.random((batch_size, 224, 224, 3), dtype=np.float32)]
+    return [
+        (f'inference_{used}_b1', model.predict, single),
+        (f'inference_{used}_b{batch_size}', model.predict, batch),
+    ]
+
+def telegram_stages():
+    import app
+    with open(os.path.join(ROOT, 'recommendations.json'), 'r', encoding='utf-8') as f:
+        recommendations = json.load(f)
+    class_name, recs = next(iter(recommendations.items()))
+    langs = ['en'] + [lang for lang in app.UI_TEXT_MAP if lang != 'en'][:1]
+    return [
+        (f'telegram_message_{lang}',
+         lambda lang: app.create_telegram_message(class_name, 0.93, recs, lang), [lang])
+        for lang in langs
+    ]
+
+def print_table(results):
+    print(f"\n{'stage':<28}{'size':<8}{'mean ms':>10}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'ops/s':>10}")
+    for r in results:
+        print(f"{r['stage']:<28}{r.get('size') or '-':<8}{r['mean_ms']:10.3f}{r['p50_ms']:10.3f}"
+              f"{r['p95_ms']:10.3f}{r['p99_ms']:10.3f}{r['ops_per_s']:10.1f}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Micro-benchmark the AgroSense prediction stages.")
+    parser.add_argument('--sizes', default='small,medium,large', help=f"Comma-separated image sizes: {', '.join(SIZES)}.")
+    parser.add_argument('--images', type=int, default=4, help="Distinct synthetic images per size.")
+    parser.add_argument('--repeat', type=int, default=30)
+    parser.add_argument('--warmup', type=int, default=3)
+    parser.add_argument('--check-max-side', type=int, default=512, help="ImagePipeline check_max_side.")
+    parser.add_argument('--draft-min-side', type=int, default=512, help="open_rgb draft_min_side.")
+    parser.add_argument('--runtime', default=os.environ.get('MODEL_RUNTIME', 'keras'))
+    parser.add_argument('--artifact-path', help="Exported model for --runtime tflite/savedmodel.")
+    parser.add_argument('--batch-size', type=int, default=8)
+    parser.add_argument('--num-threads', type=int, default=None, help="TFLite interpreter threads.")
+    parser.add_argument('--skip-inference', action='store_true')
+    parser.add_argument('--output', '-o', help="Write the results to this JSON file.")
+    args = parser.parse_args(argv)
+
+    sizes = [size.strip() for size in args.sizes.split(',') if size.strip()]
+    config = {name: getattr(args, name) for name in
+              ('images', 'repeat', 'warmup', 'check_max_side', 'draft_min_side', 'runtime', 'batch_size', 'skip_inference')}
+    config["sizes"] = sizes
+
+    plan = []
+    for size in sizes:
+        plan.extend((size, name, fn, inputs)
+                    for name, fn, inputs in image_stages(size, args.images, args.check_max_side, args.draft_min_side))
+    if not args.skip_inference:
+        plan.extend((None, name, fn, inputs) for name, fn, inputs in
+                    inference_stages(args.runtime, args.artifact_path, args.batch_size, args.num_threads))
+    plan.extend((None, name, fn, inputs) for name, fn, inputs in telegram_stages())
+
+    results = []
+    for size, name, fn, inputs in plan:
+        result = {"stage": name, "size": size}
+        result.update(time_calls(fn, inputs, args.repeat, args.warmup))
+        print(f"{name} [{size or '-'}]: p50 {result['p50_ms']:.3f} ms")
+        results.append(result)
+
+    print_table(results)
+    write_results(args.output, 'microbench', config, results)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,93 @@
+"""Synthetic leaf photos for benchmarks, so no real dataset is needed.
+
+Each image is a green, veined leaf on a noisy soil background at camera-like sizes: it passes
+the brightness/contrast and green-ratio pre-checks, decodes like a real JPEG and differs per
+seed (so the result cache never turns a load test into a cache benchmark).
+
+    python benchmarks/synthetic.py out_dir/ --count 50 --size medium
+"""
+import argparse
+import io
+import os
+
+import numpy as np
+from PIL import Image
+
+SIZES = {
+    'small': (320, 240),       # field unit camera frame
+    'medium': (1280, 960),
+    'large': (4032, 3024),     # 12 MP phone photo
+}
+# Leaf shapes are drawn at this resolution and upscaled, which keeps generation fast
+_DRAW_SIDE = 512
+
+
+def leaf_image(width, height, seed=0):
+    rng = np.random.default_rng(seed)
+    draw_w = min(width, _DRAW_SIDE)
+    draw_h = max(1, int(round(height * draw_w / width)))
+    yy, xx = np.mgrid[0:draw_h, 0:draw_w].astype(np.float32)
+    yy = yy / draw_h - 0.5 - rng.uniform(-0.05, 0.05)
+    xx = xx / draw_w - 0.5 - rng.uniform(-0.05, 0.05)
+
+    # Rotated ellipse for the leaf blade, a midrib and side veins
+    angle = rng.uniform(0, np.pi)
+    u = xx * np.cos(angle) + yy * np.sin(angle)
+    v = -xx * np.sin(angle) + yy * np.cos(angle)
+    a, b = rng.uniform(0.32, 0.42), rng.uniform(0.14, 0.22)
+    leaf = (u / a) ** 2 + (v / b) ** 2 <= 1.0
+    veins = (np.abs(v) < 0.006) | (np.abs(np.sin((u - np.abs(v)) * 60.0)) < 0.08)
+
+    soil = np.stack([
+        rng.normal(110, 18, (draw_h, draw_w)),
+        rng.normal(85, 15, (draw_h, draw_w)),
+        rng.normal(60, 12, (draw_h, draw_w)),
+    ], axis=-1)
+    green = np.stack([
+        rng.normal(60, 10, (draw_h, draw_w)),
+        rng.normal(140, 20, (draw_h, draw_w)) - 35 * veins,
+        rng.normal(50, 10, (draw_h, draw_w)),
+    ], axis=-1)
+    # A few brown lesions, like a diseased leaf
+    for _ in range(rng.integers(0, 6)):
+        cy, cx, r = rng.uniform(-0.15, 0.15), rng.uniform(-0.25, 0.25), rng.uniform(0.01, 0.04)
+        spot = leaf & ((xx - cx) ** 2 + (yy - cy) ** 2 < r ** 2)
+        green[spot] = (120, 90, 40)
+
+    pixels = np.where(leaf[..., None], green, soil)
+    img = Image.fromarray(np.clip(pixels, 0, 255).astype(np.uint8), 'RGB')
+    if (draw_w, draw_h) != (width, height):
+        img = img.resize((width, height), Image.BICUBIC)
+        # Full-resolution sensor noise, so large images compress like real photos
+        noisy = np.asarray(img, dtype=np.int16) + rng.integers(-6, 7, (height, width, 1), dtype=np.int16)
+        img = Image.fromarray(np.clip(noisy, 0, 255).astype(np.uint8), 'RGB')
+    return img
+
+def dark_image(width, height, seed=0):
+    """An underexposed frame that the quality pre-check rejects."""
+    rng = np.random.default_rng(seed)
+    return Image.fromarray(rng.integers(0, 8, (height, width, 3), dtype=np.uint8), 'RGB')
+
+def encode(img, fmt='JPEG', quality=85):
+    buffer = io.BytesIO()
+    img.save(buffer, format=fmt, quality=quality)
+    return buffer.getvalue()
+
+def leaf_jpegs(count, size='medium', seed=0, quality=85):
+    """`count` distinct JPEG-encoded leaves of a named size (see SIZES) or a (width, height) pair."""
+    width, height = SIZES[size] if isinstance(size, str) else size
+    return [encode(leaf_image(width, height, seed + i), quality=quality) for i in range(count)]
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Write synthetic leaf JPEGs.")
+    parser.add_argument('output_dir')
+    parser.add_argument('--count', type=int, default=20)
+    parser.add_argument('--size', choices=sorted(SIZES), default='medium')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+    os.makedirs(args.output_dir, exist_ok=True)
+    for i, data in enumerate(leaf_jpegs(args.count, args.size, args.seed)):
+        with open(os.path.join(args.output_dir, f"leaf_{args.size}_{i:04d}.jpg"), 'wb') as f:
+            f.write(data)
+    print(f"Wrote {args.count} {args.size} images to {args.output_dir}.")
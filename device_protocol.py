@@ -0,0 +1,173 @@
+"""Compact /predict protocol for constrained clients (Arduino / ESP32 camera boards).
+
+Uploads, besides the JSON (base64) and multipart forms the app already accepts:
+
+    Content-Type: image/jpeg | image/png | image/webp | application/octet-stream
+        the image file itself as the request body: no base64 (+33%) and no JSON parsing.
+    Content-Type: application/x-agrosense-frame; format=rgb565|yuv422|yuv420[; width=224; height=224][; endian=big]
+        an uncompressed frame already at the model's input size, scored without decoding or
+        resizing. rgb565 and yuv422 (YUYV) take 2 bytes per pixel, yuv420 (I420) 1.5; this
+        saves server CPU but not bandwidth, so on slow links a device-resized JPEG is smaller.
+
+Responses, chosen by the Accept header (anything else, including */* or no header, gets the
+usual JSON, so existing clients are unaffected):
+
+    application/cbor                  CBOR array [class id, confidence] (8-10 bytes)
+    application/x-agrosense-result    class id (uint16) and confidence (float32), little-endian
+
+The class id is the index in class_indices.json (the "Unknown" class when the prediction was
+relabeled), or NO_CLASS_ID if the class has no index.
+"""
+import struct
+
+import numpy as np
+from PIL import Image
+
+FRAME_TYPE = 'application/x-agrosense-frame'
+RAW_IMAGE_TYPES = frozenset(('image/jpeg', 'image/png', 'image/webp', 'application/octet-stream'))
+
+CBOR_TYPE = 'application/cbor'
+RESULT_TYPE = 'application/x-agrosense-result'
+RESPONSE_FORMATS = {'application/json': 'json', CBOR_TYPE: 'cbor', RESULT_TYPE: 'binary'}
+RESPONSE_MIMETYPES = {fmt: mimetype for mimetype, fmt in RESPONSE_FORMATS.items()}
+
+RESULT = struct.Struct('<Hf')
+NO_CLASS_ID = 0xFFFF
+
+# Bytes per pair of pixels (chroma is shared between horizontal pixel pairs)
+FRAME_FORMATS = {'rgb565': 4, 'yuv422': 4, 'yuv420': 3}
+
+
+class FrameError(ValueError):
+    pass
+
+
+# --- Content Negotiation ---
+def parse_content_type(header):
+    """('type/subtype', {param: value}) from a Content-Type header."""
+    media_type, *params = (header or '').split(';')
+    parsed = {}
+    for param in params:
+        name, _, value = param.partition('=')
+        if name.strip():
+            parsed[name.strip().lower()] = value.strip().strip('"')
+    return media_type.strip().lower(), parsed
+
+def negotiate(accept):
+    """Response format for an Accept header: 'cbor', 'binary' or 'json' (the default)."""
+    best, best_q = 'json', 0.0
+    for item in (accept or '').split(','):
+        media_type, params = parse_content_type(item)
+        fmt = RESPONSE_FORMATS.get(media_type)
+        if fmt is None:
+            continue
+        try:
+            q = float(params.get('q', 1.0))
+        except ValueError:
+            q = 0.0
+        if q > best_q:
+            best, best_q = fmt, q
+    return best
+
+
+# --- Uploads ---
+class RawFrame:
+    """An uncompressed camera frame sent as the request body."""
+    __slots__ = ('data', 'format', 'width', 'height', 'big_endian')
+
+    def __init__(self, data, format, width, height, big_endian=False):
+        if format not in FRAME_FORMATS:
+            raise FrameError(f"Unknown frame format '{format}'. Expected one of {', '.join(FRAME_FORMATS)}.")
+        if width <= 0 or height <= 0 or width % 2 or height % 2:
+            raise FrameError(f"Frame size {width}x{height} must be positive and even.")
+        expected = width * height * FRAME_FORMATS[format] // 2
+        if len(data) != expected:
+            raise FrameError(f"A {width}x{height} {format} frame is {expected} bytes, got {len(data)}.")
+        self.data = data
+        self.format = format
+        self.width = width
+        self.height = height
+        self.big_endian = big_endian
+
+    @classmethod
+    def from_params(cls, data, params, size):
+        """Frame described by Content-Type parameters, which must be at the model input `size`."""
+        try:
+            width = int(params.get('width', size[0]))
+            height = int(params.get('height', size[1]))
+        except ValueError:
+            raise FrameError("Frame width and height must be integers.")
+        if (width, height) != tuple(size):
+            raise FrameError(f"Frames must be {size[0]}x{size[1]} (the model's input size), got {width}x{height}.")
+        return cls(data, params.get('format', '').lower(), width, height, params.get('endian', 'little').lower() == 'big')
+
+    def to_rgb(self):
+        """(height, width, 3) uint8 RGB array."""
+        buf = np.frombuffer(self.data, dtype=np.uint8)
+        h, w = self.height, self.width
+        if self.format == 'rgb565':
+            value = buf.view('>u2' if self.big_endian else '<u2').reshape(h, w)
+            rgb = np.empty((h, w, 3), dtype=np.uint8)
+            # 5/6-bit channels to 8 bits, replicating the high bits into the low ones
+            r, g, b = value >> 11, (value >> 5) & 0x3F, value & 0x1F
+            rgb[..., 0] = (r << 3) | (r >> 2)
+            rgb[..., 1] = (g << 2) | (g >> 4)
+            rgb[..., 2] = (b << 3) | (b >> 2)
+            return rgb
+        if self.format == 'yuv422':
+            pairs = buf.reshape(h, w // 2, 4)  # Y0 U Y1 V
+            y = pairs[..., 0::2].reshape(h, w)
+            u = np.repeat(pairs[..., 1], 2, axis=1)
+            v = np.repeat(pairs[..., 3], 2, axis=1)
+        else:
+            plane = h * w
+            y = buf[:plane].reshape(h, w)
+            u = buf[plane:plane + plane // 4].reshape(h // 2, w // 2).repeat(2, axis=0).repeat(2, axis=1)
+            v = buf[plane + plane // 4:].reshape(h // 2, w // 2).repeat(2, axis=0).repeat(2, axis=1)
+        return yuv_to_rgb(y, u, v)
+
+    def to_image(self):
+        return Image.fromarray(self.to_rgb(), 'RGB')
+
+    def describe(self):
+        """Constructor keyword arguments (besides the data), JSON-serializable for alert payloads."""
+        return {"format": self.format, "width": self.width, "height": self.height, "big_endian": self.big_endian}
+
+def yuv_to_rgb(y, u, v):
+    """Full-range BT.601 (JFIF) YUV planes of equal size to an RGB uint8 array."""
+    y = y.astype(np.float32)
+    u = u.astype(np.float32) - 128.0
+    v = v.astype(np.float32) - 128.0
+    rgb = np.stack((y + 1.402 * v, y - 0.344136 * u - 0.714136 * v, y + 1.772 * u), axis=-1)
+    return np.clip(rgb + 0.5, 0, 255).astype(np.uint8)
+
+def open_device_upload(buffer, content_type, params, size):
+    """(file object for decode_upload, bytes-like data) for a raw image or frame body.
+
+    A frame is returned as a RawFrame in place of the file object. Raises FrameError.
+    """
+    if not len(buffer):
+        raise FrameError("The request body is empty (no image data).")
+    if content_type != FRAME_TYPE:
+        return buffer, buffer.getbuffer()
+    frame = RawFrame.from_params(buffer.getbuffer(), params, size)
+    return frame, frame.data
+
+
+# --- Responses ---
+def encode_result(response_format, class_id, confidence):
+    """Compact response body for 'cbor' or 'binary'."""
+    if class_id is None or not 0 <= class_id < NO_CLASS_ID:
+        class_id = NO_CLASS_ID
+    if response_format == 'binary':
+        return RESULT.pack(class_id, confidence)
+    if response_format == 'cbor':
+        return b'\x82' + _cbor_uint(class_id) + b'\xfa' + struct.pack('>f', confidence)
+    raise ValueError(f"Unknown compact response format '{response_format}'.")
+
+def _cbor_uint(value):
+    if value < 24:
+        return bytes((value,))
+    if value < 256:
+        return bytes((0x18, value))
+    return b'\x19' + struct.pack('>H', value)
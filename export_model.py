@@ -0,0 +1,161 @@
+"""Exports the Keras model to a lighter-weight serving artifact and checks it against the original.
+
+Examples:
+    python export_model.py --format tflite --samples survey_photos/
+    python export_model.py --format tflite --quantize dynamic --samples survey_photos/
+    python export_model.py --format tflite --quantize int8 --samples survey_photos/ -o model_int8.tflite
+    python export_model.py --format savedmodel --samples survey_photos/
+
+The artifact is written together with a `<artifact>.meta.json` file that records the accuracy
+check. The server (MODEL_RUNTIME=tflite / savedmodel) only switches to an artifact whose check
+passed: top-1 agreement with the Keras model of at least --min-agreement on the sample images.
+"""
+import argparse
+import hashlib
+import json
+import os
+import sys
+import time
+
+import numpy as np
+
+from inference import TFLiteModel, SavedModelRunner, artifact_metadata_path
+from preprocessing import IMG_HEIGHT, IMG_WIDTH, ImagePipeline, open_rgb
+from score import list_images
+
+DEFAULT_OUTPUTS = {
+    'tflite': 'best_agrosense_model.tflite',
+    'savedmodel': 'best_agrosense_model_savedmodel',
+}
+
+
+def file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+def load_samples(samples_dir, limit):
+    """Preprocessed sample images (skipping ones the pre-checks reject), as one float32 array."""
+    pipeline = ImagePipeline()
+    inputs = []
+    for path in list_images(samples_dir):
+        try:
+            error, _, array = pipeline.run(open_rgb(path))
+        except Exception as e:
+            print(f"Skipping {path}: {e}")
+            continue
+        if error is None:
+            inputs.append(array[0])
+        if len(inputs) >= limit:
+            break
+    if not inputs:
+        raise SystemExit(f"No usable sample images found in {samples_dir}.")
+    return np.stack(inputs)
+
+
+# --- Conversion ---
+def export_tflite(inference_model, output_path, quantize, samples):
+    import tensorflow as tf
+
+    converter = tf.lite.TFLiteConverter.from_concrete_functions(
+        [inference_model.forward_function], inference_model.keras_model
+    )
+    if quantize in ('dynamic', 'int8'):
+        converter.optimizations = [tf.lite.Optimize.DEFAULT]
+    if quantize == 'int8':
+        # Integer weights and activations, calibrated on the sample images; model I/O stays float32
+        def representative_dataset():
+            for i in range(len(samples)):
+                yield [samples[i:i + 1]]
+        converter.representative_dataset = representative_dataset
+        converter.target_spec.supported_ops = [tf.lite.OpsSet.TFLITE_BUILTINS_INT8]
+
+    with open(output_path, 'wb') as f:
+        f.write(converter.convert())
+
+def export_savedmodel(inference_model, output_path):
+    import tensorflow as tf
+
+    module = tf.Module()
+    module.keras_model = inference_model.keras_model
+    tf.saved_model.save(module, output_path, signatures={'serving_default': inference_model.forward_function})
+
+
+# --- Accuracy check ---
+def validate(reference, candidate, samples, batch_size, min_agreement):
+    expected = np.concatenate([reference.predict(samples[i:i + batch_size])
+                               for i in range(0, len(samples), batch_size)])
+    started = time.perf_counter()
+    actual = np.concatenate([candidate.predict(samples[i:i + batch_size])
+                             for i in range(0, len(samples), batch_size)])
+    elapsed = time.perf_counter() - started
+
+    agreement = float(np.mean(np.argmax(expected, axis=1) == np.argmax(actual, axis=1)))
+    return {
+        "samples": int(len(samples)),
+        "top1_agreement": agreement,
+        "max_abs_diff": float(np.max(np.abs(expected - actual))),
+        "mean_abs_diff": float(np.mean(np.abs(expected - actual))),
+        "candidate_ms_per_image": elapsed * 1000.0 / len(samples),
+        "min_agreement": min_agreement,
+        "passed": agreement >= min_agreement,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Export the AgroSense Keras model for lightweight serving.")
+    parser.add_argument('--model', default='best_agrosense_model.h5')
+    parser.add_argument('--format', choices=('tflite', 'savedmodel'), default='tflite')
+    parser.add_argument('--quantize', choices=('none', 'dynamic', 'int8'), default='none',
+                        help="TFLite only: dynamic-range or full int8 quantization.")
+    parser.add_argument('-o', '--output', help="Artifact path (default depends on --format).")
+    parser.add_argument('--samples', required=True, help="Directory of sample leaf images for the accuracy check.")
+    parser.add_argument('--max-samples', type=int, default=200)
+    parser.add_argument('--min-agreement', type=float, default=0.99,
+                        help="Minimum top-1 agreement with the Keras model for the artifact to be served.")
+    parser.add_argument('--batch-size', type=int, default=16)
+    parser.add_argument('--threads', type=int, default=None, help="TFLite interpreter threads for the check.")
+    args = parser.parse_args(argv)
+    if args.format == 'savedmodel' and args.quantize != 'none':
+        parser.error("--quantize only applies to --format tflite.")
+    output_path = args.output or DEFAULT_OUTPUTS[args.format]
+
+    from keras_model import InferenceModel, load_keras_model
+
+    samples = load_samples(args.samples, args.max_samples)
+    print(f"Loaded {len(samples)} sample images ({IMG_WIDTH}x{IMG_HEIGHT}).")
+    reference = InferenceModel(load_keras_model(args.model))
+
+    print(f"Exporting {args.model} -> {output_path} ({args.format}, quantize={args.quantize})...")
+    if args.format == 'tflite':
+        export_tflite(reference, output_path, args.quantize, samples)
+        candidate = TFLiteModel(model_path=output_path, num_threads=args.threads)
+    else:
+        export_savedmodel(reference, output_path)
+        candidate = SavedModelRunner(output_path)
+
+    validation = validate(reference, candidate, samples, args.batch_size, args.min_agreement)
+    metadata = {
+        "source_model": os.path.abspath(args.model),
+        "source_sha256": file_sha256(args.model),
+        "format": args.format,
+        "quantize": args.quantize,
+        "exported_at": time.time(),
+        "validation": validation,
+    }
+    with open(artifact_metadata_path(output_path), 'w') as f:
+        json.dump(metadata, f, indent=2)
+
+    print(json.dumps(validation, indent=2))
+    if not validation['passed']:
+        print(f"❌ Accuracy check failed: top-1 agreement {validation['top1_agreement']:.4f} "
+              f"< {args.min_agreement}. The server will not switch to this artifact.")
+        return 1
+    print(f"✅ Accuracy check passed. Serve it with MODEL_RUNTIME={args.format} MODEL_ARTIFACT_PATH={output_path}.")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,41 @@
+# Gunicorn configuration: `gunicorn -c gunicorn.conf.py app:app`
+# ASGI mode: `GUNICORN_WORKER_CLASS=uvicorn.workers.UvicornWorker gunicorn -c gunicorn.conf.py asgi_app:app`
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import autotune
+
+# CPU topology measured by autotune.py on this host (see app.py, CPU Tuning). Applied before the
+# app is imported, since TensorFlow reads TF_ENABLE_ONEDNN_OPTS at import. AUTOTUNE=startup runs
+# the sweep first when there is no tuning for this host's CPU count (minutes, not seconds).
+tuning_path = os.environ.get('TUNING_PATH', autotune.TUNING_PATH)
+if os.environ.get('AUTOTUNE') == 'startup' and autotune.load_tuning(tuning_path) is None:
+    autotune.main(['--output', tuning_path])
+autotune.apply_tuning(tuning_path)
+
+bind = f":{os.environ.get('PORT', '8080')}"
+workers = int(os.environ.get('WEB_CONCURRENCY', 1))
+# Threaded workers, so concurrent requests can share a micro-batch inside one worker
+# (GUNICORN_THREADS is ignored by the uvicorn worker, which sizes its own executors)
+worker_class = os.environ.get('GUNICORN_WORKER_CLASS', 'gthread')
+threads = int(os.environ.get('GUNICORN_THREADS', 8))
+timeout = int(os.environ.get('GUNICORN_TIMEOUT', 120))
+
+# Import app.py once in the master: only fork-safe resources are loaded there (see
+# load_shared_resources), and workers share those pages copy-on-write.
+preload_app = os.environ.get('GUNICORN_PRELOAD', '1') == '1'
+
+
+def post_worker_init(worker):
+    # Per-process handles (model runtime, Firebase, batcher thread) are created after the fork,
+    # in the background: the worker serves /health/live immediately and /health/ready once warm.
+    import app
+    app.worker_lifecycle.start(background=True)
+
+
+def worker_exit(server, worker):
+    # Send queued side effects and pending Firebase records before the worker goes away
+    # (anything left in the outbox is replayed by the next worker).
+    import app
+    app.shutdown_worker()
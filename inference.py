@@ -0,0 +1,233 @@
+import json
+import os
+import threading
+
+import numpy as np
+
+# TensorFlow is only imported by the runtimes that need it (see keras_model.py), so a
+# worker serving a TFLite artifact never pays for loading full TensorFlow.
+
+# Predictions below this confidence are reported as "Unknown" (unless Calibration sets another for the crop)
+UNKNOWN_THRESHOLD = 0.4
+
+RUNTIMES = ('keras', 'tflite', 'savedmodel')
+
+# --- Class Names ---
+def load_class_names(class_indices_path):
+    with open(class_indices_path, 'r') as f:
+        loaded_indices = json.load(f)
+    return {int(k): v for k, v in loaded_indices.items()}
+
+def top_k(probabilities, k):
+    """The k most probable classes of each row, best first: (indices, probabilities), each (rows, k).
+
+    A partial sort (argpartition) over the whole batch, then a sort of only the k survivors.
+    Accepts one row or a (rows, classes) batch.
+    """
+    probabilities = np.atleast_2d(probabilities)
+    k = max(1, min(int(k), probabilities.shape[-1]))
+    if k < probabilities.shape[-1]:
+        candidates = np.argpartition(probabilities, -k, axis=-1)[:, -k:]
+    else:
+        candidates = np.broadcast_to(np.arange(k), (probabilities.shape[0], k))
+    candidate_probabilities = np.take_along_axis(probabilities, candidates, axis=-1)
+    order = np.argsort(-candidate_probabilities, axis=-1, kind='stable')
+    return np.take_along_axis(candidates, order, axis=-1), np.take_along_axis(candidate_probabilities, order, axis=-1)
+
+def crop_of(class_name):
+    """Crop a class belongs to: 'Tomato___Late_blight' -> 'Tomato', 'Pepper,_bell___healthy' -> 'Pepper'."""
+    return class_name.split('_', 1)[0].rstrip(',')
+
+
+# --- Calibration ---
+class Calibration:
+    """Temperature scaling of the model's probabilities, and "Unknown" thresholds per crop.
+
+    Read from a small JSON file (missing file: temperature 1, UNKNOWN_THRESHOLD everywhere):
+
+        {"temperature": 1.4, "default_threshold": 0.4, "crop_thresholds": {"Cassava": 0.55}}
+
+    The temperature is applied to the log-probabilities of the same forward pass, which is
+    equivalent to dividing the logits by it, so calibration never costs another inference.
+    """
+
+    def __init__(self, temperature=1.0, default_threshold=UNKNOWN_THRESHOLD, crop_thresholds=None, source=None):
+        if temperature <= 0:
+            raise ValueError(f"Calibration temperature must be positive, got {temperature}.")
+        self.temperature = float(temperature)
+        self.default_threshold = float(default_threshold)
+        self.crop_thresholds = {crop: float(value) for crop, value in (crop_thresholds or {}).items()}
+        self.source = source
+
+    @classmethod
+    def load(cls, path):
+        try:
+            with open(path, 'r') as f:
+                params = json.load(f)
+        except FileNotFoundError:
+            return cls()
+        return cls(params.get('temperature', 1.0), params.get('default_threshold', UNKNOWN_THRESHOLD),
+                   params.get('crop_thresholds'), source=path)
+
+    def apply(self, probabilities):
+        """Calibrated probabilities, for one row or a batch (the last axis is the classes)."""
+        probabilities = np.asarray(probabilities, dtype=np.float32)
+        if self.temperature == 1.0:
+            return probabilities
+        logits = np.log(np.clip(probabilities, 1e-12, 1.0)) / self.temperature
+        logits -= logits.max(axis=-1, keepdims=True)
+        scaled = np.exp(logits)
+        return scaled / scaled.sum(axis=-1, keepdims=True)
+
+    def threshold_for(self, class_name):
+        return self.crop_thresholds.get(crop_of(class_name), self.default_threshold)
+
+    def is_unknown(self, class_name, confidence):
+        return confidence < self.threshold_for(class_name)
+
+    def describe(self):
+        return {"source": self.source, "temperature": self.temperature,
+                "default_threshold": self.default_threshold, "crop_thresholds": dict(self.crop_thresholds)}
+
+# --- Exported Artifacts ---
+def artifact_metadata_path(artifact_path):
+    return artifact_path.rstrip('/\\') + '.meta.json'
+
+def read_artifact_metadata(artifact_path):
+    """Returns the export metadata written by export_model.py, or None if there is none."""
+    try:
+        with open(artifact_metadata_path(artifact_path), 'r') as f:
+            return json.load(f)
+    except (FileNotFoundError, ValueError):
+        return None
+
+def _tflite_interpreter_class():
+    # Prefer the standalone interpreter packages, which do not pull in full TensorFlow
+    try:
+        from ai_edge_litert.interpreter import Interpreter
+        return Interpreter
+    except ImportError:
+        pass
+    try:
+        from tflite_runtime.interpreter import Interpreter
+        return Interpreter
+    except ImportError:
+        pass
+    import tensorflow as tf
+    return tf.lite.Interpreter
+
+class TFLiteModel:
+    """Serves an exported .tflite artifact through the lightweight TFLite interpreter.
+
+    The interpreter is not thread-safe, so calls are serialized; the micro-batcher already
+    funnels requests into one inference thread. Input tensors are resized only when the
+    batch size changes. Dropout is not exported, so there is no Monte Carlo uncertainty.
+    """
+
+    supports_uncertainty = False
+
+    def __init__(self, model_path=None, model_content=None, num_threads=None):
+        Interpreter = _tflite_interpreter_class()
+        self._interpreter = Interpreter(
+            model_path=model_path,
+            model_content=model_content,
+            num_threads=num_threads or None
+        )
+        self._input_index = self._interpreter.get_input_details()[0]['index']
+        self._output_index = self._interpreter.get_output_details()[0]['index']
+        self._batch_size = None
+        self._lock = threading.Lock()
+
+    def predict(self, images):
+        images = np.ascontiguousarray(images, dtype=np.float32)
+        with self._lock:
+            if images.shape[0] != self._batch_size:
+                self._interpreter.resize_tensor_input(self._input_index, list(images.shape))
+                self._interpreter.allocate_tensors()
+                self._batch_size = images.shape[0]
+            self._interpreter.set_tensor(self._input_index, images)
+            self._interpreter.invoke()
+            return self._interpreter.get_tensor(self._output_index).copy()
+
+class SavedModelRunner:
+    """Serves an exported SavedModel through its deterministic serving signature (no Keras deserialization)."""
+
+    supports_uncertainty = False
+
+    def __init__(self, model_path):
+        import tensorflow as tf
+        self._tf = tf
+        self._loaded = tf.saved_model.load(model_path)
+        self._serve = self._loaded.signatures['serving_default']
+        self._output_key = list(self._serve.structured_outputs.keys())[0]
+
+    def predict(self, images):
+        outputs = self._serve(self._tf.convert_to_tensor(images, dtype=self._tf.float32))
+        return outputs[self._output_key].numpy()
+
+# --- Loading ---
+def artifact_is_servable(runtime, artifact_path):
+    """True if an exported artifact exists and export_model.py recorded a passing accuracy check."""
+    metadata = read_artifact_metadata(artifact_path) if artifact_path else None
+    validation = (metadata or {}).get('validation') or {}
+    if not artifact_path or not os.path.exists(artifact_path):
+        print(f"WARNING: {runtime} artifact {artifact_path} not found; falling back to the Keras model.")
+        return False
+    if not validation.get('passed'):
+        print(f"WARNING: {runtime} artifact {artifact_path} has no passing accuracy check; falling back to the Keras model.")
+        return False
+    return True
+
+def preload_model_content(runtime, artifact_path):
+    """Reads a servable TFLite artifact into memory, or returns None.
+
+    This is safe in a gunicorn master before forking (no TensorFlow runtime, no threads): the
+    bytes are then shared copy-on-write by every worker, which only builds its own interpreter.
+    """
+    if runtime != 'tflite' or not artifact_is_servable(runtime, artifact_path):
+        return None
+    with open(artifact_path, 'rb') as f:
+        return f.read()
+
+def configure_tf_threads(intra_op_threads=None, inter_op_threads=None):
+    """Sizes TensorFlow's intra-op and inter-op thread pools (None keeps TensorFlow's default).
+
+    The pools are created by the first op a process runs, so this must happen before the model
+    loads; a later call with other values (a second model version) only logs a warning.
+    """
+    if not intra_op_threads and not inter_op_threads:
+        return
+    import tensorflow as tf
+    threading_config = tf.config.threading
+    try:
+        if intra_op_threads and threading_config.get_intra_op_parallelism_threads() != intra_op_threads:
+            threading_config.set_intra_op_parallelism_threads(intra_op_threads)
+        if inter_op_threads and threading_config.get_inter_op_parallelism_threads() != inter_op_threads:
+            threading_config.set_inter_op_parallelism_threads(inter_op_threads)
+    except RuntimeError as e:
+        print(f"WARNING: TensorFlow is already initialized; keeping its thread pools ({e}).")
+
+def load_inference_model(runtime, keras_model_path, artifact_path=None, num_threads=None, model_content=None,
+                         intra_op_threads=None, inter_op_threads=None):
+    """Loads the model for the requested runtime and returns (model, runtime actually used).
+
+    An exported artifact is only served if export_model.py recorded a passing accuracy check
+    against the Keras model; otherwise this falls back to the Keras runtime. `model_content`
+    is a TFLite artifact already read by preload_model_content. `num_threads` sizes the TFLite
+    interpreter; `intra_op_threads` / `inter_op_threads` the TensorFlow runtimes' thread pools.
+    """
+    if runtime not in RUNTIMES:
+        raise ValueError(f"Unknown model runtime '{runtime}'. Expected one of {RUNTIMES}.")
+
+    if runtime == 'tflite' and model_content is not None:
+        return TFLiteModel(model_content=model_content, num_threads=num_threads), runtime
+    if runtime != 'keras' and artifact_is_servable(runtime, artifact_path):
+        if runtime == 'tflite':
+            return TFLiteModel(model_path=artifact_path, num_threads=num_threads), runtime
+        configure_tf_threads(intra_op_threads, inter_op_threads)
+        return SavedModelRunner(artifact_path), runtime
+
+    configure_tf_threads(intra_op_threads, inter_op_threads)
+
+    from keras_model import InferenceModel, load_keras_model
+    return InferenceModel(load_keras_model(keras_model_path)), 'keras'
@@ -0,0 +1,411 @@
+"""Streaming ingestion of /predict uploads.
+
+The legacy path parses the whole JSON body into a str, base64-decodes it into a second copy
+and wraps that in BytesIO; multipart uploads are spooled and then copied out with read().
+Here the request body is read in chunks, base64 is decoded block by block into a buffer sized
+from Content-Length up front, and the decoder reads straight from that buffer. Oversized
+payloads are rejected from the Content-Length header, before any of the body is read.
+
+Compare peak allocations of both paths on a sample image with:
+    python ingest.py photo.jpg
+"""
+import binascii
+import io
+import threading
+import time
+import tracemalloc
+
+from flask import Request
+
+CHUNK_SIZE = 64 * 1024
+
+_BASE64_ALPHABET = b'ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz0123456789+/='
+_NOT_BASE64 = bytes(b for b in range(256) if b not in _BASE64_ALPHABET)
+_WHITESPACE = b' \t\r\n'
+
+
+class PayloadTooLarge(Exception):
+    pass
+
+
+class IngestBuffer(io.RawIOBase):
+    """Growable in-memory file over one bytearray: written once, then read in place.
+
+    Unlike BytesIO(data), wrapping the result costs no copy: `getbuffer()` is a memoryview of
+    the written bytes and reads go straight to the underlying bytearray. A falsy `max_bytes`
+    (None or 0) means no limit, as in check_content_length and iter_body.
+    """
+
+    def __init__(self, capacity=0, max_bytes=None):
+        super().__init__()
+        self._buffer = bytearray(max(int(capacity or 0), 0))
+        self._length = 0
+        self._position = 0
+        self.max_bytes = max_bytes or None
+
+    # --- Writing ---
+    def writable(self):
+        return True
+
+    def write(self, data):
+        end = self._length + len(data)
+        if self.max_bytes and end > self.max_bytes:
+            raise PayloadTooLarge(f"Upload exceeds the {self.max_bytes} byte limit.")
+        self._buffer[self._length:end] = data  # grows the bytearray only if the estimate was short
+        self._length = end
+        return len(data)
+
+    # --- Reading ---
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_CUR:
+            offset += self._position
+        elif whence == io.SEEK_END:
+            offset += self._length
+        self._position = max(0, offset)
+        return self._position
+
+    def tell(self):
+        return self._position
+
+    def readinto(self, b):
+        n = max(0, min(len(b), self._length - self._position))
+        b[:n] = memoryview(self._buffer)[self._position:self._position + n]
+        self._position += n
+        return n
+
+    def read(self, size=-1):
+        end = self._length if size is None or size < 0 else min(self._length, self._position + size)
+        data = bytes(memoryview(self._buffer)[self._position:end])
+        self._position = max(self._position, end)
+        return data
+
+    def getbuffer(self):
+        return memoryview(self._buffer)[:self._length]
+
+    def __len__(self):
+        return self._length
+
+
+class IngestRequest(Request):
+    """Flask request class that can receive multipart file parts straight into an IngestBuffer.
+
+    Only requests that set `upload_limit` (see read_multipart_image) use it; everything else
+    keeps werkzeug's default spooled temporary files. An upload_limit of 0 means no limit.
+    """
+    upload_limit = None
+
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        if self.upload_limit is None:
+            return super()._get_file_stream(total_content_length, content_type, filename, content_length)
+        capacity = content_length or total_content_length or 0
+        if self.upload_limit:
+            capacity = min(capacity, self.upload_limit)
+        return IngestBuffer(capacity, max_bytes=self.upload_limit)
+
+
+# --- Limits ---
+def check_content_length(content_length, max_bytes):
+    if max_bytes and content_length is not None and content_length > max_bytes:
+        raise PayloadTooLarge(f"Upload of {content_length} bytes exceeds the {max_bytes} byte limit.")
+
+def iter_body(stream, max_bytes, chunk_size=CHUNK_SIZE):
+    """Yields the request body in chunks, stopping with PayloadTooLarge past `max_bytes`."""
+    total = 0
+    while True:
+        chunk = stream.read(chunk_size)
+        if not chunk:
+            return
+        total += len(chunk)
+        if max_bytes and total > max_bytes:
+            raise PayloadTooLarge(f"Upload exceeds the {max_bytes} byte limit.")
+        yield chunk
+
+
+def read_raw_body(stream, content_length=None, max_bytes=None):
+    """Reads a body that is the image itself into an IngestBuffer sized from Content-Length."""
+    check_content_length(content_length, max_bytes)
+    buffer = IngestBuffer(content_length or 0, max_bytes=max_bytes)
+    for chunk in iter_body(stream, max_bytes):
+        buffer.write(chunk)
+    buffer.seek(0)
+    return buffer
+
+
+# --- JSON (base64) ---
+class Base64FieldDecoder:
+    """Finds one top-level string field of a JSON object in a byte stream and base64-decodes it.
+
+    The field's value is never materialized as a str: it is decoded 4 characters at a time
+    (whatever the chunk boundaries) into an IngestBuffer. Other fields are skipped. Like
+    base64.b64decode, characters outside the base64 alphabet (line breaks) are ignored;
+    the JSON escapes \\/, \\n, \\r and \\t are handled.
+    """
+
+    def __init__(self, field, capacity=0):
+        self.field = field.encode('utf-8')
+        self.output = IngestBuffer(capacity)
+        self.found = False
+        self.done = False
+        self._state = 'start'
+        self._key = bytearray()
+        self._escape = False
+        self._depth = 0
+        self._in_string = False
+        self._escape_carry = b''
+        self._base64_carry = b''
+
+    def feed(self, chunk):
+        i, n = 0, len(chunk)
+        while i < n and not self.done:
+            if self._state == 'value_string':
+                i = self._feed_value(chunk, i)
+                continue
+            c = chunk[i]
+            i += 1
+            state = self._state
+            if state == 'start':
+                if c == 0x7B:  # {
+                    self._state = 'key_or_end'
+                elif c not in _WHITESPACE:
+                    raise ValueError("Expected a JSON object.")
+            elif state == 'key_or_end':
+                if c == 0x22:  # "
+                    self._key.clear()
+                    self._state = 'key'
+                elif c == 0x7D:  # }
+                    self.done = True
+                elif c not in _WHITESPACE and c != 0x2C:  # ,
+                    raise ValueError("Malformed JSON object.")
+            elif state == 'key':
+                if self._escape:
+                    self._key.append(c)
+                    self._escape = False
+                elif c == 0x5C:  # backslash
+                    self._escape = True
+                elif c == 0x22:
+                    self._state = 'colon'
+                else:
+                    self._key.append(c)
+            elif state == 'colon':
+                if c == 0x3A:  # :
+                    self._state = 'value'
+                elif c not in _WHITESPACE:
+                    raise ValueError("Malformed JSON object.")
+            elif state == 'value':
+                if c in _WHITESPACE:
+                    continue
+                if c == 0x22 and bytes(self._key) == self.field:
+                    self.found = True
+                    self._state = 'value_string'
+                else:
+                    # Any other value: skip it, tracking strings and nesting
+                    self._state = 'skip'
+                    self._depth = 0
+                    self._in_string = False
+                    i -= 1
+            elif state == 'skip':
+                if self._in_string:
+                    if self._escape:
+                        self._escape = False
+                    elif c == 0x5C:
+                        self._escape = True
+                    elif c == 0x22:
+                        self._in_string = False
+                elif c == 0x22:
+                    self._in_string = True
+                elif c in (0x7B, 0x5B):  # { [
+                    self._depth += 1
+                elif c in (0x7D, 0x5D):  # } ]
+                    if self._depth == 0:
+                        self.done = True  # end of the enclosing object
+                    else:
+                        self._depth -= 1
+                elif c == 0x2C and self._depth == 0:
+                    self._state = 'key_or_end'
+
+    def _feed_value(self, chunk, i):
+        """Consumes base64 text up to the closing quote (or the end of the chunk)."""
+        end = chunk.find(b'"', i)
+        data = self._escape_carry + (chunk[i:] if end < 0 else chunk[i:end])
+        self._escape_carry = b''
+        if b'\\' in data:
+            if end < 0 and (len(data) - len(data.rstrip(b'\\'))) % 2:
+                # Escape split across chunks: keep the backslash for the next chunk
+                self._escape_carry, data = b'\\', data[:-1]
+            if b'\\u' in data:
+                raise ValueError("Unicode escapes are not supported in base64 image data.")
+            data = data.replace(b'\\/', b'/').replace(b'\\n', b'').replace(b'\\r', b'').replace(b'\\t', b'')
+
+        # Decode whole 4-character groups; the remainder waits for the next chunk
+        data = self._base64_carry + data.translate(None, _NOT_BASE64)
+        usable = len(data) - len(data) % 4
+        if usable:
+            self.output.write(binascii.a2b_base64(data[:usable]))
+        self._base64_carry = data[usable:]
+        if end < 0:
+            return len(chunk)
+
+        if self._base64_carry:
+            # Same failure as base64.b64decode on truncated data
+            self.output.write(binascii.a2b_base64(self._base64_carry))
+            self._base64_carry = b''
+        self.done = True
+        return end + 1
+
+    def result(self):
+        """The decoded bytes, or None if the field was missing, empty or not a string."""
+        if not self.found or not len(self.output):
+            return None
+        self.output.seek(0)
+        return self.output
+
+
+def read_json_image(stream, field='file', content_length=None, max_bytes=None):
+    """Streams a JSON body and returns an IngestBuffer with the decoded base64 `field`, or None."""
+    check_content_length(content_length, max_bytes)
+    # Decoded base64 is at most 3/4 of the body, so this capacity never has to grow
+    decoder = Base64FieldDecoder(field, capacity=(content_length or 0) * 3 // 4 + 3)
+    for chunk in iter_body(stream, max_bytes):
+        decoder.feed(chunk)
+        if decoder.done:
+            break
+    if decoder.found and not decoder.done:
+        raise ValueError("Truncated JSON body.")
+    return decoder.result()
+
+
+# --- Multipart ---
+def read_multipart_image(request, field='file', max_bytes=None):
+    """Returns (filename, IngestBuffer) for a multipart upload field, or (None, None) if absent.
+
+    With IngestRequest, werkzeug writes the part straight into the returned buffer (no spooled
+    temporary file and no read() copy).
+    """
+    check_content_length(request.content_length, max_bytes)
+    request.upload_limit = max_bytes or 0
+    upload = request.files.get(field)
+    if upload is None:
+        return None, None
+    if isinstance(upload.stream, IngestBuffer):
+        upload.stream.seek(0)
+        return upload.filename, upload.stream
+    buffer = IngestBuffer(max_bytes=max_bytes)
+    for chunk in iter(lambda: upload.stream.read(CHUNK_SIZE), b''):
+        buffer.write(chunk)
+    buffer.seek(0)
+    return upload.filename, buffer
+
+
+# --- Memory measurement ---
+class IngestStats:
+    """Per-path counts and tracemalloc peaks (Python-level allocations only, not PIL's C buffers).
+
+    Peaks are only meaningful with one request in flight at a time (tracemalloc is process-wide).
+    """
+
+    def __init__(self):
+        self.paths = {}
+        self._lock = threading.Lock()
+
+    def record(self, path, peak_bytes, seconds):
+        with self._lock:
+            self._record(path, peak_bytes, seconds)
+
+    def _record(self, path, peak_bytes, seconds):
+        entry = self.paths.setdefault(path, {"requests": 0, "peak_bytes_max": 0, "peak_bytes_total": 0, "seconds_total": 0.0})
+        entry["requests"] += 1
+        entry["seconds_total"] += seconds
+        if peak_bytes is not None:
+            entry["peak_bytes_max"] = max(entry["peak_bytes_max"], peak_bytes)
+            entry["peak_bytes_total"] += peak_bytes
+
+    def stats(self):
+        report = {}
+        with self._lock:
+            paths = {path: dict(entry) for path, entry in self.paths.items()}
+        for path, entry in paths.items():
+            count = entry["requests"]
+            report[path] = {
+                "requests": count,
+                "peak_bytes_max": entry["peak_bytes_max"],
+                "peak_bytes_mean": entry["peak_bytes_total"] / count if count else 0.0,
+                "ms_mean": entry["seconds_total"] * 1000.0 / count if count else 0.0,
+            }
+        return {"tracing": tracemalloc.is_tracing(), "paths": report}
+
+class measure_peak:
+    """Context manager: peak Python allocation (bytes above the starting level) while inside it."""
+
+    def __enter__(self):
+        self.peak_bytes = None
+        self.started = time.perf_counter()
+        if tracemalloc.is_tracing():
+            tracemalloc.reset_peak()
+            self._baseline = tracemalloc.get_traced_memory()[0]
+        return self
+
+    def __exit__(self, *exc_info):
+        self.seconds = time.perf_counter() - self.started
+        if tracemalloc.is_tracing():
+            self.peak_bytes = tracemalloc.get_traced_memory()[1] - self._baseline
+        return False
+
+
+# --- Before/after comparison ---
+def _compare(image_path, draft_min_side):
+    import base64
+    import json
+    from werkzeug.test import EnvironBuilder
+
+    from preprocessing import open_rgb
+
+    with open(image_path, 'rb') as f:
+        raw = f.read()
+    json_body = json.dumps({"file": base64.b64encode(raw).decode('ascii')}).encode('ascii')
+
+    def json_environ():
+        return EnvironBuilder(method='POST', data=json_body, content_type='application/json').get_environ()
+
+    def multipart_environ():
+        return EnvironBuilder(method='POST', data={'file': (io.BytesIO(raw), 'leaf.jpg')}).get_environ()
+
+    def legacy_json():
+        data = Request(json_environ()).get_json()
+        return open_rgb(io.BytesIO(base64.b64decode(data['file'])))
+
+    def streaming_json():
+        req = IngestRequest(json_environ())
+        return open_rgb(read_json_image(req.stream, 'file', req.content_length), draft_min_side)
+
+    def legacy_multipart():
+        return open_rgb(io.BytesIO(Request(multipart_environ()).files['file'].read()))
+
+    def streaming_multipart():
+        _, buffer = read_multipart_image(IngestRequest(multipart_environ()), 'file')
+        return open_rgb(buffer, draft_min_side)
+
+    tracemalloc.start()
+    print(f"{image_path}: {len(raw)} bytes, JSON body {len(json_body)} bytes")
+    for name, fn in (('json legacy', legacy_json), ('json streaming', streaming_json),
+                     ('multipart legacy', legacy_multipart), ('multipart streaming', streaming_multipart)):
+        fn()  # warm up imports and plugin registration
+        with measure_peak() as measured:
+            img = fn()
+        print(f"  {name:<20} peak {measured.peak_bytes / 1e6:8.2f} MB  {measured.seconds * 1000:7.1f} ms  decoded {img.size}")
+    tracemalloc.stop()
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Compare peak allocations of legacy and streaming ingestion.")
+    parser.add_argument('image')
+    parser.add_argument('--draft-min-side', type=int, default=512)
+    args = parser.parse_args()
+    _compare(args.image, args.draft_min_side)
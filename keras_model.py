@@ -0,0 +1,104 @@
+import threading
+from contextlib import contextmanager
+
+import tensorflow as tf
+from tensorflow.keras.models import load_model
+
+from preprocessing import IMG_HEIGHT, IMG_WIDTH
+
+# --- Custom Keras Objects (Crucial for loading your model) ---
+class F1Score(tf.keras.metrics.Metric):
+    def __init__(self, name="f1_score", **kwargs):
+        super(F1Score, self).__init__(name=name, **kwargs)
+        self.precision = tf.keras.metrics.Precision()
+        self.recall = tf.keras.metrics.Recall()
+
+    def update_state(self, y_true, y_pred, sample_weight=None):
+        self.precision.update_state(y_true, y_pred, sample_weight)
+        self.recall.update_state(y_true, y_pred, sample_weight)
+
+    def result(self):
+        precision = self.precision.result()
+        recall = self.recall.result()
+        return 2 * (precision * recall) / (precision + recall + tf.keras.backend.epsilon())
+
+    def reset_state(self):
+        self.precision.reset_state()
+        self.recall.reset_state()
+
+# Whether FixedDropout is active. It is read while a forward pass is traced, so the
+# deterministic and Monte Carlo graphs built by InferenceModel each bake in their own setting.
+_dropout_state = threading.local()
+
+@contextmanager
+def stochastic_dropout(enabled):
+    previous = getattr(_dropout_state, 'enabled', True)
+    _dropout_state.enabled = enabled
+    try:
+        yield
+    finally:
+        _dropout_state.enabled = previous
+
+class FixedDropout(tf.keras.layers.Dropout):
+    """Dropout kept active at inference (Monte Carlo dropout), unless traced inside stochastic_dropout(False)."""
+    def call(self, inputs, training=None):
+        if not getattr(_dropout_state, 'enabled', True):
+            return inputs
+        return super().call(inputs, training=True)
+
+# --- Loading ---
+def load_keras_model(model_path):
+    return load_model(model_path, custom_objects={
+        'F1Score': F1Score,
+        'swish': tf.keras.activations.swish,
+        'FixedDropout': FixedDropout
+    })
+
+class InferenceModel:
+    """Compiled forward passes over a loaded Keras model, with a fixed (N, 224, 224, 3) float32 signature.
+
+    `predict` is the deterministic fast path: dropout is removed from the traced graph and every
+    layer runs in inference mode. `predict_with_uncertainty` repeats each image `samples` times
+    inside a single batched call with dropout active, and returns the per-class mean and variance.
+    """
+
+    supports_uncertainty = True
+
+    def __init__(self, keras_model):
+        self.keras_model = keras_model
+        image_spec = tf.TensorSpec([None, IMG_HEIGHT, IMG_WIDTH, 3], tf.float32)
+
+        @tf.function(input_signature=[image_spec])
+        def forward(images):
+            return keras_model(images, training=False)
+
+        @tf.function(input_signature=[image_spec, tf.TensorSpec([], tf.int32)])
+        def forward_mc(images, samples):
+            count = tf.shape(images)[0]
+            repeated = tf.repeat(images, samples, axis=0)
+            probabilities = keras_model(repeated, training=False)
+            probabilities = tf.reshape(probabilities, [count, samples, -1])
+            mean, variance = tf.nn.moments(probabilities, axes=[1])
+            return mean, variance
+
+        # Trace both graphs now, each with its own dropout setting; concrete functions never retrace
+        with stochastic_dropout(False):
+            self.forward_function = forward.get_concrete_function()
+        with stochastic_dropout(True):
+            self._forward_mc = forward_mc.get_concrete_function()
+
+    def predict(self, images):
+        """Deterministic class probabilities for a (N, H, W, 3) batch."""
+        return self.forward_function(tf.convert_to_tensor(images, dtype=tf.float32)).numpy()
+
+    def predict_with_uncertainty(self, images, samples):
+        """Returns (mean, variance) of `samples` stochastic passes, computed as one batched call."""
+        mean, variance = self._forward_mc(
+            tf.convert_to_tensor(images, dtype=tf.float32),
+            tf.constant(max(int(samples), 1), dtype=tf.int32)
+        )
+        return mean.numpy(), variance.numpy()
+
+    def predict_stochastic(self, images):
+        """One Monte Carlo pass per image: the model's original, non-deterministic behaviour."""
+        return self.predict_with_uncertainty(images, 1)[0]
@@ -0,0 +1,240 @@
+"""In-process latency histograms and counters, rendered in the Prometheus text format.
+
+Metrics are per process: with several gunicorn workers, each /metrics scrape reports the
+worker that answered it. Every request gets a trace (its ID comes from an X-Request-ID header
+or is generated) that collects per-stage timings, so slow requests can be logged with the
+breakdown of where their time went.
+"""
+import contextvars
+import json
+import os
+import random
+import threading
+import time
+import uuid
+from bisect import bisect_left
+
+# Upper bounds (seconds) of the latency histogram buckets
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def _label_text(names, values, extra=None):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+class Counter:
+    def __init__(self, name, help_text, labelnames=()):
+        self.name = name
+        self.help_text = help_text
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *labels, amount=1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            values = sorted(self._values.items())
+        for labels, value in values:
+            lines.append(f"{self.name}{_label_text(self.labelnames, labels)} {value}")
+        return lines
+
+
+class Histogram:
+    """Fixed-bucket histogram: one bisect and two additions per observation."""
+
+    def __init__(self, name, help_text, labelnames=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, *labels):
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = [[0] * (len(self.buckets) + 1), 0.0]
+            series[0][index] += 1
+            series[1] += value
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            series = sorted((labels, list(counts), total) for labels, (counts, total) in self._series.items())
+        for labels, counts, total in series:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += count
+                le = 'le="+Inf"' if bound == float('inf') else f'le="{bound!r}"'
+                lines.append(f"{self.name}_bucket{_label_text(self.labelnames, labels, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{_label_text(self.labelnames, labels)} {total}")
+            lines.append(f"{self.name}_count{_label_text(self.labelnames, labels)} {cumulative}")
+        return lines
+
+
+class Gauge:
+    """Value read from a callback at scrape time (queue depths, cache sizes)."""
+
+    def __init__(self, name, help_text, fn):
+        self.name = name
+        self.help_text = help_text
+        self.fn = fn
+
+    def render(self):
+        try:
+            value = self.fn()
+        except Exception:
+            return []
+        if value is None:
+            return []
+        return [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} gauge", f"{self.name} {value}"]
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = {}
+
+    def register(self, metric):
+        self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name, help_text, labelnames=()):
+        return self.register(Counter(name, help_text, labelnames))
+
+    def histogram(self, name, help_text, labelnames=(), buckets=LATENCY_BUCKETS):
+        return self.register(Histogram(name, help_text, labelnames, buckets))
+
+    def gauge(self, name, help_text, fn):
+        return self.register(Gauge(name, help_text, fn))
+
+    def render(self):
+        lines = []
+        for metric in self._metrics.values():
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = Registry()
+
+STAGE_SECONDS = REGISTRY.histogram(
+    'agrosense_stage_seconds', "Time spent in each stage of a prediction.", ('stage',))
+REQUEST_SECONDS = REGISTRY.histogram(
+    'agrosense_request_seconds', "End-to-end HTTP request latency.", ('endpoint',))
+REQUESTS = REGISTRY.counter(
+    'agrosense_requests_total', "HTTP requests by endpoint and status code.", ('endpoint', 'status'))
+PREDICTIONS = REGISTRY.counter(
+    'agrosense_predictions_total', "Predictions served by class, language and source (model or cache).",
+    ('predicted_class', 'lang', 'source'))
+ERRORS = REGISTRY.counter(
+    'agrosense_errors_total', "Requests rejected or failed, by error type.", ('type',))
+
+
+# --- Request traces ---
+_current_trace = contextvars.ContextVar('agrosense_trace', default=None)
+
+class RequestTrace:
+    __slots__ = ('trace_id', 'started', 'stages', 'attributes')
+
+    def __init__(self, trace_id):
+        self.trace_id = trace_id
+        self.started = time.perf_counter()
+        self.stages = {}
+        self.attributes = {}
+
+    def annotate(self, **attributes):
+        self.attributes.update(attributes)
+
+def begin_trace(trace_id=None):
+    """Starts the trace for the current request (thread or task) and returns it."""
+    trace = RequestTrace(trace_id or uuid.uuid4().hex)
+    _current_trace.set(trace)
+    return trace
+
+def current_trace():
+    return _current_trace.get()
+
+def annotate(**attributes):
+    trace = _current_trace.get()
+    if trace is not None:
+        trace.attributes.update(attributes)
+
+
+class stage:
+    """Times a block into agrosense_stage_seconds{stage=name} and the current request's trace."""
+    __slots__ = ('name', 'started')
+
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        elapsed = time.perf_counter() - self.started
+        STAGE_SECONDS.observe(elapsed, self.name)
+        trace = _current_trace.get()
+        if trace is not None:
+            trace.stages[self.name] = trace.stages.get(self.name, 0.0) + elapsed
+        return False
+
+def timed(name, fn):
+    """Wraps `fn` so every call is recorded as stage `name` (for calls made off the request thread)."""
+    def wrapper(*args, **kwargs):
+        with stage(name):
+            return fn(*args, **kwargs)
+    return wrapper
+
+
+# --- Slow-request log ---
+class SlowRequestLog:
+    """Writes one JSON line per sampled request slower than `threshold_ms` (0 disables it)."""
+
+    def __init__(self, threshold_ms=0.0, sample_rate=1.0, path=None):
+        self.threshold_ms = float(threshold_ms)
+        self.sample_rate = float(sample_rate)
+        self.path = path
+        self._lock = threading.Lock()
+
+    def maybe_log(self, trace, endpoint, status, duration_ms):
+        if self.threshold_ms <= 0 or duration_ms < self.threshold_ms or random.random() >= self.sample_rate:
+            return
+        line = json.dumps({
+            "event": "slow_request",
+            "trace_id": trace.trace_id,
+            "endpoint": endpoint,
+            "status": status,
+            "duration_ms": round(duration_ms, 2),
+            "stages_ms": {name: round(seconds * 1000.0, 2) for name, seconds in trace.stages.items()},
+            "attributes": trace.attributes,
+            "pid": os.getpid(),
+            "timestamp": time.time(),
+        }, default=str)
+        if self.path:
+            with self._lock, open(self.path, 'a') as f:
+                f.write(line + '\n')
+        else:
+            print(line)
+
+def finish_trace(trace, endpoint, status, slow_log=None):
+    """Records the request's latency and status; returns its duration in milliseconds."""
+    duration = time.perf_counter() - trace.started
+    REQUEST_SECONDS.observe(duration, endpoint)
+    REQUESTS.inc(endpoint, str(status))
+    if slow_log is not None:
+        slow_log.maybe_log(trace, endpoint, status, duration * 1000.0)
+    return duration * 1000.0
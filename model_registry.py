@@ -0,0 +1,527 @@
+"""Versioned model bundles, swapped in without a restart, with optional shadow evaluation.
+
+Layout of the registry directory (MODEL_REGISTRY_DIR):
+
+    models/
+        registry.json          {"active": "v2", "shadow": {"version": "v3", "sample_rate": 0.1}}
+        v2/
+            manifest.json      {"runtime": "keras", "model": "model.h5", "created": ..., "notes": ...}
+            model.h5           (or model.tflite / model_savedmodel, with export_model.py's .meta.json)
+            class_indices.json
+            calibration.json   (optional; otherwise the server's CALIBRATION_PATH applies)
+
+The version "default" is the model and class_indices.json the server was started with.
+registry.json is the desired state shared by every worker: each worker polls it, loads and
+warms up a new active version in the background, swaps it in atomically and retires the old
+one once the requests still using it have finished. At most `max_resident` (2) models are
+loaded per worker, so a shadow is unloaded before a different version is loaded as active.
+
+    python model_registry.py add v3 --model best_agrosense_model.h5 --class-indices class_indices.json
+    python model_registry.py list
+"""
+import argparse
+import gc
+import json
+import os
+import random
+import shutil
+import sys
+import tempfile
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+import numpy as np
+
+DEFAULT_VERSION = 'default'
+CONTROL_FILE = 'registry.json'
+MANIFEST_FILE = 'manifest.json'
+RUNTIMES = ('keras', 'tflite', 'savedmodel')
+
+
+class RegistryError(Exception):
+    pass
+
+
+# --- Bundles on Disk ---
+def bundle_paths(directory):
+    """Runtime and file paths of the bundle in `directory`, from its manifest."""
+    try:
+        with open(os.path.join(directory, MANIFEST_FILE), 'r') as f:
+            manifest = json.load(f)
+    except (FileNotFoundError, ValueError) as e:
+        raise RegistryError(f"{directory} has no readable {MANIFEST_FILE}: {e}")
+    runtime = manifest.get('runtime', 'keras')
+    model_path = os.path.join(directory, manifest.get('model', 'model.h5'))
+    calibration_path = os.path.join(directory, 'calibration.json')
+    return {
+        "runtime": runtime,
+        # load_inference_model falls back to a Keras model next to an artifact that is not servable
+        "keras_model_path": model_path if runtime == 'keras' else os.path.join(directory, manifest.get('keras_model', 'model.h5')),
+        "artifact_path": model_path if runtime != 'keras' else None,
+        "class_indices_path": os.path.join(directory, 'class_indices.json'),
+        "calibration_path": calibration_path if os.path.exists(calibration_path) else None,
+    }
+
+def add_bundle(root, version, model_path, class_indices_path, runtime='keras', calibration_path=None, notes=None):
+    """Copies a model (and its export metadata, if any) into a new version directory."""
+    if version == DEFAULT_VERSION or not version or os.sep in version or version.startswith('.'):
+        raise RegistryError(f"'{version}' is not a valid version name.")
+    if runtime not in RUNTIMES:
+        raise RegistryError(f"Unknown runtime '{runtime}'. Expected one of {RUNTIMES}.")
+    directory = os.path.join(root, version)
+    if os.path.exists(directory):
+        raise RegistryError(f"Version {version} already exists in {root}.")
+
+    # Assembled next to the registry and renamed into place, so workers never see half a bundle
+    os.makedirs(root, exist_ok=True)
+    staging = tempfile.mkdtemp(prefix=f'.{version}-', dir=root)
+    try:
+        model_name = 'model' + ('.h5' if runtime == 'keras' else '.tflite' if runtime == 'tflite' else '_savedmodel')
+        if os.path.isdir(model_path):
+            shutil.copytree(model_path, os.path.join(staging, model_name))
+        else:
+            shutil.copy2(model_path, os.path.join(staging, model_name))
+        metadata_path = model_path.rstrip('/\\') + '.meta.json'
+        if os.path.exists(metadata_path):
+            shutil.copy2(metadata_path, os.path.join(staging, model_name + '.meta.json'))
+        shutil.copy2(class_indices_path, os.path.join(staging, 'class_indices.json'))
+        if calibration_path:
+            shutil.copy2(calibration_path, os.path.join(staging, 'calibration.json'))
+        with open(os.path.join(staging, MANIFEST_FILE), 'w') as f:
+            json.dump({"runtime": runtime, "model": model_name, "created": time.time(), "notes": notes}, f, indent=2)
+        os.chmod(staging, 0o755)
+        os.rename(staging, directory)
+    except BaseException:
+        shutil.rmtree(staging, ignore_errors=True)
+        raise
+    return directory
+
+
+class ModelBundle:
+    """One loaded, warmed-up model version and everything needed to interpret its output.
+
+    Once retired (close()), it can no longer be acquired, and its batcher is stopped as soon as
+    the last request holding it releases it, however long after the drain timeout that is.
+    """
+
+    def __init__(self, version, model, runtime, class_names, calibration, recommendations, batcher, load_seconds):
+        self.version = version
+        self.model = model
+        self.runtime = runtime
+        self.class_names = class_names
+        self.class_ids = {name: class_id for class_id, name in class_names.items()}
+        self.calibration = calibration
+        self.recommendations = recommendations
+        self.batcher = batcher
+        self.load_seconds = load_seconds
+        self.loaded_at = time.time()
+        self.retired = False
+        self._in_use = 0
+        self._idle = threading.Condition()
+
+    def acquire(self):
+        """Holds this version for one request. Raises RegistryError if it was retired."""
+        with self._idle:
+            if self.retired:
+                raise RegistryError(f"Model {self.version} was retired.")
+            self._in_use += 1
+        return self
+
+    def release(self):
+        with self._idle:
+            self._in_use -= 1
+            idle = self._in_use <= 0
+            if idle:
+                self._idle.notify_all()
+        if idle and self.retired:
+            self.batcher.stop()
+
+    def close(self, drain_timeout=30.0):
+        """Retires this version: waits for the requests using it, then stops its batcher.
+
+        Returns False if requests were still using it after `drain_timeout`; the last of them
+        stops the batcher when it releases the bundle.
+        """
+        deadline = time.monotonic() + drain_timeout
+        with self._idle:
+            self.retired = True
+            while self._in_use > 0:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self._idle.wait(remaining)
+            drained = self._in_use <= 0
+        if drained:
+            self.batcher.stop()
+        return drained
+
+    def describe(self):
+        return {"version": self.version, "runtime": self.runtime, "classes": len(self.class_names),
+                "load_seconds": self.load_seconds, "loaded_at": self.loaded_at, "in_use": self._in_use}
+
+
+# --- Shadow Evaluation ---
+class ShadowStats:
+    """Agreement and latency of a shadow version versus the live one, over sampled requests."""
+
+    def __init__(self, version, sample_rate, window=1000):
+        self.version = version
+        self.sample_rate = sample_rate
+        self.started_at = time.time()
+        self.sampled = 0
+        self.compared = 0
+        self.agreed = 0
+        self.errors = 0
+        self.skipped = 0
+        self.disagreements = {}
+        self._live_ms = deque(maxlen=window)
+        self._shadow_ms = deque(maxlen=window)
+        self._lock = threading.Lock()
+
+    def record(self, live_class, shadow_class, live_ms, shadow_ms):
+        with self._lock:
+            self.compared += 1
+            if live_class == shadow_class:
+                self.agreed += 1
+            else:
+                pair = f"{live_class} -> {shadow_class}"
+                self.disagreements[pair] = self.disagreements.get(pair, 0) + 1
+            self._live_ms.append(live_ms)
+            self._shadow_ms.append(shadow_ms)
+
+    def stats(self):
+        def summary(values):
+            if not values:
+                return None
+            values = np.fromiter(values, dtype=np.float64)
+            return {"p50": float(np.percentile(values, 50)), "p95": float(np.percentile(values, 95)),
+                    "mean": float(values.mean())}
+        with self._lock:
+            top = sorted(self.disagreements.items(), key=lambda item: -item[1])[:10]
+            return {
+                "version": self.version,
+                "sample_rate": self.sample_rate,
+                "started_at": self.started_at,
+                "sampled": self.sampled,
+                "compared": self.compared,
+                "agreement": self.agreed / self.compared if self.compared else None,
+                "errors": self.errors,
+                "skipped": self.skipped,
+                "top_disagreements": dict(top),
+                "live_ms": summary(self._live_ms),
+                "shadow_ms": summary(self._shadow_ms),
+            }
+
+
+# --- Registry ---
+class ModelRegistry:
+    """The active model version of this worker, kept in line with registry.json.
+
+    `load_fn(version, directory)` loads and warms up a ModelBundle (`directory` is None for the
+    default version). Requests use `with registry.use() as bundle:` so the model, class names
+    and calibration they see always belong together, and a retired version is only unloaded
+    once none of them holds it (or `drain_timeout` passed). `on_swap` callbacks run after each
+    swap. A version that fails to load is reported and not retried until registry.json changes.
+    """
+
+    def __init__(self, root, load_fn, poll_interval=5.0, drain_timeout=30.0, max_resident=2, max_shadow_pending=8):
+        self.root = root
+        self.load_fn = load_fn
+        self.poll_interval = float(poll_interval)
+        self.drain_timeout = float(drain_timeout)
+        self.max_resident = max(int(max_resident), 1)
+        self.max_shadow_pending = int(max_shadow_pending)
+        self.on_swap = []
+        self.active = None
+        self.shadow = None
+        self.shadow_stats = None
+        self.swaps = 0
+        self.last_error = None
+        self._applied_stamp = None
+        self._sync_lock = threading.Lock()
+        # Held while `active` / `shadow` change and while a request acquires one of them, so a
+        # request never acquires a bundle that is already being retired
+        self._swap_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stopping = threading.Event()
+        self._thread = None
+        self._owner = None
+
+    # --- Desired State (registry.json) ---
+    @property
+    def control_path(self):
+        return os.path.join(self.root, CONTROL_FILE)
+
+    def read_control(self):
+        try:
+            with open(self.control_path, 'r') as f:
+                control = json.load(f)
+        except FileNotFoundError:
+            control = {}
+        except ValueError as e:
+            raise RegistryError(f"{self.control_path} is not valid JSON: {e}")
+        return {"active": control.get('active') or DEFAULT_VERSION, "shadow": control.get('shadow')}
+
+    def write_control(self, control):
+        os.makedirs(self.root, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(prefix='.registry-', dir=self.root)
+        with os.fdopen(fd, 'w') as f:
+            json.dump(control, f, indent=2)
+        os.chmod(tmp_path, 0o644)
+        os.replace(tmp_path, self.control_path)
+        self._wake.set()
+
+    def _control_stamp(self):
+        try:
+            stat = os.stat(self.control_path)
+        except FileNotFoundError:
+            return None
+        return (stat.st_mtime_ns, stat.st_size)
+
+    def versions(self):
+        """Versions available on disk (plus the default one)."""
+        try:
+            names = sorted(name for name in os.listdir(self.root)
+                           if os.path.exists(os.path.join(self.root, name, MANIFEST_FILE)))
+        except FileNotFoundError:
+            names = []
+        return [DEFAULT_VERSION] + names
+
+    def _check_version(self, version):
+        if version not in self.versions():
+            raise RegistryError(f"Unknown model version '{version}'.")
+
+    def request_activate(self, version):
+        """Makes `version` the active one in every worker (this one syncs immediately)."""
+        self._check_version(version)
+        control = self.read_control()
+        control["active"] = version
+        if (control.get("shadow") or {}).get("version") == version:
+            control["shadow"] = None
+        self.write_control(control)
+
+    def request_shadow(self, version, sample_rate):
+        if version is not None:
+            self._check_version(version)
+            if not 0.0 < sample_rate <= 1.0:
+                raise RegistryError("sample_rate must be in (0, 1].")
+        control = self.read_control()
+        control["shadow"] = {"version": version, "sample_rate": sample_rate} if version is not None else None
+        self.write_control(control)
+
+    # --- Loading and Swapping ---
+    def _directory(self, version):
+        return None if version == DEFAULT_VERSION else os.path.join(self.root, version)
+
+    def _load(self, version):
+        resident = sum(1 for bundle in (self.active, self.shadow) if bundle is not None)
+        if resident >= self.max_resident:
+            raise RegistryError(f"Cannot load {version}: {resident} models are already resident.")
+        started = time.perf_counter()
+        bundle = self.load_fn(version, self._directory(version))
+        print(f"✅ Model {version} loaded and warmed up in {time.perf_counter() - started:.2f}s.")
+        return bundle
+
+    def _retire(self, bundle):
+        if not bundle.close(self.drain_timeout):
+            print(f"WARNING: model {bundle.version} still had requests in flight after {self.drain_timeout}s; "
+                  f"it stops when the last one finishes.")
+        gc.collect()
+        print(f"Model {bundle.version} unloaded.")
+
+    def sync(self, force=False):
+        """Brings the active and shadow versions in line with registry.json."""
+        with self._sync_lock:
+            stamp = self._control_stamp()
+            if not force and stamp == self._applied_stamp and self.active is not None:
+                return
+            self._applied_stamp = stamp
+            try:
+                control = self.read_control()
+            except RegistryError as e:
+                self.last_error = str(e)
+                print(f"❌ {e}")
+                control = {"active": self.active.version if self.active is not None else DEFAULT_VERSION,
+                           "shadow": None}
+            try:
+                self._sync_active(control["active"])
+            except Exception as e:
+                self.last_error = f"Could not activate {control['active']}: {e}"
+                print(f"❌ {self.last_error}")
+                if self.active is None and control["active"] != DEFAULT_VERSION:
+                    # Never leave a worker without a model: fall back to the default version
+                    self._sync_active(DEFAULT_VERSION)
+            try:
+                self._sync_shadow(control.get("shadow"))
+            except Exception as e:
+                self.last_error = f"Could not start shadow {control['shadow']}: {e}"
+                print(f"❌ {self.last_error}")
+
+    def _sync_active(self, version):
+        if self.active is not None and self.active.version == version:
+            return
+        if self.shadow is not None and self.shadow.version == version:
+            with self._swap_lock:
+                new, self.shadow, self.shadow_stats = self.shadow, None, None  # promote the warm shadow
+        else:
+            if self.shadow is not None:
+                # Keep at most two models: the old active (still serving) and the new one
+                with self._swap_lock:
+                    shadow, self.shadow, self.shadow_stats = self.shadow, None, None
+                self._retire(shadow)
+            new = self._load(version)
+        with self._swap_lock:
+            old, self.active = self.active, new
+        self.swaps += 1
+        print(f"✅ Model {version} is now active" + (f" (was {old.version})." if old is not None else "."))
+        for callback in self.on_swap:
+            try:
+                callback(new)
+            except Exception as e:
+                print(f"Error in model swap callback: {e}")
+        if old is not None:
+            self._retire(old)
+
+    def _sync_shadow(self, shadow):
+        version = (shadow or {}).get("version")
+        if version == self.active.version:
+            version = None
+        if self.shadow is not None and self.shadow.version != version:
+            with self._swap_lock:
+                old, self.shadow, self.shadow_stats = self.shadow, None, None
+            self._retire(old)
+        if version is None:
+            return
+        sample_rate = float(shadow.get("sample_rate", 0.1))
+        if self.shadow is None:
+            loaded = self._load(version)
+            with self._swap_lock:
+                self.shadow, self.shadow_stats = loaded, ShadowStats(version, sample_rate)
+        else:
+            self.shadow_stats.sample_rate = sample_rate
+
+    # --- Request Path ---
+    @contextmanager
+    def use(self):
+        """The active bundle, held for the duration of a request."""
+        with self._swap_lock:
+            # Under the swap lock `active` cannot be replaced (and so retired) before it is held
+            if self.active is None:
+                raise RegistryError("No model version is loaded.")
+            bundle = self.active.acquire()
+        try:
+            yield bundle
+        finally:
+            bundle.release()
+
+    def maybe_shadow(self, sample, live_output, live_bundle, live_ms):
+        """Scores a sampled request with the shadow version in the background; never blocks or raises."""
+        shadow, stats = self.shadow, self.shadow_stats
+        if shadow is None or stats is None or random.random() >= stats.sample_rate:
+            return
+        if shadow.batcher.queue_depth() >= self.max_shadow_pending:
+            stats.skipped += 1
+            return
+        with self._swap_lock:
+            if self.shadow is not shadow:
+                return  # retired since it was sampled
+            shadow.acquire()
+        stats.sampled += 1
+        live_class = live_bundle.class_names.get(int(np.argmax(live_output)), "Unknown")
+        started = time.perf_counter()
+
+        def compare(future):
+            try:
+                shadow_class = shadow.class_names.get(int(np.argmax(future.result())), "Unknown")
+                stats.record(live_class, shadow_class, live_ms, (time.perf_counter() - started) * 1000.0)
+            except Exception:
+                stats.errors += 1
+            finally:
+                shadow.release()
+
+        try:
+            # Copied: the request thread reuses its input buffer for the next image
+            shadow.batcher.submit(np.array(sample, dtype=np.float32, copy=True)).add_done_callback(compare)
+        except Exception:
+            stats.errors += 1
+            shadow.release()
+
+    # --- Watcher Thread ---
+    def start(self):
+        """Loads the desired versions in this process, then watches registry.json for changes."""
+        with self._sync_lock:
+            if self._thread is not None and self._thread.is_alive() and self._owner == os.getpid():
+                return self
+        self.sync(force=True)
+        if self.active is None:
+            raise RegistryError(self.last_error or "No model version could be loaded.")
+        self._owner = os.getpid()
+        self._stopping.clear()
+        self._thread = threading.Thread(target=self._run, name="model-registry", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stopping.set()
+        self._wake.set()
+
+    def _run(self):
+        while not self._stopping.is_set():
+            self._wake.wait(self.poll_interval)
+            self._wake.clear()
+            if self._stopping.is_set():
+                break
+            try:
+                self.sync()
+            except Exception as e:
+                print(f"Error syncing the model registry: {e}")
+
+    def status(self):
+        try:
+            desired = self.read_control()
+        except RegistryError as e:
+            desired = {"error": str(e)}
+        return {
+            "root": self.root,
+            "desired": desired,
+            "active": self.active.describe() if self.active is not None else None,
+            "shadow": self.shadow.describe() if self.shadow is not None else None,
+            "shadow_stats": self.shadow_stats.stats() if self.shadow_stats is not None else None,
+            "available": self.versions(),
+            "swaps": self.swaps,
+            "last_error": self.last_error,
+            "pid": os.getpid(),
+        }
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Manage the AgroSense model registry.")
+    parser.add_argument('--root', default=os.environ.get('MODEL_REGISTRY_DIR', 'models'))
+    commands = parser.add_subparsers(dest='command', required=True)
+    add = commands.add_parser('add', help="Add a model version.")
+    add.add_argument('version')
+    add.add_argument('--model', required=True, help="Keras .h5, .tflite file or SavedModel directory.")
+    add.add_argument('--class-indices', required=True)
+    add.add_argument('--runtime', choices=RUNTIMES, default='keras')
+    add.add_argument('--calibration', help="calibration.json for this version.")
+    add.add_argument('--notes')
+    commands.add_parser('list', help="List versions and the desired active/shadow state.")
+    args = parser.parse_args()
+
+    registry = ModelRegistry(args.root, load_fn=None)
+    if args.command == 'add':
+        try:
+            path = add_bundle(args.root, args.version, args.model, args.class_indices, args.runtime,
+                              args.calibration, args.notes)
+        except RegistryError as e:
+            sys.exit(f"❌ {e}")
+        print(f"✅ Added {args.version} at {path}. Activate it with POST /admin/models/{args.version}/activate.")
+    else:
+        control = registry.read_control()
+        shadow = control.get('shadow') or {}
+        for version in registry.versions():
+            marks = [label for label, match in (('active', control['active']), ('shadow', shadow.get('version')))
+                     if match == version]
+            print(f"{version}{'  (' + ', '.join(marks) + ')' if marks else ''}")
@@ -0,0 +1,179 @@
+import threading
+
+import numpy as np
+from PIL import Image, ImageStat
+import cv2
+
+from metrics import stage
+
+IMG_HEIGHT = 224
+IMG_WIDTH = 224
+
+LOW_QUALITY_ERROR = "Image quality is too low (e.g., too dark, too uniform). Please upload a clearer image."
+NO_LEAF_ERROR = "No significant plant leaf detected in the image. Please upload an image of a plant leaf."
+
+# --- Image Pre-check Functions (reference implementations) ---
+def is_low_quality_image(pil_image):
+    try:
+        img_gray = pil_image.convert("L")
+        stat = ImageStat.Stat(img_gray)
+        mean_brightness = stat.mean[0]
+        stddev = stat.stddev[0]
+        return mean_brightness < 20 or stddev < 10
+    except Exception as e:
+        print(f"Error checking image quality: {e}")
+        return True
+
+def is_leaf_detected(pil_image):
+    try:
+        cv_image = np.array(pil_image)
+        cv_image = cv2.cvtColor(cv_image, cv2.COLOR_RGB2BGR)
+        hsv = cv2.cvtColor(cv_image, cv2.COLOR_BGR2HSV)
+        lower_green = np.array([20, 20, 20])
+        upper_green = np.array([90, 255, 255])
+        mask = cv2.inRange(hsv, lower_green, upper_green)
+        green_pixel_count = np.sum(mask > 0)
+        total_pixels = mask.shape[0] * mask.shape[1]
+        green_ratio = green_pixel_count / total_pixels
+        return green_ratio > 0.05
+    except Exception as e:
+        print(f"Error during leaf detection: {e}")
+        return False
+
+# --- Single-pass Pipeline ---
+def open_rgb(fp, draft_min_side=0):
+    """Decodes an image file once, converting only when it is not already RGB.
+
+    With `draft_min_side`, a JPEG at least twice that size is decoded at a reduced DCT scale
+    (1/2, 1/4 or 1/8) whose longer side is still at least `draft_min_side` pixels. This is much
+    faster and smaller than a full decode, but not pixel-identical to it.
+    """
+    img = Image.open(fp)
+    if draft_min_side and img.format == 'JPEG' and max(img.size) >= 2 * draft_min_side:
+        scale = draft_min_side / max(img.size)
+        img.draft('RGB', (max(1, int(img.size[0] * scale)), max(1, int(img.size[1] * scale))))
+    if img.mode != 'RGB':
+        return img.convert('RGB')
+    img.load()
+    return img
+
+class ImageChecks:
+    __slots__ = ('brightness', 'contrast', 'green_ratio', 'check_size')
+
+    def __init__(self, brightness, contrast, green_ratio, check_size):
+        self.brightness = brightness
+        self.contrast = contrast
+        self.green_ratio = green_ratio
+        self.check_size = check_size
+
+    def as_dict(self):
+        return {name: getattr(self, name) for name in self.__slots__}
+
+class ImagePipeline:
+    """Runs the pre-checks and builds the model input from one decoded RGB image.
+
+    The brightness/contrast and green-ratio checks are computed on a view reduced so that its
+    longer side is at most `check_max_side` pixels (0 checks at full resolution). At full
+    resolution the measurements are bit-for-bit those of is_low_quality_image and
+    is_leaf_detected. The model input is written into a caller-supplied float32 buffer, so a
+    request thread can reuse one preallocated array instead of allocating per image.
+    """
+
+    def __init__(self, size=(IMG_WIDTH, IMG_HEIGHT), min_brightness=20.0, min_contrast=10.0,
+                 min_green_ratio=0.05, check_max_side=0, reducing_gap=None):
+        self.size = tuple(size)
+        self.min_brightness = float(min_brightness)
+        self.min_contrast = float(min_contrast)
+        self.min_green_ratio = float(min_green_ratio)
+        self.check_max_side = int(check_max_side)
+        # Optional faster (but not bit-identical) resize of very large images; see Image.resize
+        self.reducing_gap = reducing_gap
+        self._lower_green = np.array([20, 20, 20], dtype=np.uint8)
+        self._upper_green = np.array([90, 255, 255], dtype=np.uint8)
+        self._local = threading.local()
+
+    # --- Checks ---
+    def check_view(self, pil_image):
+        longest = max(pil_image.size)
+        if self.check_max_side <= 0 or longest <= self.check_max_side:
+            return pil_image
+        factor = -(-longest // self.check_max_side)  # ceil division
+        return pil_image.reduce(factor)
+
+    def measure(self, pil_image):
+        with stage('precheck_view'):
+            view = self.check_view(pil_image)
+
+        # Brightness/contrast from the grayscale histogram, exactly as ImageStat computes them
+        with stage('quality_check'):
+            stat = ImageStat.Stat(view.convert("L").histogram())
+
+        # Green ratio: RGB->HSV directly (identical to RGB->BGR->HSV) and a count of in-range pixels
+        with stage('leaf_check'):
+            hsv = cv2.cvtColor(np.asarray(view), cv2.COLOR_RGB2HSV)
+            mask = cv2.inRange(hsv, self._lower_green, self._upper_green)
+            green_ratio = cv2.countNonZero(mask) / (mask.shape[0] * mask.shape[1])
+
+        return ImageChecks(stat.mean[0], stat.stddev[0], green_ratio, view.size)
+
+    def precheck(self, pil_image, checks=None):
+        """Returns the user-facing error for an image that should be rejected, or None."""
+        if checks is None:
+            try:
+                checks = self.measure(pil_image)
+            except Exception as e:
+                print(f"Error checking image: {e}")
+                return LOW_QUALITY_ERROR
+        if checks.brightness < self.min_brightness or checks.contrast < self.min_contrast:
+            return LOW_QUALITY_ERROR
+        if not checks.green_ratio > self.min_green_ratio:
+            return NO_LEAF_ERROR
+        return None
+
+    # --- Model Input ---
+    def input_buffer(self):
+        """Per-thread (1, H, W, 3) float32 buffer, reused across requests handled by that thread."""
+        buffer = getattr(self._local, 'buffer', None)
+        if buffer is None:
+            buffer = np.empty((1, self.size[1], self.size[0], 3), dtype=np.float32)
+            self._local.buffer = buffer
+        return buffer
+
+    def to_input(self, pil_image, out=None):
+        """Resizes and normalizes into `out` (allocated if None) and returns it."""
+        if out is None:
+            out = np.empty((1, self.size[1], self.size[0], 3), dtype=np.float32)
+        with stage('resize_normalize'):
+            if pil_image.size == self.size:
+                img_resized = pil_image  # e.g. a device frame sent at the input size
+            elif self.reducing_gap:
+                img_resized = pil_image.resize(self.size, reducing_gap=self.reducing_gap)
+            else:
+                img_resized = pil_image.resize(self.size)
+            out[0] = np.asarray(img_resized)
+            out /= 255.0
+        return out
+
+    def run(self, pil_image, out=None):
+        """Pre-checks and preprocesses one image. Returns (error, checks, model input or None)."""
+        try:
+            checks = self.measure(pil_image)
+        except Exception as e:
+            print(f"Error checking image: {e}")
+            return LOW_QUALITY_ERROR, None, None
+        error = self.precheck(pil_image, checks)
+        if error:
+            return error, checks, None
+        return None, checks, self.to_input(pil_image, out)
+
+# Full-resolution pipeline with the original thresholds
+default_pipeline = ImagePipeline()
+
+def precheck_image(pil_image):
+    """Returns the user-facing error for an image that should be rejected, or None if it can be scored."""
+    return default_pipeline.precheck(pil_image)
+
+# --- Model Input ---
+def preprocess_image(pil_image):
+    """Resizes and normalizes an RGB image into a (1, IMG_HEIGHT, IMG_WIDTH, 3) model input."""
+    return default_pipeline.to_input(pil_image)
@@ -0,0 +1,316 @@
+"""Recommendations indexed by class id, compiled to a memory-mapped file shared by all workers.
+
+    python recommendations_store.py [recommendations.json] [class_indices.json]
+
+prints the validation report (and exits 1 if any class has no recommendation).
+"""
+import hashlib
+import json
+import mmap
+import os
+import re
+import struct
+import sys
+import tempfile
+import threading
+import time
+from collections.abc import Mapping
+
+RECOMMENDATION_FIELDS = ('overview', 'treatment', 'prevention')
+
+# Compiled file: header, one (name offset, name length, value offset, value length) row per
+# entry, then the UTF-8 names and compact JSON values. Rows 0..class_count-1 are the model's
+# class ids, in order (value length 0: no recommendation); entries for names that are not
+# classes follow. The digest is of the source JSON and class names it was compiled from.
+MAGIC = b'AGRREC01'
+HEADER = struct.Struct('<8sII16s')
+ROW = struct.Struct('<IIII')
+
+
+def normalize_name(name):
+    """Key used to match class names that differ only in case or separators."""
+    return re.sub(r'[\s_]+', '_', name.strip().lower())
+
+def source_digest(source_bytes, class_names):
+    digest = hashlib.blake2b(source_bytes, digest_size=16)
+    digest.update(json.dumps(sorted(class_names.items())).encode('utf-8'))
+    return digest.digest()
+
+
+# --- Validation ---
+def validate(recommendations, class_names):
+    """Checks recommendations against the model's classes.
+
+    Returns (index, report): `index` maps each class id to the recommendations entry name that
+    serves it (an exact match, else a case/separator-insensitive one); the report lists the
+    classes with no entry, the inexact matches, entries that match no class and malformed ones.
+    """
+    report = {"missing": [], "case_mismatch": [], "unused": [], "invalid": []}
+    for name, entry in recommendations.items():
+        problems = entry_problems(entry)
+        if problems:
+            report["invalid"].append({"name": name, "problems": problems})
+    invalid = {item["name"] for item in report["invalid"]}
+    by_normalized = {}
+    for name in recommendations:
+        if name not in invalid:
+            by_normalized.setdefault(normalize_name(name), name)
+
+    index, used = {}, set()
+    for class_id, class_name in sorted(class_names.items()):
+        if class_name in recommendations and class_name not in invalid:
+            index[class_id] = class_name
+        elif normalize_name(class_name) in by_normalized:
+            index[class_id] = by_normalized[normalize_name(class_name)]
+            report["case_mismatch"].append({"class_id": class_id, "class": class_name, "entry": index[class_id]})
+        else:
+            report["missing"].append({"class_id": class_id, "class": class_name})
+            continue
+        used.add(index[class_id])
+    report["unused"] = sorted(name for name in recommendations if name not in used and name not in invalid)
+    return index, report
+
+def entry_problems(entry):
+    if not isinstance(entry, dict):
+        return ["not an object"]
+    problems = []
+    if not isinstance(entry.get('overview'), str):
+        problems.append("'overview' must be a string")
+    for field in ('treatment', 'prevention'):
+        value = entry.get(field)
+        if not isinstance(value, list) or not all(isinstance(item, str) for item in value):
+            problems.append(f"'{field}' must be a list of strings")
+    return problems
+
+def print_report(report, source_path):
+    for item in report["missing"]:
+        print(f"⚠️ {source_path}: no recommendation for class {item['class_id']} '{item['class']}'.")
+    for item in report["case_mismatch"]:
+        print(f"⚠️ {source_path}: class {item['class_id']} '{item['class']}' uses entry '{item['entry']}' "
+              f"(names differ in case or separators).")
+    for item in report["invalid"]:
+        print(f"❌ {source_path}: entry '{item['name']}' is malformed: {'; '.join(item['problems'])}.")
+    for name in report["unused"]:
+        if name != "Unknown":
+            print(f"ℹ️ {source_path}: entry '{name}' matches no model class.")
+
+
+# --- Compiled File ---
+def compile_file(recommendations, class_names, index, digest, compiled_path):
+    """Writes the compiled file atomically (temporary file, fsync, rename)."""
+    class_count = max(class_names) + 1 if class_names else 0
+    served = set(index.values())
+    extras = [name for name in recommendations if name not in served and not entry_problems(recommendations[name])]
+    entries = [(class_names.get(class_id, ''), index.get(class_id)) for class_id in range(class_count)]
+    entries += [(name, name) for name in extras]
+
+    rows, blob = [], bytearray()
+    for name, entry_name in entries:
+        name_bytes = name.encode('utf-8')
+        name_offset = len(blob)
+        blob += name_bytes
+        value_offset, value_length = len(blob), 0
+        if entry_name is not None:
+            value = json.dumps(recommendations[entry_name], ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+            blob += value
+            value_length = len(value)
+        rows.append(ROW.pack(name_offset, len(name_bytes), value_offset, value_length))
+
+    directory = os.path.dirname(os.path.abspath(compiled_path))
+    fd, tmp_path = tempfile.mkstemp(prefix='.recommendations-', dir=directory)
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(HEADER.pack(MAGIC, len(entries), class_count, digest))
+            f.write(b''.join(rows))
+            f.write(blob)
+            f.flush()
+            os.fsync(f.fileno())
+        os.chmod(tmp_path, 0o644)
+        os.replace(tmp_path, compiled_path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+class _Snapshot:
+    """One immutable, memory-mapped version of the compiled file."""
+
+    def __init__(self, compiled_path, stamp):
+        self.stamp = stamp
+        with open(compiled_path, 'rb') as f:
+            self.buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, self.entry_count, self.class_count, self.digest = HEADER.unpack_from(self.buffer, 0)
+        if magic != MAGIC:
+            raise ValueError(f"{compiled_path} is not a compiled recommendations file.")
+        self.blob_start = HEADER.size + self.entry_count * ROW.size
+        self.names = {}
+        for i in range(self.entry_count):
+            name = self._name(i)
+            if name:
+                self.names.setdefault(name, i)
+        self._decoded = {}
+
+    def _row(self, i):
+        return ROW.unpack_from(self.buffer, HEADER.size + i * ROW.size)
+
+    def _name(self, i):
+        name_offset, name_length, _, _ = self._row(i)
+        start = self.blob_start + name_offset
+        return self.buffer[start:start + name_length].decode('utf-8')
+
+    def value(self, i):
+        """Decoded entry `i`, or None when it has no recommendation."""
+        if not 0 <= i < self.entry_count:
+            return None
+        cached = self._decoded.get(i)
+        if cached is None:
+            _, _, value_offset, value_length = self._row(i)
+            if not value_length:
+                return None
+            start = self.blob_start + value_offset
+            cached = self._decoded[i] = json.loads(self.buffer[start:start + value_length].decode('utf-8'))
+        return cached
+
+
+class RecommendationsStore(Mapping):
+    """Read-only mapping of class name to recommendations, also indexed by model class id.
+
+    The source JSON is validated against the class names and compiled to `compiled_path`, which
+    every worker memory-maps (so the pages are shared). At most every `check_interval` seconds
+    a lookup checks the source file's mtime; when it changed, the store is recompiled (if no
+    other worker already did) and swapped in atomically, without touching the model. A source
+    that no longer parses is reported and the previous version stays in use. `on_reload`
+    callbacks run after each swap.
+    """
+
+    def __init__(self, source_path, class_names, compiled_path=None, check_interval=5.0):
+        self.source_path = source_path
+        self.class_names = dict(class_names)
+        self.compiled_path = compiled_path or os.path.splitext(source_path)[0] + '.bin'
+        self.check_interval = float(check_interval)
+        self.report = None
+        self.version = 0
+        self.reloads = 0
+        self.reload_errors = 0
+        self.on_reload = []
+        self._lock = threading.Lock()
+        self._next_check = 0.0
+        self._snapshot = self._load()
+
+    # --- Loading ---
+    def _stamp(self):
+        stat = os.stat(self.source_path)
+        return (stat.st_mtime_ns, stat.st_size)
+
+    def _load(self):
+        stamp = self._stamp()
+        with open(self.source_path, 'rb') as f:
+            source_bytes = f.read()
+        digest = source_digest(source_bytes, self.class_names)
+        recommendations = json.loads(source_bytes)
+        index, self.report = validate(recommendations, self.class_names)
+        print_report(self.report, self.source_path)
+
+        # Another worker may already have compiled this exact version
+        if not self._compiled_digest_is(digest):
+            compile_file(recommendations, self.class_names, index, digest, self.compiled_path)
+        snapshot = _Snapshot(self.compiled_path, stamp)
+        self.version += 1
+        return snapshot
+
+    def _compiled_digest_is(self, digest):
+        try:
+            with open(self.compiled_path, 'rb') as f:
+                header = f.read(HEADER.size)
+        except FileNotFoundError:
+            return False
+        if len(header) < HEADER.size:
+            return False
+        magic, _, _, compiled_digest = HEADER.unpack(header)
+        return magic == MAGIC and compiled_digest == digest
+
+    def maybe_reload(self, force=False):
+        """Reloads if the source file changed. Returns True when a new version was swapped in."""
+        now = time.monotonic()
+        if not force and (self.check_interval <= 0 or now < self._next_check):
+            return False
+        with self._lock:
+            if not force and now < self._next_check:
+                return False
+            self._next_check = now + self.check_interval
+            try:
+                if not force and self._stamp() == self._snapshot.stamp:
+                    return False
+                # Old snapshots are not closed: a reader may still hold one, and the mmap is
+                # released when the last reference goes away
+                self._snapshot = self._load()
+            except Exception as e:
+                self.reload_errors += 1
+                print(f"❌ Could not reload {self.source_path}, keeping version {self.version}: {e}")
+                return False
+            self.reloads += 1
+        print(f"✅ Recommendations reloaded (version {self.version}).")
+        for callback in self.on_reload:
+            try:
+                callback(self)
+            except Exception as e:
+                print(f"Error in recommendations reload callback: {e}")
+        return True
+
+    # --- Lookups ---
+    def by_id(self, class_id, default=None):
+        """Recommendations for a model class id (the index into the model's output)."""
+        self.maybe_reload()
+        snapshot = self._snapshot
+        if not 0 <= class_id < snapshot.class_count:
+            return default
+        value = snapshot.value(class_id)
+        return default if value is None else value
+
+    def get(self, name, default=None):
+        self.maybe_reload()
+        snapshot = self._snapshot
+        i = snapshot.names.get(name)
+        value = snapshot.value(i) if i is not None else None
+        return default if value is None else value
+
+    def __getitem__(self, name):
+        value = self.get(name)
+        if value is None:
+            raise KeyError(name)
+        return value
+
+    def __iter__(self):
+        snapshot = self._snapshot
+        return iter([name for name, i in snapshot.names.items() if snapshot.value(i) is not None])
+
+    def __len__(self):
+        return sum(1 for _ in self)
+
+    def stats(self):
+        snapshot = self._snapshot
+        return {
+            "version": self.version,
+            "entries": len(self),
+            "classes": snapshot.class_count,
+            "missing_classes": len(self.report["missing"]) if self.report else None,
+            "reloads": self.reloads,
+            "reload_errors": self.reload_errors,
+            "compiled_bytes": len(snapshot.buffer),
+        }
+
+
+if __name__ == '__main__':
+    source = sys.argv[1] if len(sys.argv) > 1 else 'recommendations.json'
+    indices = sys.argv[2] if len(sys.argv) > 2 else 'class_indices.json'
+    with open(source, 'r', encoding='utf-8') as f:
+        recommendations = json.load(f)
+    with open(indices, 'r') as f:
+        class_names = {int(k): v for k, v in json.load(f).items()}
+    _, report = validate(recommendations, class_names)
+    print_report(report, source)
+    covered = len(class_names) - len(report["missing"])
+    print(f"{covered}/{len(class_names)} classes have recommendations "
+          f"({len(report['case_mismatch'])} matched ignoring case, {len(report['invalid'])} malformed entries).")
+    sys.exit(1 if report["missing"] or report["invalid"] else 0)
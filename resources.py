@@ -0,0 +1,148 @@
+import os
+import resource
+import threading
+import time
+from contextlib import contextmanager
+
+# Import time of this module: close to process start for the master, and inherited by forked workers
+PROCESS_STARTED = time.time()
+
+
+def process_memory():
+    """Current memory use of this process in MB.
+
+    `private` (pages not shared with any other process) is the best measure of what one more
+    gunicorn worker costs once shared, preloaded pages are accounted for.
+    """
+    memory = {"max_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0}
+    try:
+        with open('/proc/self/smaps_rollup', 'r') as f:
+            fields = {}
+            for line in f:
+                parts = line.split()
+                if len(parts) >= 3 and parts[2] == 'kB':
+                    fields[parts[0].rstrip(':')] = int(parts[1])
+        memory["rss_mb"] = fields.get('Rss', 0) / 1024.0
+        memory["pss_mb"] = fields.get('Pss', 0) / 1024.0
+        memory["private_mb"] = (fields.get('Private_Clean', 0) + fields.get('Private_Dirty', 0)) / 1024.0
+        memory["shared_mb"] = (fields.get('Shared_Clean', 0) + fields.get('Shared_Dirty', 0)) / 1024.0
+    except OSError:
+        pass  # Not Linux: only max_rss_mb is available
+    return memory
+
+
+class WorkerLifecycle:
+    """Tracks the per-process resource lifecycle: fork-safe preload, per-worker init, warm-up.
+
+    `init_fn(lifecycle)` loads the per-process handles and runs the warm-up; it is run once per
+    process (again after a fork, since handles and threads do not survive one) and retried at
+    most every `retry_interval` seconds if it fails. Readiness and liveness are reported
+    separately: a worker that is still loading, or failed to load, is alive but not ready.
+    """
+
+    def __init__(self, init_fn, retry_interval=30.0):
+        self.init_fn = init_fn
+        self.retry_interval = retry_interval
+        self.process_started = PROCESS_STARTED
+        self._lock = threading.Lock()
+        self._ready = threading.Event()
+        self._reset()
+
+    def _reset(self):
+        if getattr(self, 'pid', None) not in (None, os.getpid()):
+            self.process_started = time.time()  # Forked worker: measure from the fork
+        self.pid = os.getpid()
+        self.phase = 'cold'
+        self.error = None
+        self.started_at = None
+        self.ready_at = None
+        self.first_prediction_at = None
+        self.failed_at = None
+        self.timings = {}
+        self.memory_at_ready = None
+        self._ready.clear()
+
+    # --- Lifecycle ---
+    def start(self, background=True):
+        """Starts per-process initialization unless it is already running or done in this process."""
+        with self._lock:
+            if self.pid != os.getpid():
+                self._reset()  # We are a freshly forked worker
+            if self.phase in ('initializing', 'ready'):
+                return
+            if self.phase == 'failed' and time.time() - self.failed_at < self.retry_interval:
+                return
+            self.phase = 'initializing'
+            self.error = None
+            self.started_at = time.time()
+        if background:
+            threading.Thread(target=self._initialize, name='worker-init', daemon=True).start()
+        else:
+            self._initialize()
+
+    def _initialize(self):
+        try:
+            self.init_fn(self)
+        except Exception as e:
+            import traceback
+            traceback.print_exc()
+            with self._lock:
+                self.phase = 'failed'
+                self.error = str(e)
+                self.failed_at = time.time()
+            print(f"CRITICAL ERROR during worker initialization (pid {os.getpid()}): {e}")
+            return
+        with self._lock:
+            self.phase = 'ready'
+            self.ready_at = time.time()
+            self.memory_at_ready = process_memory()
+        self._ready.set()
+        print(f"Worker {os.getpid()} ready in {self.ready_at - self.started_at:.2f}s.")
+
+    def wait_ready(self, timeout):
+        if self.pid != os.getpid():
+            return False
+        return self._ready.wait(timeout)
+
+    def is_ready(self):
+        return self.pid == os.getpid() and self.phase == 'ready'
+
+    @contextmanager
+    def step(self, name):
+        """Times one initialization step (reported as timings[name] in seconds)."""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.timings[name] = time.perf_counter() - started
+
+    def mark_prediction(self):
+        if self.first_prediction_at is None:
+            self.first_prediction_at = time.time()
+
+    # --- Reporting ---
+    def liveness(self):
+        return {
+            "status": "ok",
+            "pid": os.getpid(),
+            "uptime_seconds": time.time() - self.process_started,
+        }
+
+    def readiness(self):
+        with self._lock:
+            if self.pid != os.getpid():
+                self._reset()
+        report = {
+            "status": "ok" if self.is_ready() else "unavailable",
+            "phase": self.phase,
+            "pid": os.getpid(),
+            "error": self.error,
+            "timings_seconds": dict(self.timings),
+            "memory_at_ready": self.memory_at_ready,
+            "memory_now": process_memory(),
+        }
+        if self.ready_at is not None and self.started_at is not None:
+            report["time_to_ready_seconds"] = self.ready_at - self.started_at
+        if self.first_prediction_at is not None:
+            report["time_to_first_prediction_seconds"] = self.first_prediction_at - self.process_started
+        return report
@@ -0,0 +1,106 @@
+import json
+import threading
+
+try:
+    import orjson
+except ImportError:  # optional, faster encoder
+    orjson = None
+
+ENCODERS = ('auto', 'orjson', 'json')
+
+
+def make_encoder(name='auto'):
+    """Returns a function that serializes a value to JSON bytes with the named encoder."""
+    if name not in ENCODERS:
+        raise ValueError(f"Unknown JSON encoder '{name}'. Expected one of {ENCODERS}.")
+    if name == 'orjson' and orjson is None:
+        print("WARNING: orjson is not installed; using the standard json encoder.")
+    if name != 'json' and orjson is not None:
+        return orjson.dumps
+    return lambda value: json.dumps(value, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+
+
+class PredictionTemplate:
+    """The parts of a /predict response and Telegram caption that depend only on (class, language).
+
+    The JSON body is pre-encoded around the confidence value, so a request only encodes one
+    float (and the uncertainty and top classes, if asked for); the caption is split the same way.
+    """
+    __slots__ = ('class_name', 'lang', 'recommendations', 'json_head', 'json_tail', 'caption_head',
+                 'caption_tail', 'encode')
+
+    def __init__(self, class_name, lang, recommendations, caption_parts, encode):
+        self.class_name = class_name
+        self.lang = lang
+        self.recommendations = recommendations
+        self.encode = encode
+        # Fields in the order the endpoint's response dict listed them (jsonify then sorted the keys)
+        self.json_head = b'{"predicted_class":' + encode(class_name) + b',"confidence":'
+        self.json_tail = b',"recommendations":' + encode(recommendations)
+        self.caption_head, self.caption_tail = caption_parts
+
+    def render_json(self, confidence, uncertainty=None, top_classes=None):
+        body = self.json_head + self.encode(float(confidence)) + self.json_tail
+        if uncertainty is not None:
+            body += b',"uncertainty":' + self.encode(uncertainty)
+        if top_classes:
+            body += b',"top_k":' + self.encode(top_classes)
+        return body + b'}'
+
+    def render_caption(self, confidence):
+        return f"{self.caption_head}{confidence*100:.2f}{self.caption_tail}"
+
+
+class ResponseTemplates:
+    """Per-(class, language) PredictionTemplates, built once and reused.
+
+    `build_fn(class_name, recommendations, lang)` returns (translated recommendations,
+    (caption head, caption tail), complete). A template is only kept when `complete` is true
+    (every field really translated, not an English fallback) and `lang` is one of `languages`,
+    so a failed translation is retried on the next request and arbitrary ?lang= values cannot
+    grow the cache.
+    """
+
+    def __init__(self, build_fn, languages, encoder='auto'):
+        self.build_fn = build_fn
+        self.languages = frozenset(languages)
+        self.encode = make_encoder(encoder)
+        self._templates = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.builds = 0
+
+    def get(self, class_name, recommendations, lang):
+        key = (class_name, lang)
+        template = self._templates.get(key)
+        if template is not None:
+            with self._lock:
+                self.hits += 1
+            return template
+        translated, caption_parts, complete = self.build_fn(class_name, recommendations, lang)
+        template = PredictionTemplate(class_name, lang, translated, caption_parts, self.encode)
+        with self._lock:
+            self.builds += 1
+            if complete and lang in self.languages:
+                self._templates[key] = template
+        return template
+
+    def precompute(self, entries, is_ready):
+        """Builds templates for every (class, language) for which `is_ready(class, recs, lang)`
+        holds, i.e. whose translations are already stored. Returns the number built."""
+        built = 0
+        for class_name, recommendations in entries:
+            for lang in sorted(self.languages):
+                if (class_name, lang) not in self._templates and is_ready(class_name, recommendations, lang):
+                    self.get(class_name, recommendations, lang)
+                    built += 1
+        return built
+
+    def clear(self):
+        with self._lock:
+            self._templates.clear()
+
+    def stats(self):
+        with self._lock:
+            return {"templates": len(self._templates), "hits": self.hits, "builds": self.builds,
+                    "encoder": 'orjson' if self.encode is getattr(orjson, 'dumps', None) else 'json'}
@@ -0,0 +1,141 @@
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+
+from PIL import Image
+
+
+def content_hash(data):
+    """Exact fingerprint of an uploaded image (the decoded file bytes, not the base64 text)."""
+    return hashlib.sha256(data).hexdigest()
+
+def perceptual_hash(pil_img, hash_size=8):
+    """64-bit difference hash (dHash): survives re-encoding, small rescales and sensor noise."""
+    small = pil_img.resize((hash_size + 1, hash_size), Image.BILINEAR, reducing_gap=2.0).convert('L')
+    pixels = small.tobytes()
+    value = 0
+    for row in range(hash_size):
+        offset = row * (hash_size + 1)
+        for col in range(hash_size):
+            value = (value << 1) | (pixels[offset + col] > pixels[offset + col + 1])
+    return value
+
+def hamming_distance(a, b):
+    return bin(a ^ b).count('1')
+
+
+class ResultCache:
+    """Bounded LRU of recent prediction results keyed by image content, with a TTL.
+
+    Lookups are by exact content hash first; with `max_distance` > 0, a miss can also match a
+    cached image whose perceptual hash is within `max_distance` bits (a near-duplicate frame).
+    Each entry also remembers when it last triggered an alert, so repeats can be suppressed.
+    """
+
+    def __init__(self, max_entries=2048, ttl_seconds=600.0, max_distance=0):
+        self.max_entries = int(max_entries)
+        self.ttl_seconds = float(ttl_seconds)
+        self.max_distance = int(max_distance)
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.near_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.alerts_suppressed = 0
+
+    @property
+    def enabled(self):
+        return self.max_entries > 0
+
+    def _live(self, key, entry, now):
+        if now - entry['stored_at'] <= self.ttl_seconds:
+            return True
+        del self._entries[key]
+        self.expirations += 1
+        return False
+
+    # --- Lookups ---
+    def get(self, key):
+        """Returns (key, result) for an exact match, or None. Does not count a miss."""
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or not self._live(key, entry, now):
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return key, entry['result']
+
+    def get_similar(self, phash):
+        """Returns (key, result) for the closest live entry within max_distance bits, or None."""
+        if self.max_distance <= 0 or phash is None:
+            return None
+        now = time.time()
+        with self._lock:
+            best_key, best_distance = None, self.max_distance + 1
+            for key, entry in list(self._entries.items()):
+                if entry['phash'] is None or not self._live(key, entry, now):
+                    continue
+                distance = hamming_distance(phash, entry['phash'])
+                if distance < best_distance:
+                    best_key, best_distance = key, distance
+            if best_key is None:
+                return None
+            self._entries.move_to_end(best_key)
+            self.near_hits += 1
+            return best_key, self._entries[best_key]['result']
+
+    def record_miss(self):
+        with self._lock:
+            self.misses += 1
+
+    def put(self, key, result, phash=None):
+        if not self.enabled:
+            return
+        with self._lock:
+            previous = self._entries.pop(key, None)
+            self._entries[key] = {
+                'result': result,
+                'phash': phash,
+                'stored_at': time.time(),
+                'alerted_at': previous['alerted_at'] if previous else None,
+            }
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    # --- Alert suppression ---
+    def should_alert(self, key, window_seconds):
+        """True (and records the alert) unless this entry already alerted within `window_seconds`."""
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return True
+            if entry['alerted_at'] is not None and now - entry['alerted_at'] < window_seconds:
+                self.alerts_suppressed += 1
+                return False
+            entry['alerted_at'] = now
+            return True
+
+    def stats(self):
+        with self._lock:
+            total = self.hits + self.near_hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "hits": self.hits,
+                "near_duplicate_hits": self.near_hits,
+                "misses": self.misses,
+                "hit_ratio": ((self.hits + self.near_hits) / total) if total else 0.0,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+                "alerts_suppressed": self.alerts_suppressed,
+            }
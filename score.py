@@ -0,0 +1,318 @@
+"""Offline bulk scoring of leaf images, without the Flask server, Firebase or Telegram.
+
+Examples:
+    python score.py survey_photos/ -o predictions.csv
+    python score.py --manifest images.txt -o predictions.parquet --format parquet
+    python score.py survey_photos/ -o predictions.csv --resume
+    python score.py survey_photos/ -o predictions.csv --mc-samples 20
+
+A manifest is a text file with one image path per line, or a CSV file with a `path` column.
+Progress is checkpointed next to the output every few batches, so an interrupted run over a
+large archive can pick up where it stopped with --resume. With --mc-samples (Keras runtime
+only) each image is scored by that many stochastic passes, and an `uncertainty` column holds
+the standard deviation of the predicted class's probability.
+"""
+import argparse
+import csv
+import hashlib
+import json
+import os
+import queue
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+from preprocessing import IMG_HEIGHT, IMG_WIDTH, ImagePipeline, open_rgb
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.bmp', '.webp')
+OUTPUT_COLUMNS = ['path', 'status', 'predicted_class', 'class_index', 'confidence', 'error']
+UNCERTAINTY_COLUMNS = OUTPUT_COLUMNS + ['uncertainty']
+
+
+# --- Input Discovery ---
+def list_images(input_dir):
+    paths = []
+    for root, dirs, files in os.walk(input_dir):
+        dirs.sort()
+        for name in sorted(files):
+            if name.lower().endswith(IMAGE_EXTENSIONS):
+                paths.append(os.path.join(root, name))
+    return paths
+
+def read_manifest(manifest_path):
+    base_dir = os.path.dirname(os.path.abspath(manifest_path))
+    with open(manifest_path, 'r', newline='') as f:
+        if manifest_path.lower().endswith('.csv'):
+            paths = [row['path'] for row in csv.DictReader(f) if row.get('path')]
+        else:
+            paths = [line.strip() for line in f if line.strip() and not line.startswith('#')]
+    return [p if os.path.isabs(p) else os.path.join(base_dir, p) for p in paths]
+
+def fingerprint(paths):
+    """Identifies the input list so a checkpoint is never resumed against different inputs."""
+    digest = hashlib.sha1()
+    for path in paths:
+        digest.update(path.encode('utf-8'))
+        digest.update(b'\0')
+    return digest.hexdigest()
+
+
+# --- Decoding (thread pool) and prefetching ---
+def load_image(pipeline, path, out):
+    """Decodes, pre-checks and preprocesses one image like /predict, writing the input into `out`.
+
+    Returns the rejection error, or None if the image was written to `out`.
+    """
+    try:
+        pil_img = open_rgb(path)
+    except Exception as e:
+        return f"Failed to process image data: {e}"
+    precheck_error, _, _ = pipeline.run(pil_img, out=out)
+    return precheck_error
+
+def prefetch_batches(paths, batch_size, pool, depth, pipeline):
+    """Yields (paths, inputs, errors) batches decoded ahead of inference by a producer thread.
+
+    Behaves like a `tf.data` pipeline with `.map(num_parallel_calls)` and `.prefetch(depth)`:
+    while the model scores one batch, up to `depth` further batches are being decoded.
+    """
+    batches = queue.Queue(maxsize=max(depth, 1))
+    done = object()
+
+    def produce():
+        try:
+            for start in range(0, len(paths), batch_size):
+                batch_paths = paths[start:start + batch_size]
+                # Each decode thread writes straight into its row of the batch array
+                inputs = np.empty((len(batch_paths), IMG_HEIGHT, IMG_WIDTH, 3), dtype=np.float32)
+                errors = list(pool.map(
+                    lambda i: load_image(pipeline, batch_paths[i], inputs[i:i + 1]),
+                    range(len(batch_paths))
+                ))
+                batches.put((batch_paths, inputs, errors))
+        except Exception as e:
+            batches.put(e)
+        finally:
+            batches.put(done)
+
+    producer = threading.Thread(target=produce, name='score-prefetch', daemon=True)
+    producer.start()
+    while True:
+        item = batches.get()
+        if item is done:
+            break
+        if isinstance(item, Exception):
+            raise item
+        yield item
+
+
+# --- Output writers ---
+class CsvWriter:
+    def __init__(self, path, resume_bytes=None, columns=OUTPUT_COLUMNS):
+        self.path = path
+        if resume_bytes is not None and os.path.exists(path):
+            # Drop rows written after the last checkpoint
+            with open(path, 'r+b') as f:
+                f.truncate(resume_bytes)
+            self.file = open(path, 'a', newline='', encoding='utf-8')
+            self.writer = csv.DictWriter(self.file, fieldnames=columns)
+        else:
+            self.file = open(path, 'w', newline='', encoding='utf-8')
+            self.writer = csv.DictWriter(self.file, fieldnames=columns)
+            self.writer.writeheader()
+
+    def write(self, rows):
+        self.writer.writerows(rows)
+
+    def commit(self):
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        return {"output_bytes": self.file.tell()}
+
+    def close(self):
+        self.file.close()
+
+class ParquetWriter:
+    """Writes one Parquet part file per checkpoint into the output directory."""
+
+    def __init__(self, path, resume_parts=None, columns=OUTPUT_COLUMNS):
+        try:
+            import pyarrow
+            import pyarrow.parquet
+        except ImportError:
+            raise SystemExit("Parquet output requires pyarrow (pip install pyarrow).")
+        self._pa = pyarrow
+        self._pq = pyarrow.parquet
+        self.path = path
+        self.columns = columns
+        self.parts = resume_parts or 0
+        os.makedirs(path, exist_ok=True)
+        for name in os.listdir(path):
+            # Remove parts written after the last checkpoint (or all parts for a fresh run)
+            if name.startswith('part-') and name.endswith('.parquet') and int(name[5:10]) >= self.parts:
+                os.remove(os.path.join(path, name))
+        self.rows = []
+
+    def write(self, rows):
+        self.rows.extend(rows)
+
+    def commit(self):
+        if self.rows:
+            columns = {column: [row[column] for row in self.rows] for column in self.columns}
+            table = self._pa.table(columns)
+            self._pq.write_table(table, os.path.join(self.path, f"part-{self.parts:05d}.parquet"))
+            self.parts += 1
+            self.rows = []
+        return {"output_parts": self.parts}
+
+    def close(self):
+        pass
+
+
+# --- Checkpointing ---
+def load_checkpoint(path, input_fingerprint):
+    if not os.path.exists(path):
+        return None
+    with open(path, 'r') as f:
+        checkpoint = json.load(f)
+    if checkpoint.get('fingerprint') != input_fingerprint:
+        raise SystemExit(f"Checkpoint {path} was written for a different input list; refusing to resume.")
+    return checkpoint
+
+def save_checkpoint(path, state):
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(state, f)
+    os.replace(tmp_path, path)
+
+
+# --- Main ---
+def build_rows(batch_paths, outputs, errors, class_names, calibration, variances=None):
+    """One output row per image. `variances` (Monte Carlo runs) adds the `uncertainty` column."""
+    from inference import top_k
+
+    # Calibrated and ranked for the whole batch at once, with the same rules as the server
+    indices, probabilities = top_k(calibration.apply(outputs), 1)
+    rows = []
+    for i, path in enumerate(batch_paths):
+        if errors[i] is not None:
+            row = {'path': path, 'status': 'rejected', 'predicted_class': None,
+                   'class_index': None, 'confidence': None, 'error': errors[i]}
+        else:
+            class_index, confidence = int(indices[i][0]), float(probabilities[i][0])
+            class_name = class_names.get(class_index, "Unknown")
+            if calibration.is_unknown(class_name, confidence):
+                class_name = "Unknown"
+            row = {'path': path, 'status': 'ok', 'predicted_class': class_name,
+                   'class_index': class_index, 'confidence': confidence, 'error': None}
+        if variances is not None:
+            row['uncertainty'] = float(np.sqrt(variances[i][row['class_index']])) if errors[i] is None else None
+        rows.append(row)
+    return rows
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Score leaf images offline with the AgroSense model.")
+    parser.add_argument('input_dir', nargs='?', help="Directory tree of images to score.")
+    parser.add_argument('--manifest', help="Text file (one path per line) or CSV with a 'path' column.")
+    parser.add_argument('-o', '--output', required=True, help="Output CSV file or Parquet directory.")
+    parser.add_argument('--format', choices=('csv', 'parquet'), help="Output format (default: from the extension).")
+    parser.add_argument('--model', default='best_agrosense_model.h5')
+    parser.add_argument('--runtime', choices=('keras', 'tflite', 'savedmodel'), default='keras',
+                        help="Serve an artifact produced by export_model.py instead of the Keras model.")
+    parser.add_argument('--artifact', help="Exported artifact path for --runtime tflite/savedmodel.")
+    parser.add_argument('--threads', type=int, default=None, help="TFLite interpreter threads.")
+    parser.add_argument('--mc-samples', type=int, default=0,
+                        help="Monte Carlo dropout passes per image, adding an uncertainty column (Keras runtime only).")
+    parser.add_argument('--class-indices', default='class_indices.json')
+    parser.add_argument('--calibration', default='calibration.json',
+                        help="Temperature and per-crop thresholds, as used by the server (optional).")
+    parser.add_argument('--batch-size', type=int, default=32)
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 4, help="Decode/resize threads.")
+    parser.add_argument('--prefetch', type=int, default=2, help="Batches decoded ahead of inference.")
+    parser.add_argument('--checkpoint-every', type=int, default=10,
+                        help="Batches between checkpoints (each Parquet checkpoint writes one part file).")
+    parser.add_argument('--precheck-max-side', type=int, default=512,
+                        help="Longest side of the view the pre-checks run on (0 = full resolution).")
+    parser.add_argument('--resume', action='store_true', help="Continue from the checkpoint next to the output.")
+    args = parser.parse_args(argv)
+    if bool(args.input_dir) == bool(args.manifest):
+        parser.error("Give either an input directory or --manifest.")
+    if args.mc_samples < 0:
+        parser.error("--mc-samples must be 0 (deterministic) or more.")
+    if args.mc_samples and args.runtime != 'keras':
+        parser.error(f"--mc-samples needs the Keras runtime; the {args.runtime} artifact has no dropout.")
+    if args.format is None:
+        args.format = 'parquet' if args.output.lower().endswith('.parquet') else 'csv'
+    return args
+
+def main(argv=None):
+    args = parse_args(argv)
+    paths = read_manifest(args.manifest) if args.manifest else list_images(args.input_dir)
+    input_fingerprint = fingerprint(paths)
+    checkpoint_path = args.output.rstrip('/\\') + '.checkpoint.json'
+
+    checkpoint = load_checkpoint(checkpoint_path, input_fingerprint) if args.resume else None
+    completed = checkpoint['completed'] if checkpoint else 0
+    columns = UNCERTAINTY_COLUMNS if args.mc_samples else OUTPUT_COLUMNS
+    if args.format == 'parquet':
+        writer = ParquetWriter(args.output, resume_parts=checkpoint.get('output_parts') if checkpoint else None,
+                               columns=columns)
+    else:
+        writer = CsvWriter(args.output, resume_bytes=checkpoint.get('output_bytes') if checkpoint else None,
+                           columns=columns)
+
+    print(f"Scoring {len(paths) - completed} of {len(paths)} images ({completed} already done).")
+    if completed >= len(paths):
+        writer.close()
+        return 0
+
+    # Imported here so --help and argument errors don't pay for loading TensorFlow
+    from inference import Calibration, load_inference_model, load_class_names
+    model, runtime = load_inference_model(args.runtime, args.model, artifact_path=args.artifact, num_threads=args.threads)
+    print(f"Using the {runtime} runtime.")
+    if args.mc_samples and not model.supports_uncertainty:
+        raise SystemExit(f"--mc-samples is not available with the {runtime} runtime.")
+    class_names = load_class_names(args.class_indices)
+    calibration = Calibration.load(args.calibration)
+
+    def checkpoint_now():
+        state = {"fingerprint": input_fingerprint, "completed": completed, "total": len(paths)}
+        state.update(writer.commit())
+        save_checkpoint(checkpoint_path, state)
+
+    pipeline = ImagePipeline(check_max_side=args.precheck_max_side)
+    started = time.time()
+    scored = 0
+    pending_batches = 0
+    with ThreadPoolExecutor(max_workers=args.workers) as pool:
+        for batch_paths, inputs, errors in prefetch_batches(paths[completed:], args.batch_size, pool, args.prefetch, pipeline):
+            valid = [i for i, error in enumerate(errors) if error is None]
+            outputs = np.zeros((len(batch_paths), len(class_names)), dtype=np.float32)
+            variances = np.zeros_like(outputs) if args.mc_samples else None
+            if valid and args.mc_samples:
+                outputs[valid], variances[valid] = model.predict_with_uncertainty(inputs[valid], args.mc_samples)
+            elif valid:
+                outputs[valid] = model.predict(inputs[valid])
+            writer.write(build_rows(batch_paths, outputs, errors, class_names, calibration, variances))
+
+            completed += len(batch_paths)
+            scored += len(batch_paths)
+            pending_batches += 1
+            if pending_batches >= args.checkpoint_every:
+                checkpoint_now()
+                pending_batches = 0
+
+            rate = scored / max(time.time() - started, 1e-6)
+            print(f"\r{completed}/{len(paths)} images ({rate:.1f} img/s)", end='', file=sys.stderr)
+
+    if pending_batches:
+        checkpoint_now()
+    writer.close()
+    print(f"\nDone. Predictions written to {args.output}.")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
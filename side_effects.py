@@ -0,0 +1,231 @@
+import base64
+import json
+import queue
+import random
+import threading
+import time
+from collections import deque
+
+
+class _Job:
+    __slots__ = ('sink', 'payload', 'enqueued_at', 'attempts')
+
+    def __init__(self, sink, payload):
+        self.sink = sink
+        self.payload = payload
+        self.enqueued_at = time.time()
+        self.attempts = 0
+
+
+class _SinkStats:
+    def __init__(self):
+        self.submitted = 0
+        self.succeeded = 0
+        self.failed = 0
+        self.retries = 0
+        self.dead_lettered = 0
+        self.latency_ms_sum = 0.0
+        self.latency_ms_max = 0.0
+        self.latency_ms_last = 0.0
+
+    def as_dict(self):
+        attempts = self.succeeded + self.failed + self.retries
+        return {
+            "submitted": self.submitted,
+            "succeeded": self.succeeded,
+            "failed": self.failed,
+            "retries": self.retries,
+            "dead_lettered": self.dead_lettered,
+            "latency_ms": {
+                "mean": (self.latency_ms_sum / attempts) if attempts else 0.0,
+                "max": self.latency_ms_max,
+                "last": self.latency_ms_last,
+            },
+        }
+
+
+def _json_default(value):
+    """Makes binary payload fields (e.g. the Telegram photo) storable in the dead-letter file."""
+    if isinstance(value, (bytes, bytearray, memoryview)):
+        return {"__bytes__": base64.b64encode(bytes(value)).decode('ascii')}
+    return str(value)
+
+
+class SideEffectPipeline:
+    """Runs slow side effects (Firebase writes, Telegram alerts) on background worker threads.
+
+    Jobs go into a bounded queue; when it is full new jobs are dropped and counted rather than
+    blocking the request. A failing sink is retried with exponential backoff and jitter, and
+    jobs that still fail are appended to a JSON-lines dead-letter file for later replay.
+    """
+
+    def __init__(self, max_queue_size=1000, workers=2, max_retries=3, backoff_base=0.5,
+                 backoff_max=30.0, dead_letter_path='dead_letter.jsonl'):
+        self.max_queue_size = int(max_queue_size)
+        self.workers = max(int(workers), 1)
+        self.max_retries = max(int(max_retries), 0)
+        self.backoff_base = float(backoff_base)
+        self.backoff_max = float(backoff_max)
+        self.dead_letter_path = dead_letter_path
+
+        self._sinks = {}
+        self._queue = queue.Queue(maxsize=self.max_queue_size)
+        self._threads = []
+        self._stopping = threading.Event()
+        self._lock = threading.Lock()
+        self._dead_letter_lock = threading.Lock()
+        self._stats = {}
+        self._dropped = 0
+
+    # --- Configuration ---
+    def register(self, name, handler):
+        """Registers a sink. `handler(payload)` must raise an exception when the side effect fails."""
+        self._sinks[name] = handler
+        self._stats.setdefault(name, _SinkStats())
+        return self
+
+    # --- Lifecycle ---
+    def start(self):
+        with self._lock:
+            self._threads = [t for t in self._threads if t.is_alive()]
+            if self._threads:
+                return self
+            self._stopping.clear()
+            for i in range(self.workers):
+                thread = threading.Thread(target=self._run, name=f"side-effects-{i}", daemon=True)
+                thread.start()
+                self._threads.append(thread)
+        return self
+
+    def stop(self, drain=True, timeout=10.0):
+        """Stops the workers, by default after the queued jobs have been processed."""
+        if drain:
+            deadline = time.time() + timeout
+            while self._queue.unfinished_tasks and time.time() < deadline:
+                time.sleep(0.05)
+        self._stopping.set()
+        for thread in self._threads:
+            thread.join(max(timeout, 0.1))
+        self._threads = []
+
+    # --- Public API ---
+    def submit(self, sink, payload):
+        """Queues a side effect without blocking. Returns False if the job was dropped."""
+        if sink not in self._sinks:
+            raise KeyError(f"Unknown side-effect sink: {sink}")
+        if not self._threads:
+            self.start()
+        try:
+            self._queue.put_nowait(_Job(sink, payload))
+        except queue.Full:
+            with self._lock:
+                self._dropped += 1
+            print(f"⚠️ Side-effect queue full, dropping '{sink}' job.")
+            return False
+        with self._lock:
+            self._stats[sink].submitted += 1
+        return True
+
+    def stats(self):
+        with self._lock:
+            return {
+                "queue_depth": self._queue.qsize(),
+                "queue_capacity": self.max_queue_size,
+                "workers": len([t for t in self._threads if t.is_alive()]),
+                "dropped": self._dropped,
+                "sinks": {name: s.as_dict() for name, s in self._stats.items()},
+            }
+
+    # --- Worker ---
+    def _run(self):
+        while not self._stopping.is_set():
+            try:
+                job = self._queue.get(timeout=0.5)
+            except queue.Empty:
+                continue
+            try:
+                self._process(job)
+            finally:
+                self._queue.task_done()
+
+    def _backoff(self, attempt):
+        delay = min(self.backoff_base * (2 ** (attempt - 1)), self.backoff_max)
+        return delay * (0.5 + random.random() / 2)
+
+    def _process(self, job):
+        handler = self._sinks[job.sink]
+        stats = self._stats[job.sink]
+        while True:
+            job.attempts += 1
+            started = time.perf_counter()
+            try:
+                handler(job.payload)
+                error = None
+            except Exception as e:
+                error = e
+            elapsed_ms = (time.perf_counter() - started) * 1000.0
+
+            with self._lock:
+                stats.latency_ms_sum += elapsed_ms
+                stats.latency_ms_max = max(stats.latency_ms_max, elapsed_ms)
+                stats.latency_ms_last = elapsed_ms
+                if error is None:
+                    stats.succeeded += 1
+                elif job.attempts <= self.max_retries:
+                    stats.retries += 1
+                else:
+                    stats.failed += 1
+            if error is None:
+                return
+
+            if job.attempts > self.max_retries or self._stopping.is_set():
+                print(f"❌ Side effect '{job.sink}' failed after {job.attempts} attempt(s): {error}")
+                self._dead_letter(job, error)
+                return
+            # Interruptible sleep so shutdown is not held up by a long backoff
+            self._stopping.wait(self._backoff(job.attempts))
+
+    def _dead_letter(self, job, error):
+        record = {
+            "sink": job.sink,
+            "payload": job.payload,
+            "error": str(error),
+            "attempts": job.attempts,
+            "enqueued_at": job.enqueued_at,
+            "failed_at": time.time(),
+        }
+        try:
+            line = json.dumps(record, default=_json_default, ensure_ascii=False)
+            with self._dead_letter_lock:
+                with open(self.dead_letter_path, 'a', encoding='utf-8') as f:
+                    f.write(line + "\n")
+            with self._lock:
+                self._stats[job.sink].dead_lettered += 1
+        except Exception as e:
+            print(f"Error writing to dead-letter file {self.dead_letter_path}: {e}")
+
+
+class StubSink:
+    """In-process stand-in for a remote sink. Records payloads and can simulate latency or failures.
+
+    Only the last `keep` payloads are kept (long load tests would otherwise hold every photo);
+    `count` is the total number of successful calls.
+    """
+
+    def __init__(self, name='stub', latency=0.0, fail_times=0, keep=100):
+        self.name = name
+        self.latency = latency
+        self.fail_times = fail_times
+        self.calls = deque(maxlen=keep)
+        self.count = 0
+        self._lock = threading.Lock()
+
+    def __call__(self, payload):
+        if self.latency:
+            time.sleep(self.latency)
+        with self._lock:
+            if self.fail_times > 0:
+                self.fail_times -= 1
+                raise RuntimeError(f"{self.name}: simulated failure")
+            self.calls.append(payload)
+            self.count += 1
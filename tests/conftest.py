@@ -0,0 +1,67 @@
+import os
+import sys
+
+import numpy as np
+import pytest
+
+# The modules live at the repository root (app.py imports them as top-level modules)
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+
+class FakeModel:
+    """Stands in for the TensorFlow model: every image is class `winner` with 90% confidence."""
+
+    supports_uncertainty = False
+
+    def __init__(self, classes, winner=0):
+        self.classes = classes
+        self.winner = winner
+
+    def predict(self, images):
+        out = np.full((len(images), self.classes), 0.1 / (self.classes - 1), dtype=np.float32)
+        out[:, self.winner] = 0.9
+        return out
+
+
+@pytest.fixture(scope='session')
+def core(tmp_path_factory):
+    """app.py, loaded and ready, with a FakeModel, stubbed sinks and every file in a temp directory."""
+    for module in ('flask_cors', 'firebase_admin', 'googletrans'):
+        pytest.importorskip(module)
+    root = tmp_path_factory.mktemp('app')
+    env = {
+        'SIDE_EFFECT_SINKS': 'stub',
+        'TRANSLATOR_BACKEND': 'stub',
+        'TUNING_PATH': str(root / 'tuning.json'),
+        'CALIBRATION_PATH': str(root / 'calibration.json'),
+        'MODEL_REGISTRY_DIR': str(root / 'models'),
+        'MODEL_REGISTRY_POLL_SECONDS': '3600',
+        'RECOMMENDATIONS_COMPILED_PATH': str(root / 'recommendations.bin'),
+        'RECOMMENDATIONS_RELOAD_INTERVAL_SECONDS': '0',
+        'TRANSLATION_STORE_PATH': str(root / 'translations.sqlite3'),
+        'FIREBASE_OUTBOX_PATH': str(root / 'firebase_outbox.sqlite3'),
+        'ANALYTICS_PATH': str(root / 'analytics.log'),
+        'DEAD_LETTER_PATH': str(root / 'dead_letter.jsonl'),
+        'ALERT_MODE': 'digest',
+        'ALERT_DIGEST_INTERVAL_SECONDS': '3600',
+    }
+    saved = {name: os.environ.get(name) for name in env}
+    os.environ.update(env)
+    cwd = os.getcwd()
+    os.chdir(ROOT)  # class_indices.json and recommendations.json are read from the working directory
+    try:
+        import app
+    finally:
+        os.chdir(cwd)
+        for name, value in saved.items():
+            if value is None:
+                os.environ.pop(name, None)
+            else:
+                os.environ[name] = value
+
+    app.load_inference_model = lambda *args, **kwargs: (FakeModel(len(app.class_names)), 'fake')
+    app.load_resources()
+    yield app
+    app.shutdown_worker()
@@ -0,0 +1,115 @@
+import io
+
+from PIL import Image
+
+from alerts import AlertDispatcher, TelegramError, TelegramRateLimited, TokenBucket, truncate_caption
+
+
+def jpeg(color=(0, 128, 0)):
+    buffer = io.BytesIO()
+    Image.new('RGB', (64, 48), color).save(buffer, format='JPEG')
+    return buffer.getvalue()
+
+
+class FakeClient:
+    """Records sends; `errors` maps a caption prefix to the exception its send raises."""
+
+    configured = True
+
+    def __init__(self, errors=None):
+        self.errors = dict(errors or {})
+        self.sent = []
+
+    def _send(self, kind, photos, caption):
+        for prefix, error in self.errors.items():
+            if caption.startswith(prefix):
+                raise error
+        self.sent.append((kind, len(photos), caption))
+
+    def send_photo(self, photo, caption):
+        self._send('photo', [photo], caption)
+
+    def send_media_group(self, photos, caption):
+        self._send('album', photos, caption)
+
+    def stats(self):
+        return {"sent": len(self.sent)}
+
+
+def make_dispatcher(client, **kw):
+    return AlertDispatcher(client, lambda payload: payload['predicted_class'],
+                           lambda class_name, alerts: f"{class_name}: {len(alerts)}",
+                           digest_interval=3600, **kw)
+
+def queue_alerts(dispatcher, class_name, count):
+    for i in range(count):
+        dispatcher.deliver({'photo': jpeg(), 'predicted_class': class_name, 'confidence': 0.5 + i / 100,
+                            'lang': 'en'})
+
+def test_accepts_suppresses_healthy_low_confidence_and_duplicates():
+    dispatcher = make_dispatcher(FakeClient(), min_confidence=0.6)
+    assert not dispatcher.accepts('a', 'Tomato_healthy', 0.99)
+    assert not dispatcher.accepts('b', 'Blight', 0.5)
+    assert dispatcher.accepts('c', 'Blight', 0.9)
+    assert not dispatcher.accepts('c', 'Blight', 0.9)
+    assert dispatcher.stats()['suppressed'] == {"healthy": 1, "low_confidence": 1, "duplicate": 1}
+
+def test_digest_sends_one_album_per_class():
+    client = FakeClient()
+    dispatcher = make_dispatcher(client)
+    queue_alerts(dispatcher, 'Blight', 3)
+    queue_alerts(dispatcher, 'Rust', 1)
+    assert dispatcher.flush_digest() == 2
+    assert client.sent == [('album', 3, "Blight: 3"), ('photo', 1, "Rust: 1")]
+    assert dispatcher.stats()['pending'] == 0
+    dispatcher.stop(flush=False)
+
+def test_rejected_digest_is_dropped_and_the_rest_still_go_out():
+    client = FakeClient({'Blight': TelegramError("sendMediaGroup failed. Status: 400", status=400)})
+    dispatcher = make_dispatcher(client)
+    queue_alerts(dispatcher, 'Blight', 3)
+    queue_alerts(dispatcher, 'Rust', 1)
+    assert dispatcher.flush_digest() == 1
+    assert client.sent == [('photo', 1, "Rust: 1")]
+    stats = dispatcher.stats()
+    assert stats['pending'] == 0 and stats['digests_rejected'] == 1 and stats['dropped'] == 3
+    # Nothing is left to block the next round
+    assert dispatcher.flush_digest() == 0
+    dispatcher.stop(flush=False)
+
+def test_retryable_failures_keep_the_digest_for_the_next_round():
+    for error in (TelegramRateLimited(0.01), TelegramError("network error"),
+                  TelegramError("sendMediaGroup failed. Status: 502", status=502)):
+        client = FakeClient({'Blight': error})
+        dispatcher = make_dispatcher(client)
+        queue_alerts(dispatcher, 'Blight', 3)
+        queue_alerts(dispatcher, 'Rust', 1)
+        assert dispatcher.flush_digest() == 0
+        assert dispatcher.stats()['pending'] == 4
+
+        client.errors.clear()
+        assert dispatcher.flush_digest() == 2
+        assert dispatcher.stats()['pending'] == 0
+        dispatcher.stop(flush=False)
+
+def test_token_bucket_pause_holds_back_every_caller():
+    bucket = TokenBucket(rate=0, burst=1)
+    assert bucket.acquire(0)
+    bucket.pause(60)
+    assert not bucket.acquire(0.01)
+
+def test_short_captions_are_unchanged():
+    caption = "<b>Disease:</b> <code>Late &amp; early blight</code>"
+    assert truncate_caption(caption, limit=30) == caption
+
+def test_truncated_caption_closes_open_tags():
+    caption = "<b>Disease:</b> <code>" + "x" * 50 + "</code>\n<i>tail</i>"
+    short = truncate_caption(caption, limit=20)
+    assert short == "<b>Disease:</b> <code>" + "x" * 10 + "…</code>"
+
+def test_truncation_never_splits_an_entity():
+    caption = "<b>" + "a" * 8 + "&amp;&lt;b&gt;" + "z" * 20 + "</b>"
+    short = truncate_caption(caption, limit=13)
+    assert short == "<b>" + "a" * 8 + "&amp;&lt;b&gt;…</b>"
+    assert truncate_caption(caption, limit=10) == "<b>" + "a" * 8 + "&amp;…</b>"
+    assert truncate_caption(caption, limit=12) == "<b>" + "a" * 8 + "&amp;&lt;b…</b>"
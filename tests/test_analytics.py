@@ -0,0 +1,75 @@
+import pytest
+
+from analytics import OTHER_CLASS, OTHER_LANGUAGE, RECORD, PredictionAnalytics, parse_time
+
+CLASSES = {0: 'Tomato___Late_blight', 1: 'Tomato___healthy', 2: 'Pepper,_bell___Bacterial_spot'}
+DAY = 86400.0
+
+
+def make_analytics(tmp_path, **kw):
+    return PredictionAnalytics(str(tmp_path / 'analytics.log'), CLASSES, **kw)
+
+def test_rollups_count_classes_crops_and_languages(tmp_path):
+    analytics = make_analytics(tmp_path)
+    analytics.record('Tomato___Late_blight', 0.9, 'en', timestamp=10 * DAY)
+    analytics.record('Tomato___healthy', 0.7, 'sw', timestamp=10 * DAY + 5)
+    analytics.record('Pepper,_bell___Bacterial_spot', 0.8, 'en', timestamp=11 * DAY)
+    report = analytics.query()
+    assert report['total'] == 3
+    assert report['crops'] == {'Tomato': 2, 'Pepper': 1}
+    assert report['languages'] == {'en': 2, 'sw': 1}
+    assert [bucket['total'] for bucket in report['series']] == [2, 1]
+    assert report['classes']['Tomato___Late_blight']['mean_confidence'] == pytest.approx(0.9)
+    assert analytics.query(start=11 * DAY)['total'] == 1
+    assert analytics.query(crop='Pepper')['total'] == 1
+
+def test_unknown_predictions_are_not_counted_as_other(tmp_path):
+    analytics = make_analytics(tmp_path)
+    analytics.record('Unknown', 0.3, 'en', timestamp=DAY)
+    analytics.record('Corn___Rust', 0.9, 'en', timestamp=DAY)
+    analytics.record('Tomato___Late_blight', 0.9, 'en', timestamp=DAY)
+    classes = analytics.query()['classes']
+    assert classes['Unknown']['count'] == 1
+    assert classes['Other']['count'] == 1
+    assert classes['Tomato___Late_blight']['count'] == 1
+
+def test_out_of_range_class_ids_fold_into_other(tmp_path):
+    analytics = make_analytics(tmp_path)
+    with open(analytics.path, 'ab') as f:
+        f.write(RECORD.pack(DAY, 0.5, 3, b'en'))
+        f.write(RECORD.pack(DAY, 0.5, OTHER_CLASS, b'en'))
+    assert analytics.query()['classes'] == {'Other': {'count': 2, 'mean_confidence': 0.5}}
+
+def test_snapshot_restores_rollups_and_replays_newer_records(tmp_path):
+    analytics = make_analytics(tmp_path)
+    analytics.record('Tomato___Late_blight', 0.9, 'en', timestamp=DAY)
+    analytics.refresh()
+    analytics.snapshot()
+    analytics.record('Unknown', 0.2, 'en', timestamp=DAY)
+
+    restored = make_analytics(tmp_path)
+    assert restored.stats()['records'] == 2
+    assert restored.query()['classes']['Unknown']['count'] == 1
+    assert restored.query()['total'] == 2
+
+def test_sync_sends_only_changed_buckets(tmp_path):
+    sent = []
+    analytics = make_analytics(tmp_path, sync_fn=sent.append)
+    analytics.record('Tomato___Late_blight', 0.9, 'en', timestamp=DAY)
+    assert analytics.sync() == 2
+    assert sent[0]['day/1970-01-02']['classes'] == {'Tomato___Late_blight': 1}
+    assert analytics.sync() == 0
+
+def test_parse_time():
+    assert parse_time(None) is None
+    assert parse_time('86400') == DAY
+    assert parse_time('1970-01-02') == DAY
+    with pytest.raises(ValueError):
+        parse_time('yesterday')
+
+def test_unaccepted_languages_are_recorded_as_other(tmp_path):
+    analytics = make_analytics(tmp_path, languages=['en', 'sw'])
+    analytics.record('Tomato___healthy', 0.7, 'sw', timestamp=DAY)
+    analytics.record('Tomato___healthy', 0.7, 'garbage', timestamp=DAY)
+    analytics.record('Tomato___healthy', 0.7, '', timestamp=DAY)
+    assert analytics.query()['languages'] == {'sw': 1, OTHER_LANGUAGE: 2}
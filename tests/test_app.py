@@ -0,0 +1,104 @@
+import io
+import json
+import zipfile
+
+import numpy as np
+from PIL import Image
+
+
+def leaf_jpeg(size=(64, 48)):
+    """Green and black stripes: passes the brightness, contrast and leaf pre-checks."""
+    pixels = np.zeros((size[1], size[0], 3), dtype=np.uint8)
+    pixels[:, ::2] = (0, 160, 0)
+    buffer = io.BytesIO()
+    Image.fromarray(pixels).save(buffer, format='JPEG', quality=95)
+    return buffer.getvalue()
+
+def test_predict_scores_a_raw_image_body(core):
+    response = core.app.test_client().post('/predict', data=leaf_jpeg(), content_type='image/jpeg')
+    assert response.status_code == 200
+    body = response.get_json()
+    assert body['predicted_class'] == core.class_names[0]
+    assert abs(body['confidence'] - 0.9) < 1e-6
+
+def test_uncertainty_is_refused_when_the_model_cannot_estimate_it(core):
+    response = core.app.test_client().post('/predict?uncertainty=1', data=leaf_jpeg(), content_type='image/jpeg')
+    assert response.status_code == 400
+
+def test_predict_scores_a_multipart_upload(core):
+    response = core.app.test_client().post('/predict', data={'file': (io.BytesIO(leaf_jpeg()), 'leaf.jpg')},
+                                           content_type='multipart/form-data')
+    assert response.status_code == 200
+    body = response.get_json()
+    assert body['predicted_class'] == core.class_names[0]
+    assert abs(body['confidence'] - 0.9) < 1e-6
+
+def test_predict_adds_the_top_k_classes(core):
+    response = core.app.test_client().post('/predict?top_k=3', data={'file': (io.BytesIO(leaf_jpeg()), 'leaf.jpg')},
+                                           content_type='multipart/form-data')
+    top = response.get_json()['top_k']
+    assert len(top) == 3 and top[0]['class'] == core.class_names[0]
+    assert top[0]['confidence'] >= top[1]['confidence'] >= top[2]['confidence']
+
+def test_prediction_metrics_only_label_known_languages(core):
+    client = core.app.test_client()
+    for lang in ('sw', 'garbage0', 'zz'):
+        assert client.post(f'/predict?lang={lang}', data=leaf_jpeg(), content_type='image/jpeg').status_code == 200
+    text = client.get('/metrics').get_data(as_text=True)
+    series = [line for line in text.splitlines() if line.startswith('agrosense_predictions_total{')]
+    assert any('lang="sw"' in line for line in series)
+    assert any('lang="other"' in line for line in series)
+    assert not any('garbage0' in line or 'lang="zz"' in line for line in series)
+
+def ndjson(response):
+    return [json.loads(line) for line in response.get_data(as_text=True).splitlines()]
+
+def zipped(names):
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, 'w') as archive:
+        for name in names:
+            archive.writestr(name, leaf_jpeg())
+        archive.writestr('notes.txt', "not an image")
+    return buffer.getvalue()
+
+def test_batch_scores_multipart_images_and_zips(core):
+    files = [(io.BytesIO(leaf_jpeg()), f'{name}.jpg') for name in ('a', 'b', 'c')]
+    files.append((io.BytesIO(b'not a jpeg'), 'broken.jpg'))
+    files.append((io.BytesIO(zipped(['survey/d.jpg', 'survey/e.png'])), 'survey.zip'))
+    response = core.app.test_client().post('/predict/batch?top_k=2', data={'files': files},
+                                           content_type='multipart/form-data')
+    assert response.status_code == 200 and response.mimetype == 'application/x-ndjson'
+    lines = ndjson(response)
+    results, summary = lines[:-1], lines[-1]
+    assert [line['name'] for line in results] == ['a.jpg', 'b.jpg', 'c.jpg', 'broken.jpg', 'survey/d.jpg', 'survey/e.png']
+    assert all(line['predicted_class'] == core.class_names[0] and len(line['top_k']) == 2
+               for i, line in enumerate(results) if i != 3)
+    assert results[3]['error'].startswith("Failed to process image data")
+    assert summary['summary']['total'] == 6 and summary['summary']['predicted'] == 5
+    assert summary['summary']['rejected'] == 1
+    assert set(summary['recommendations']) == {core.class_names[0]}
+
+def test_batch_scores_a_zip_body(core):
+    response = core.app.test_client().post('/predict/batch', data=zipped(['a.jpg', 'b.jpg']),
+                                           content_type='application/zip')
+    assert response.status_code == 200 and response.mimetype == 'application/x-ndjson'
+    lines = ndjson(response)
+    assert [line.get('name') for line in lines[:-1]] == ['a.jpg', 'b.jpg']
+    assert all(line['predicted_class'] == core.class_names[0] for line in lines[:-1])
+    assert lines[-1]['summary']['predicted'] == 2
+    assert set(lines[-1]['recommendations']) == {core.class_names[0]}
+
+def test_batch_without_images_is_rejected(core):
+    response = core.app.test_client().post('/predict/batch', data={}, content_type='multipart/form-data')
+    assert response.status_code == 400
+
+def test_batch_items_whose_inference_fails_become_error_lines(core, monkeypatch):
+    def broken(inputs):
+        raise RuntimeError("model crashed")
+
+    monkeypatch.setattr(core.model_registry.active.batcher, 'predict_fn', broken)
+    response = core.app.test_client().post('/predict/batch', data=zipped(['a.jpg', 'b.jpg']),
+                                           content_type='application/zip')
+    lines = ndjson(response)
+    assert [line['error'] for line in lines[:-1]] == ["Prediction failed: model crashed"] * 2
+    assert lines[-1]['summary']['rejected'] == 2 and lines[-1]['recommendations'] == {}
@@ -0,0 +1,73 @@
+import asyncio
+
+import pytest
+
+from test_app import leaf_jpeg
+
+httpx = pytest.importorskip('httpx')
+pytest.importorskip('starlette')
+
+
+@pytest.fixture(scope='module')
+def asgi(core):
+    from starlette.testclient import TestClient
+
+    import asgi_app
+    with pytest.MonkeyPatch.context() as patch:
+        # Leaving the lifespan must not drain the session-wide worker the other tests share
+        patch.setattr(core, 'shutdown_worker', lambda: None)
+        with TestClient(asgi_app.app) as client:
+            yield asgi_app, client
+
+def test_predict_scores_a_raw_image_body(asgi, core):
+    _, client = asgi
+    response = client.post('/predict', content=leaf_jpeg(), headers={'Content-Type': 'image/jpeg'})
+    assert response.status_code == 200
+    assert response.json()['predicted_class'] == core.class_names[0]
+
+def test_full_inference_pool_answers_503_with_retry_after(asgi):
+    asgi_app, client = asgi
+    executor = asgi_app.inference_executor
+    rejected, executor.in_flight = executor.rejected, executor.capacity
+    try:
+        response = client.post('/predict', content=leaf_jpeg(), headers={'Content-Type': 'image/jpeg'})
+    finally:
+        executor.in_flight = 0
+    assert response.status_code == 503
+    assert response.headers['Retry-After'] == str(asgi_app.ASGI_RETRY_AFTER_SECONDS)
+    assert executor.rejected == rejected + 1
+    assert client.post('/predict', content=leaf_jpeg(), headers={'Content-Type': 'image/jpeg'}).status_code == 200
+
+def test_telegram_calls_go_through_the_pooled_async_client(asgi, core, monkeypatch):
+    asgi_app, _ = asgi
+    calls = []
+
+    async def post(url, data=None, files=None, timeout=None):
+        calls.append((url.rsplit('/', 1)[-1], data['text'], asyncio.get_running_loop()))
+        return httpx.Response(200, json={"ok": True})
+
+    monkeypatch.setattr(asgi_app.http_client, 'post', post)
+    assert core.telegram_client.send_message("hello") == {"ok": True}
+    assert calls == [('sendMessage', "hello", asgi_app.event_loop)]
+
+def test_async_client_errors_are_telegram_network_errors(asgi, core, monkeypatch):
+    from alerts import TelegramError
+    asgi_app, _ = asgi
+
+    async def post(url, **kwargs):
+        raise httpx.ConnectTimeout("timed out")
+
+    monkeypatch.setattr(asgi_app.http_client, 'post', post)
+    with pytest.raises(TelegramError, match="network error"):
+        core.telegram_client.send_message("hello")
+
+def test_loop_translator_awaits_the_async_translator_on_the_loop(asgi):
+    asgi_app, _ = asgi
+
+    class AsyncTranslator:
+        async def translate(self, text, dest='en', src='auto'):
+            assert asyncio.get_running_loop() is asgi_app.event_loop
+            return f"[{src}->{dest}] {text}"
+
+    translator = asgi_app.LoopTranslator(AsyncTranslator(), timeout=5)
+    assert translator.translate("Leaf spots.", dest='sw', src='en') == "[en->sw] Leaf spots."
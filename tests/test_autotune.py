@@ -0,0 +1,58 @@
+import json
+import os
+
+import pytest
+
+import autotune
+from autotune import apply_tuning, available_cpus, candidate_settings, choose, load_tuning, save_tuning
+
+SETTINGS = {"workers": 2, "intra_op_threads": 3, "inter_op_threads": 1, "onednn": True}
+
+TUNED_VARIABLES = ('WEB_CONCURRENCY', 'TF_INTRA_OP_THREADS', 'TF_INTER_OP_THREADS', 'OMP_NUM_THREADS',
+                   'TF_ENABLE_ONEDNN_OPTS')
+
+
+@pytest.fixture
+def clean_environment(monkeypatch):
+    for name in TUNED_VARIABLES:
+        # Set first so that monkeypatch also removes what apply_tuning adds
+        monkeypatch.setenv(name, '')
+        monkeypatch.delenv(name)
+    return monkeypatch
+
+def test_candidates_split_the_cores_between_workers():
+    candidates = candidate_settings(4, 'keras')
+    assert {c["workers"] for c in candidates} == {1, 2, 4}
+    assert all(c["workers"] * c["intra_op_threads"] <= 4 for c in candidates)
+    assert {c["onednn"] for c in candidates} == {False, True}
+    tflite = candidate_settings(4, 'tflite', workers=[2])
+    assert all(c["inter_op_threads"] == 1 and not c["onednn"] for c in tflite)
+
+def test_choose_prefers_throughput_within_the_slo():
+    fast = dict(SETTINGS, throughput_ips=50.0, p95_ms=300.0)
+    steady = dict(SETTINGS, throughput_ips=40.0, p95_ms=120.0)
+    failed = dict(SETTINGS, error="probe crashed")
+    assert choose([fast, steady, failed], slo_ms=200) == (steady, True)
+    assert choose([fast, steady], slo_ms=100) == (steady, False)
+    assert choose([failed], slo_ms=100) == (None, False)
+
+def test_saved_tuning_is_applied_without_overriding_the_environment(tmp_path, clean_environment):
+    path = str(tmp_path / 'tuning.json')
+    save_tuning(path, {"cpu_count": available_cpus(), "settings": SETTINGS})
+    clean_environment.setenv('WEB_CONCURRENCY', '7')
+    assert apply_tuning(path)["settings"] == SETTINGS
+    assert os.environ['WEB_CONCURRENCY'] == '7'
+    assert os.environ['TF_INTRA_OP_THREADS'] == '3' and os.environ['TF_ENABLE_ONEDNN_OPTS'] == '1'
+
+def test_tuning_from_another_host_falls_back(tmp_path, clean_environment):
+    path = tmp_path / 'tuning.json'
+    path.write_text(json.dumps({"cpu_count": available_cpus() + 1, "settings": SETTINGS}))
+    assert load_tuning(str(path)) is None
+    assert apply_tuning(str(path)) is None
+    assert os.environ['TF_ENABLE_ONEDNN_OPTS'] == autotune.FALLBACK_ENVIRONMENT['TF_ENABLE_ONEDNN_OPTS']
+
+def test_unreadable_tuning_is_ignored(tmp_path):
+    path = tmp_path / 'tuning.json'
+    path.write_text("{broken")
+    assert load_tuning(str(path)) is None
+    assert load_tuning(str(tmp_path / 'missing.json')) is None
@@ -0,0 +1,75 @@
+import threading
+import time
+
+import numpy as np
+import pytest
+
+from batching import BatcherStopped, MicroBatcher
+
+
+def doubling(inputs):
+    return inputs.reshape(len(inputs), -1)[:, :2] * 2
+
+def test_concurrent_samples_share_a_batch():
+    calls = []
+
+    def predict(inputs):
+        calls.append(len(inputs))
+        return doubling(inputs)
+
+    batcher = MicroBatcher(predict, max_batch_size=8, max_wait_ms=50).start()
+    samples = [np.full((1, 2, 2, 1), i, dtype=np.float32) for i in range(8)]
+    futures = [batcher.submit(sample) for sample in samples]
+    assert [float(f.result(5)[0]) for f in futures] == [2.0 * i for i in range(8)]
+    assert sum(calls) == 8 and max(calls) > 1
+    batcher.stop()
+
+def test_model_errors_fail_only_their_batch():
+    def predict(inputs):
+        if inputs[0, 0, 0, 0] < 0:
+            raise ValueError("bad input")
+        return doubling(inputs)
+
+    batcher = MicroBatcher(predict, max_batch_size=1, max_wait_ms=0).start()
+    with pytest.raises(ValueError):
+        batcher.predict(np.full((2, 2, 1), -1, dtype=np.float32), timeout=5)
+    assert float(batcher.predict(np.ones((2, 2, 1), dtype=np.float32), timeout=5)[0]) == 2.0
+    assert batcher.stats()["errors_total"] == 1
+    batcher.stop()
+
+def test_stopped_batcher_refuses_new_samples():
+    batcher = MicroBatcher(doubling).start()
+    batcher.stop()
+    with pytest.raises(BatcherStopped):
+        batcher.submit(np.ones((2, 2, 1), dtype=np.float32))
+    # Only an explicit start() brings it back
+    batcher.start()
+    assert float(batcher.predict(np.ones((2, 2, 1), dtype=np.float32), timeout=5)[0]) == 2.0
+    batcher.stop()
+
+def test_stop_fails_queued_samples_instead_of_leaving_them_pending():
+    release = threading.Event()
+
+    def slow(inputs):
+        release.wait(5)
+        return doubling(inputs)
+
+    batcher = MicroBatcher(slow, max_batch_size=1, max_wait_ms=0).start()
+    running = batcher.submit(np.ones((2, 2, 1), dtype=np.float32))
+    time.sleep(0.05)  # the worker is now blocked inside predict_fn
+    queued = [batcher.submit(np.ones((2, 2, 1), dtype=np.float32)) for _ in range(3)]
+    stopper = threading.Thread(target=batcher.stop, kwargs={"timeout": 5})
+    stopper.start()
+    release.set()
+    stopper.join(5)
+    assert float(running.result(5)[0]) == 2.0
+    for future in queued:
+        with pytest.raises(BatcherStopped):
+            future.result(5)
+
+def test_stop_from_a_done_callback_does_not_deadlock():
+    batcher = MicroBatcher(doubling, max_batch_size=1, max_wait_ms=0).start()
+    stopped = threading.Event()
+    future = batcher.submit(np.ones((2, 2, 1), dtype=np.float32))
+    future.add_done_callback(lambda _: (batcher.stop(), stopped.set()))
+    assert stopped.wait(5)
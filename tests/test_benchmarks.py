@@ -0,0 +1,26 @@
+import pytest
+
+from benchmarks.compare import compare
+from benchmarks.synthetic import leaf_image
+from preprocessing import is_leaf_detected, is_low_quality_image
+
+
+def report(kind, **metrics):
+    return {"kind": kind, "results": [dict(server='flask', size='small', payload='multipart', concurrency=8, **metrics)]}
+
+def test_slower_latency_and_lower_throughput_are_regressions():
+    baseline = report('loadtest', throughput_rps=100.0, p95_ms=50.0)
+    rows = compare(baseline, report('loadtest', throughput_rps=85.0, p95_ms=54.0), threshold=0.10)
+    regressed = {metric: flag for _, metric, _, _, _, flag in rows}
+    assert regressed == {'throughput_rps': True, 'p95_ms': False}
+    assert not any(row[-1] for row in compare(baseline, report('loadtest', throughput_rps=120.0, p95_ms=40.0), 0.10))
+
+def test_runs_of_different_kinds_are_not_compared():
+    with pytest.raises(ValueError):
+        compare(report('loadtest'), report('microbench'), threshold=0.10)
+
+def test_synthetic_leaves_pass_the_pre_checks():
+    for seed in range(3):
+        image = leaf_image(320, 240, seed=seed)
+        assert image.size == (320, 240)
+        assert not is_low_quality_image(image) and is_leaf_detected(image)
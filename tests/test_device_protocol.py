@@ -0,0 +1,55 @@
+import struct
+
+import numpy as np
+import pytest
+
+from device_protocol import (FRAME_TYPE, NO_CLASS_ID, RESULT, FrameError, RawFrame, encode_result, negotiate,
+                             open_device_upload, parse_content_type)
+from ingest import IngestBuffer
+
+
+def test_negotiate_defaults_to_json():
+    assert negotiate(None) == 'json'
+    assert negotiate('*/*') == 'json'
+    assert negotiate('application/cbor') == 'cbor'
+    assert negotiate('application/json;q=0.5, application/x-agrosense-result') == 'binary'
+
+def test_parse_content_type_reads_parameters():
+    assert parse_content_type('Application/X-Agrosense-Frame; format=rgb565; width="224"') == (
+        FRAME_TYPE, {'format': 'rgb565', 'width': '224'})
+
+def test_binary_and_cbor_results():
+    assert RESULT.unpack(encode_result('binary', 3, 0.5)) == (3, 0.5)
+    assert encode_result('cbor', 3, 0.5) == b'\x82\x03\xfa' + struct.pack('>f', 0.5)
+    assert encode_result('cbor', 300, 0.5)[:4] == b'\x82\x19\x01\x2c'
+
+def test_classes_without_an_id_get_the_reserved_id():
+    # e.g. "Unknown", or a class the scoring version does not have
+    assert RESULT.unpack(encode_result('binary', None, 0.25)) == (NO_CLASS_ID, 0.25)
+    with pytest.raises(ValueError):
+        encode_result('json', 1, 0.5)
+
+def test_rgb565_frame_decodes_to_rgb():
+    pixels = np.array([[0xF800, 0x07E0], [0x001F, 0xFFFF]], dtype='<u2')
+    rgb = RawFrame(pixels.tobytes(), 'rgb565', 2, 2).to_rgb()
+    assert rgb.tolist() == [[[255, 0, 0], [0, 255, 0]], [[0, 0, 255], [255, 255, 255]]]
+
+def test_frames_are_validated():
+    with pytest.raises(FrameError):
+        RawFrame(b'\x00' * 8, 'bgr', 2, 2)
+    with pytest.raises(FrameError):
+        RawFrame(b'\x00' * 7, 'rgb565', 2, 2)
+    with pytest.raises(FrameError):
+        RawFrame.from_params(b'\x00' * 8, {'format': 'rgb565', 'width': '2', 'height': '2'}, (4, 4))
+
+def body(data):
+    buffer = IngestBuffer(len(data))
+    buffer.write(data)
+    return buffer
+
+def test_open_device_upload():
+    with pytest.raises(FrameError):
+        open_device_upload(body(b''), 'image/jpeg', {}, (2, 2))
+    frame, data = open_device_upload(body(b'\x80' * 6), FRAME_TYPE, {'format': 'yuv420'}, (2, 2))
+    assert isinstance(frame, RawFrame) and len(data) == 6
+    assert frame.to_rgb().shape == (2, 2, 3)
@@ -0,0 +1,69 @@
+import json
+
+import numpy as np
+import pytest
+
+from export_model import validate
+from inference import (Calibration, SavedModelRunner, TFLiteModel, crop_of, load_inference_model, read_artifact_metadata,
+                       top_k)
+
+
+class Constant:
+    def __init__(self, rows):
+        self.rows = np.asarray(rows, dtype=np.float32)
+
+    def predict(self, images):
+        return self.rows[:len(images)]
+
+def test_unknown_runtimes_are_rejected():
+    with pytest.raises(ValueError):
+        load_inference_model('onnx', 'best_agrosense_model.h5')
+
+def test_artifact_metadata_is_optional(tmp_path):
+    artifact = tmp_path / 'model.tflite'
+    assert read_artifact_metadata(str(artifact)) is None
+    (tmp_path / 'model.tflite.meta.json').write_text('{"validation": {"passed": true}}')
+    assert read_artifact_metadata(str(artifact))['validation']['passed']
+
+def test_validation_compares_top1_agreement():
+    reference = Constant([[0.9, 0.1], [0.2, 0.8]])
+    samples = np.zeros((2, 1), dtype=np.float32)
+    assert validate(reference, Constant([[0.6, 0.4], [0.3, 0.7]]), samples, 2, min_agreement=1.0)['passed']
+    check = validate(reference, Constant([[0.6, 0.4], [0.7, 0.3]]), samples, 2, min_agreement=0.99)
+    assert check['top1_agreement'] == 0.5 and not check['passed']
+
+def test_top_k_ranks_each_row_best_first():
+    probabilities = np.array([[0.1, 0.6, 0.3], [0.5, 0.2, 0.3]], dtype=np.float32)
+    indices, values = top_k(probabilities, 2)
+    assert indices.tolist() == [[1, 2], [0, 2]]
+    np.testing.assert_allclose(values, [[0.6, 0.3], [0.5, 0.3]])
+
+def test_top_k_accepts_one_row_and_clamps_k():
+    indices, values = top_k(np.array([0.2, 0.8]), 10)
+    assert indices.tolist() == [[1, 0]] and values.shape == (1, 2)
+    assert top_k(np.array([0.2, 0.8]), 0)[0].tolist() == [[1]]
+
+def test_temperature_scaling_keeps_the_ranking_and_sums_to_one():
+    probabilities = np.array([0.7, 0.2, 0.1], dtype=np.float32)
+    softened = Calibration(temperature=2.0).apply(probabilities)
+    assert softened.sum() == pytest.approx(1.0)
+    assert np.argsort(softened).tolist() == np.argsort(probabilities).tolist()
+    assert softened[0] < probabilities[0]
+    with pytest.raises(ValueError):
+        Calibration(temperature=0)
+
+def test_unknown_thresholds_are_per_crop(tmp_path):
+    path = tmp_path / 'calibration.json'
+    path.write_text(json.dumps({"default_threshold": 0.4, "crop_thresholds": {"Cassava": 0.6}}))
+    calibration = Calibration.load(str(path))
+    assert crop_of('Pepper,_bell___healthy') == 'Pepper'
+    assert calibration.is_unknown('Cassava___Mosaic', 0.5)
+    assert not calibration.is_unknown('Tomato___Late_blight', 0.5)
+    assert Calibration.load(str(tmp_path / 'missing.json')).describe()['source'] is None
+
+def test_exported_runtimes_advertise_no_uncertainty():
+    # Callers check the flag instead of calling methods that would only raise
+    for runtime in (TFLiteModel, SavedModelRunner):
+        assert runtime.supports_uncertainty is False
+        assert not hasattr(runtime, 'predict_with_uncertainty')
+        assert not hasattr(runtime, 'predict_stochastic')
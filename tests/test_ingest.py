@@ -0,0 +1,80 @@
+import base64
+import io
+import json
+
+import pytest
+from werkzeug.test import EnvironBuilder
+
+from ingest import (IngestBuffer, IngestRequest, PayloadTooLarge, check_content_length, read_json_image,
+                    read_multipart_image, read_raw_body)
+
+BODY = bytes(range(256)) * 40  # 10240 bytes, several read chunks with a small chunk size
+
+
+def multipart_request(data, max_bytes):
+    environ = EnvironBuilder(method='POST', data={'file': (io.BytesIO(data), 'leaf.jpg')}).get_environ()
+    return read_multipart_image(IngestRequest(environ), 'file', max_bytes=max_bytes)
+
+
+# --- Limits: a falsy limit means "unlimited" everywhere ---
+@pytest.mark.parametrize('limit', [0, None])
+def test_no_limit_accepts_any_size(limit):
+    buffer = IngestBuffer(max_bytes=limit)
+    buffer.write(BODY)
+    assert len(buffer) == len(BODY)
+    assert bytes(read_raw_body(io.BytesIO(BODY), len(BODY), max_bytes=limit).getbuffer()) == BODY
+    check_content_length(10 ** 9, limit)
+
+def test_limit_exactly_at_body_size_is_accepted():
+    buffer = read_raw_body(io.BytesIO(BODY), len(BODY), max_bytes=len(BODY))
+    assert buffer.read() == BODY
+
+def test_body_one_byte_over_the_limit_is_refused():
+    limit = len(BODY) - 1
+    with pytest.raises(PayloadTooLarge):
+        read_raw_body(io.BytesIO(BODY), len(BODY), max_bytes=limit)
+    # Without (or with a lying) Content-Length the streamed body is cut off as well
+    with pytest.raises(PayloadTooLarge):
+        read_raw_body(io.BytesIO(BODY), None, max_bytes=limit)
+    buffer = IngestBuffer(max_bytes=limit)
+    with pytest.raises(PayloadTooLarge):
+        buffer.write(BODY)
+
+def test_multipart_without_limit_reads_into_an_ingest_buffer():
+    filename, buffer = multipart_request(BODY, 0)
+    assert filename == 'leaf.jpg'
+    assert isinstance(buffer, IngestBuffer)
+    assert buffer.read() == BODY
+
+def test_multipart_part_over_the_limit_is_refused():
+    environ = EnvironBuilder(method='POST', data={'file': (io.BytesIO(BODY), 'leaf.jpg')}).get_environ()
+    request = IngestRequest(environ)
+    request.upload_limit = len(BODY) - 1
+    with pytest.raises(PayloadTooLarge):
+        request.files.get('file')
+
+def test_multipart_part_at_the_limit_is_accepted():
+    environ = EnvironBuilder(method='POST', data={'file': (io.BytesIO(BODY), 'leaf.jpg')}).get_environ()
+    request = IngestRequest(environ)
+    request.upload_limit = len(BODY)
+    assert request.files.get('file').stream.getbuffer() == BODY
+
+
+# --- JSON (base64) ---
+@pytest.mark.parametrize('chunk', [1, 3, 7, 64 * 1024])
+def test_json_image_decodes_across_chunk_boundaries(chunk):
+    body = json.dumps({"lang": "ha", "meta": {"a": [1, "}"]}, "file": base64.b64encode(BODY).decode()}).encode()
+
+    class Chunked(io.BytesIO):
+        def read(self, size=-1):
+            return super().read(min(size, chunk))
+
+    buffer = read_json_image(Chunked(body), 'file', len(body), max_bytes=0)
+    assert buffer.read() == BODY
+
+def test_json_without_the_field_returns_none():
+    assert read_json_image(io.BytesIO(b'{"other": 1}'), 'file') is None
+
+def test_truncated_json_is_an_error():
+    with pytest.raises(ValueError):
+        read_json_image(io.BytesIO(b'{"file": "QUJD'), 'file')
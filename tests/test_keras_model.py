@@ -0,0 +1,39 @@
+import numpy as np
+import pytest
+
+tf = pytest.importorskip('tensorflow')
+
+from keras_model import FixedDropout, InferenceModel  # noqa: E402
+
+
+@pytest.fixture(scope='module')
+def model():
+    inputs = tf.keras.Input((224, 224, 3))
+    features = tf.keras.layers.GlobalAveragePooling2D()(inputs)
+    features = FixedDropout(0.5)(tf.keras.layers.Dense(16, activation='relu')(features))
+    return InferenceModel(tf.keras.Model(inputs, tf.keras.layers.Dense(3, activation='softmax')(features)))
+
+def images(count):
+    return np.random.default_rng(0).random((count, 224, 224, 3), dtype=np.float32)
+
+def test_deterministic_pass_repeats_exactly(model):
+    batch = images(4)
+    first = model.predict(batch)
+    assert first.shape == (4, 3)
+    np.testing.assert_array_equal(first, model.predict(batch))
+    np.testing.assert_allclose(first.sum(axis=1), 1.0, rtol=1e-5)
+
+def test_monte_carlo_pass_returns_mean_and_variance_per_image(model):
+    mean, variance = model.predict_with_uncertainty(images(2), samples=8)
+    assert mean.shape == variance.shape == (2, 3)
+    np.testing.assert_allclose(mean.sum(axis=1), 1.0, rtol=1e-5)
+    assert (variance >= 0).all()
+
+def test_exported_tflite_model_matches_the_keras_model(model, tmp_path):
+    from export_model import export_tflite, validate
+    from inference import TFLiteModel
+
+    path = str(tmp_path / 'model.tflite')
+    export_tflite(model, path, None, images(2))
+    check = validate(model, TFLiteModel(model_path=path), images(4), batch_size=2, min_agreement=1.0)
+    assert check['passed'] and check['max_abs_diff'] < 1e-4
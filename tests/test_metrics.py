@@ -0,0 +1,56 @@
+import contextvars
+import json
+
+from metrics import Registry, SlowRequestLog, begin_trace, current_trace, finish_trace, stage
+
+
+def test_histogram_renders_cumulative_prometheus_buckets():
+    registry = Registry()
+    histogram = registry.histogram('latency_seconds', "Latency.", ('stage',), buckets=(0.1, 1.0))
+    for value in (0.05, 0.5, 5.0):
+        histogram.observe(value, 'decode')
+    text = registry.render()
+    assert 'latency_seconds_bucket{stage="decode",le="0.1"} 1' in text
+    assert 'latency_seconds_bucket{stage="decode",le="1.0"} 2' in text
+    assert 'latency_seconds_bucket{stage="decode",le="+Inf"} 3' in text
+    assert 'latency_seconds_count{stage="decode"} 3' in text
+
+def test_counter_labels_are_escaped():
+    registry = Registry()
+    registry.counter('errors_total', "Errors.", ('type',)).inc('say "hi"\n')
+    assert 'errors_total{type="say \\"hi\\"\\n"} 1' in registry.render()
+
+def test_failing_gauges_are_skipped():
+    registry = Registry()
+    registry.gauge('depth', "Queue depth.", lambda: 1 / 0)
+    registry.gauge('size', "Cache size.", lambda: 3)
+    assert registry.render() == "# HELP size Cache size.\n# TYPE size gauge\nsize 3\n"
+
+def test_stages_are_recorded_on_the_current_trace_only():
+    def request():
+        trace = begin_trace('abc')
+        with stage('decode'):
+            pass
+        with stage('decode'):
+            pass
+        return trace
+
+    before = current_trace()
+    trace = contextvars.copy_context().run(request)
+    assert trace.trace_id == 'abc' and set(trace.stages) == {'decode'}
+    assert current_trace() is before
+
+def test_slow_requests_are_logged_with_their_stages(tmp_path):
+    path = tmp_path / 'slow.jsonl'
+    log = SlowRequestLog(threshold_ms=0.001, path=str(path))
+
+    def request():
+        trace = begin_trace()
+        trace.annotate(cached=False)
+        trace.stages['inference'] = 0.25
+        return finish_trace(trace, 'predict', 200, slow_log=log)
+
+    contextvars.copy_context().run(request)
+    line = json.loads(path.read_text())
+    assert line['endpoint'] == 'predict' and line['stages_ms'] == {'inference': 250.0}
+    assert line['attributes'] == {'cached': False}
@@ -0,0 +1,158 @@
+import json
+import os
+import threading
+
+import numpy as np
+import pytest
+
+from batching import BatcherStopped, MicroBatcher
+from model_registry import DEFAULT_VERSION, MANIFEST_FILE, ModelBundle, ModelRegistry, RegistryError
+
+
+def make_registry(root, drain_timeout=0.2, **kwargs):
+    """A registry whose "models" answer a constant one-hot row per version (no TensorFlow)."""
+    loaded = []
+
+    def load_fn(version, directory):
+        winner = len(loaded) % 3
+
+        def predict(inputs):
+            out = np.zeros((len(inputs), 3), dtype=np.float32)
+            out[:, winner] = 1.0
+            return out
+
+        batcher = MicroBatcher(predict, max_batch_size=4, max_wait_ms=1, name=f'test-{version}').start()
+        bundle = ModelBundle(version, None, 'fake', {0: 'a', 1: 'b', 2: 'c'}, None, None, batcher, 0.0)
+        loaded.append(bundle)
+        return bundle
+
+    registry = ModelRegistry(str(root), load_fn, poll_interval=60, drain_timeout=drain_timeout, **kwargs)
+    return registry, loaded
+
+def add_version(root, version):
+    os.makedirs(os.path.join(root, version))
+    with open(os.path.join(root, version, MANIFEST_FILE), 'w') as f:
+        json.dump({"runtime": "keras"}, f)
+
+SAMPLE = np.zeros((1, 2, 2, 3), dtype=np.float32)
+
+
+def test_activate_swaps_and_retires_the_old_version(tmp_path):
+    add_version(tmp_path, 'v2')
+    registry, loaded = make_registry(tmp_path)
+    swapped = []
+    registry.on_swap.append(swapped.append)
+    registry.sync(force=True)
+    assert registry.active.version == DEFAULT_VERSION
+
+    registry.request_activate('v2')
+    registry.sync()
+    assert registry.active.version == 'v2'
+    assert [bundle.version for bundle in swapped] == [DEFAULT_VERSION, 'v2']
+    assert loaded[0].retired
+    with pytest.raises(BatcherStopped):
+        loaded[0].batcher.submit(SAMPLE)
+    with registry.use() as bundle:
+        assert bundle.version == 'v2'
+        assert bundle.batcher.predict(SAMPLE, timeout=5).shape == (3,)
+
+def test_request_holding_a_retired_version_finishes_on_it(tmp_path):
+    add_version(tmp_path, 'v2')
+    registry, loaded = make_registry(tmp_path, drain_timeout=0.05)
+    registry.sync(force=True)
+    with registry.use() as old:
+        registry.request_activate('v2')
+        registry.sync()  # the drain times out while this request still holds the old version
+        assert registry.active.version == 'v2'
+        assert old.retired
+        # Its batcher keeps serving the request that holds it...
+        assert old.batcher.predict(SAMPLE, timeout=5).shape == (3,)
+        # ...but the retired version cannot be acquired again
+        with pytest.raises(RegistryError):
+            old.acquire()
+    # The last release stops the batcher
+    with pytest.raises(BatcherStopped):
+        old.batcher.submit(SAMPLE)
+
+def test_use_never_returns_a_retired_bundle_during_swaps(tmp_path):
+    for version in ('v2', 'v3'):
+        add_version(tmp_path, version)
+    registry, _ = make_registry(tmp_path, drain_timeout=5)
+    registry.sync(force=True)
+    failures = []
+    stop = threading.Event()
+
+    def requests():
+        while not stop.is_set():
+            try:
+                with registry.use() as bundle:
+                    bundle.batcher.predict(SAMPLE, timeout=5)
+            except Exception as e:
+                failures.append(e)
+
+    clients = [threading.Thread(target=requests) for _ in range(4)]
+    for thread in clients:
+        thread.start()
+    for version in ('v2', 'v3', 'v2', DEFAULT_VERSION):
+        registry.request_activate(version)
+        registry.sync()
+    stop.set()
+    for thread in clients:
+        thread.join(10)
+    assert failures == []
+
+def test_malformed_registry_json_is_reported_not_raised(tmp_path):
+    registry, _ = make_registry(tmp_path)
+    registry.sync(force=True)
+    with open(registry.control_path, 'w') as f:
+        f.write('{"active": "v2"')  # partially written
+    registry.sync()
+    assert registry.active.version == DEFAULT_VERSION
+    assert "not valid JSON" in registry.last_error
+    status = registry.status()
+    assert "not valid JSON" in status["desired"]["error"]
+    assert status["active"]["version"] == DEFAULT_VERSION
+
+def test_unknown_version_is_refused(tmp_path):
+    registry, _ = make_registry(tmp_path)
+    with pytest.raises(RegistryError):
+        registry.request_activate('missing')
+    with pytest.raises(RegistryError):
+        registry.request_shadow(DEFAULT_VERSION, 1.5)
+
+def test_failed_load_falls_back_to_the_default_version(tmp_path):
+    add_version(tmp_path, 'broken')
+    registry, _ = make_registry(tmp_path)
+    original = registry.load_fn
+
+    def load_fn(version, directory):
+        if version == 'broken':
+            raise RuntimeError("corrupt model")
+        return original(version, directory)
+
+    registry.load_fn = load_fn
+    registry.write_control({"active": "broken"})
+    registry.sync(force=True)
+    assert registry.active.version == DEFAULT_VERSION
+    assert "corrupt model" in registry.last_error
+
+def test_shadow_compares_sampled_requests(tmp_path):
+    add_version(tmp_path, 'v2')
+    registry, _ = make_registry(tmp_path)
+    registry.sync(force=True)
+    registry.request_shadow('v2', 1.0)
+    registry.sync()
+    with registry.use() as bundle:
+        live = bundle.batcher.predict(SAMPLE, timeout=5)
+        registry.maybe_shadow(SAMPLE, live, bundle, 1.0)
+    shadow = registry.shadow
+    with shadow._idle:
+        shadow._idle.wait_for(lambda: shadow._in_use == 0, timeout=5)
+    stats = registry.shadow_stats.stats()
+    assert stats["sampled"] == 1 and stats["compared"] == 1
+    assert stats["agreement"] == 0.0  # the fake versions always disagree
+
+    # Promoting the shadow reuses the loaded bundle
+    registry.request_activate('v2')
+    registry.sync()
+    assert registry.active is shadow and registry.shadow is None
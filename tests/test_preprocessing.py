@@ -0,0 +1,61 @@
+import io
+
+import numpy as np
+from PIL import Image
+
+from preprocessing import (IMG_HEIGHT, IMG_WIDTH, LOW_QUALITY_ERROR, NO_LEAF_ERROR, ImagePipeline,
+                           is_leaf_detected, is_low_quality_image, open_rgb, precheck_image)
+
+
+def striped(color, size=(64, 48)):
+    """Alternating `color` and black columns: enough contrast to pass the quality check."""
+    pixels = np.zeros((size[1], size[0], 3), dtype=np.uint8)
+    pixels[:, ::2] = color
+    return Image.fromarray(pixels)
+
+def encoded(image, format):
+    buffer = io.BytesIO()
+    image.save(buffer, format=format)
+    buffer.seek(0)
+    return buffer
+
+def test_leaf_image_passes_and_becomes_a_model_input():
+    error, checks, model_input = ImagePipeline().run(striped((0, 160, 0)))
+    assert error is None
+    assert checks.green_ratio == 0.5 and checks.check_size == (64, 48)
+    assert model_input.shape == (1, IMG_HEIGHT, IMG_WIDTH, 3) and model_input.dtype == np.float32
+    assert 0.0 <= model_input.min() and model_input.max() <= 1.0
+
+def test_dark_and_leafless_images_are_rejected():
+    pipeline = ImagePipeline()
+    assert pipeline.run(Image.new('RGB', (64, 48)))[0] == LOW_QUALITY_ERROR
+    assert pipeline.run(Image.new('RGB', (64, 48), (0, 160, 0)))[0] == LOW_QUALITY_ERROR  # uniform
+    error, checks, model_input = pipeline.run(striped((200, 0, 0)))
+    assert error == NO_LEAF_ERROR and checks is not None and model_input is None
+
+def test_precheck_matches_the_reference_checks():
+    for image in (striped((0, 160, 0)), striped((200, 0, 0)), Image.new('RGB', (64, 48))):
+        expected = (LOW_QUALITY_ERROR if is_low_quality_image(image)
+                    else None if is_leaf_detected(image) else NO_LEAF_ERROR)
+        assert precheck_image(image) == expected
+
+def test_checks_run_on_a_reduced_view():
+    checks = ImagePipeline(check_max_side=32).measure(striped((0, 160, 0), size=(128, 96)))
+    assert max(checks.check_size) <= 32
+
+def test_input_is_written_into_the_callers_buffer():
+    pipeline = ImagePipeline()
+    buffer = pipeline.input_buffer()
+    assert pipeline.input_buffer() is buffer
+    assert pipeline.run(striped((0, 160, 0)), out=buffer)[2] is buffer
+
+def test_open_rgb_converts_other_modes():
+    image = open_rgb(encoded(Image.new('L', (16, 16), 128), 'PNG'))
+    assert image.mode == 'RGB' and image.size == (16, 16)
+
+def test_open_rgb_drafts_large_jpegs():
+    source = encoded(striped((0, 160, 0), size=(800, 600)), 'JPEG')
+    assert open_rgb(source).size == (800, 600)
+    source.seek(0)
+    drafted = open_rgb(source, draft_min_side=224)
+    assert drafted.mode == 'RGB' and 224 <= max(drafted.size) < 800
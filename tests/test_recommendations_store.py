@@ -0,0 +1,64 @@
+import json
+
+from recommendations_store import RecommendationsStore, validate
+
+CLASSES = {0: 'Tomato___Late_blight', 1: 'Tomato___healthy', 2: 'Corn___Rust'}
+
+
+def entry(overview):
+    return {'overview': overview, 'treatment': ["Spray."], 'prevention': ["Rotate."]}
+
+def write(path, recommendations):
+    path.write_text(json.dumps(recommendations), encoding='utf-8')
+
+def make_store(tmp_path, recommendations, **kw):
+    source = tmp_path / 'recommendations.json'
+    write(source, recommendations)
+    return RecommendationsStore(str(source), CLASSES, compiled_path=str(tmp_path / 'recommendations.bin'), **kw)
+
+def test_validation_reports_missing_inexact_unused_and_malformed_entries():
+    index, report = validate({
+        'Tomato___Late_blight': entry("Blight."),
+        'tomato healthy': entry("Healthy."),
+        'Corn___Rust': {'overview': 1},
+        'Unknown': entry("Unsure."),
+    }, CLASSES)
+    assert index == {0: 'Tomato___Late_blight', 1: 'tomato healthy'}
+    assert report['missing'] == [{"class_id": 2, "class": 'Corn___Rust'}]
+    assert report['case_mismatch'][0]['entry'] == 'tomato healthy'
+    assert report['unused'] == ['Unknown']
+    assert report['invalid'][0]['name'] == 'Corn___Rust'
+
+def test_lookups_by_class_id_and_name(tmp_path):
+    store = make_store(tmp_path, {'Tomato___Late_blight': entry("Blight."), 'tomato healthy': entry("Healthy."),
+                                  'Unknown': entry("Unsure.")})
+    assert store.by_id(0)['overview'] == "Blight."
+    assert store.by_id(1)['overview'] == "Healthy."
+    assert store.by_id(2, 'default') == 'default'
+    assert store.by_id(99) is None
+    assert store.get('Tomato___healthy')['overview'] == "Healthy."
+    assert store['Unknown']['overview'] == "Unsure."
+    assert 'Corn___Rust' not in store
+
+def test_workers_share_one_compiled_file(tmp_path):
+    first = make_store(tmp_path, {'Corn___Rust': entry("Rust.")})
+    compiled = (tmp_path / 'recommendations.bin').stat().st_mtime_ns
+    second = RecommendationsStore(first.source_path, CLASSES, compiled_path=first.compiled_path)
+    assert (tmp_path / 'recommendations.bin').stat().st_mtime_ns == compiled
+    assert second.by_id(2)['overview'] == "Rust."
+
+def test_edits_are_reloaded_and_announced(tmp_path):
+    store = make_store(tmp_path, {'Corn___Rust': entry("Rust.")}, check_interval=0.001)
+    reloaded = []
+    store.on_reload.append(reloaded.append)
+    write(tmp_path / 'recommendations.json', {'Corn___Rust': entry("Orange pustules on the leaves.")})
+    store._next_check = 0.0
+    assert store.by_id(2)['overview'] == "Orange pustules on the leaves."
+    assert reloaded == [store] and store.version == 2
+
+def test_a_broken_edit_keeps_the_previous_version(tmp_path):
+    store = make_store(tmp_path, {'Corn___Rust': entry("Rust.")})
+    (tmp_path / 'recommendations.json').write_text("{not json", encoding='utf-8')
+    assert not store.maybe_reload(force=True)
+    assert store.by_id(2)['overview'] == "Rust."
+    assert store.stats()['reload_errors'] == 1
@@ -0,0 +1,67 @@
+import time
+
+from resources import WorkerLifecycle, process_memory
+
+
+class FlakyInit:
+    """Fails the first `failures` calls, then records a timed step."""
+
+    def __init__(self, failures=0):
+        self.failures = failures
+        self.calls = 0
+
+    def __call__(self, lifecycle):
+        self.calls += 1
+        if self.calls <= self.failures:
+            raise RuntimeError("model file missing")
+        with lifecycle.step('model_load'):
+            pass
+
+
+def test_process_memory_reports_max_rss():
+    assert process_memory()['max_rss_mb'] > 0
+
+def test_foreground_start_makes_the_worker_ready():
+    init = FlakyInit()
+    lifecycle = WorkerLifecycle(init)
+    assert not lifecycle.is_ready() and lifecycle.readiness()['status'] == 'unavailable'
+
+    lifecycle.start(background=False)
+    assert lifecycle.is_ready() and lifecycle.wait_ready(0)
+    report = lifecycle.readiness()
+    assert report['status'] == 'ok' and report['phase'] == 'ready'
+    assert 'model_load' in report['timings_seconds'] and report['time_to_ready_seconds'] >= 0
+
+    # Already initialized in this process: not run again
+    lifecycle.start(background=False)
+    assert init.calls == 1
+
+def test_background_start_signals_readiness():
+    lifecycle = WorkerLifecycle(FlakyInit())
+    lifecycle.start()
+    assert lifecycle.wait_ready(5) and lifecycle.is_ready()
+
+def test_failed_init_is_reported_and_retried_after_the_interval():
+    init = FlakyInit(failures=1)
+    lifecycle = WorkerLifecycle(init, retry_interval=60)
+    lifecycle.start(background=False)
+    report = lifecycle.readiness()
+    assert report['status'] == 'unavailable' and report['phase'] == 'failed'
+    assert report['error'] == "model file missing"
+    assert lifecycle.liveness()['status'] == 'ok'
+
+    lifecycle.start(background=False)
+    assert init.calls == 1  # Still inside the retry interval
+
+    lifecycle.failed_at = time.time() - 61
+    lifecycle.start(background=False)
+    assert init.calls == 2 and lifecycle.is_ready() and lifecycle.error is None
+
+def test_first_prediction_is_timed_once():
+    lifecycle = WorkerLifecycle(FlakyInit())
+    lifecycle.start(background=False)
+    lifecycle.mark_prediction()
+    first = lifecycle.first_prediction_at
+    lifecycle.mark_prediction()
+    assert lifecycle.first_prediction_at == first
+    assert lifecycle.readiness()['time_to_first_prediction_seconds'] >= 0
@@ -0,0 +1,74 @@
+import json
+import threading
+
+import pytest
+
+from response_templates import ResponseTemplates, make_encoder
+
+RECOMMENDATIONS = {'overview': "Leaf spots.", 'treatment': ["Spray."], 'prevention': ["Rotate."]}
+
+
+def build(complete=True):
+    calls = []
+
+    def build_fn(class_name, recommendations, lang):
+        calls.append((class_name, lang))
+        translated = {field: f"[{lang}] {value}" if isinstance(value, str) else value
+                      for field, value in recommendations.items()}
+        return translated, (f"<b>{class_name}</b> ", "%"), complete
+    return build_fn, calls
+
+@pytest.mark.parametrize('encoder', ['json', 'auto'])
+def test_rendered_body_matches_a_plain_json_response(encoder):
+    templates = ResponseTemplates(build()[0], ['en', 'sw'], encoder=encoder)
+    template = templates.get('Blight', RECOMMENDATIONS, 'sw')
+    body = json.loads(template.render_json(0.875, {"std": 0.1}, [{"class": 'Blight', "confidence": 0.875}]))
+    assert list(body) == ['predicted_class', 'confidence', 'recommendations', 'uncertainty', 'top_k']
+    assert body['confidence'] == 0.875 and body['recommendations']['overview'] == "[sw] Leaf spots."
+    assert template.render_caption(0.875) == "<b>Blight</b> 87.50%"
+
+def test_templates_are_built_once_per_class_and_language():
+    build_fn, calls = build()
+    templates = ResponseTemplates(build_fn, ['en', 'sw'])
+    for _ in range(3):
+        templates.get('Blight', RECOMMENDATIONS, 'sw')
+    assert calls == [('Blight', 'sw')]
+    templates.clear()
+    templates.get('Blight', RECOMMENDATIONS, 'sw')
+    assert len(calls) == 2
+
+def test_incomplete_translations_and_unlisted_languages_are_not_kept():
+    build_fn, calls = build(complete=False)
+    templates = ResponseTemplates(build_fn, ['en', 'sw'])
+    templates.get('Blight', RECOMMENDATIONS, 'sw')
+    templates.get('Blight', RECOMMENDATIONS, 'sw')
+    assert len(calls) == 2
+
+    build_fn, calls = build()
+    templates = ResponseTemplates(build_fn, ['en'])
+    templates.get('Blight', RECOMMENDATIONS, 'xx')
+    assert templates.stats()['templates'] == 0
+
+def test_precompute_builds_only_ready_pairs():
+    templates = ResponseTemplates(build()[0], ['en', 'sw'])
+    built = templates.precompute([('Blight', RECOMMENDATIONS)], lambda name, recs, lang: lang == 'en')
+    assert built == 1 and templates.stats()['templates'] == 1
+
+def test_unknown_encoder_is_rejected():
+    with pytest.raises(ValueError):
+        make_encoder('ujson')
+
+def test_concurrent_hits_are_all_counted():
+    templates = ResponseTemplates(build()[0], ['en'])
+    templates.get('Blight', RECOMMENDATIONS, 'en')
+
+    def hit():
+        for _ in range(2000):
+            templates.get('Blight', RECOMMENDATIONS, 'en')
+
+    threads = [threading.Thread(target=hit) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert templates.stats()['hits'] == 8000
@@ -0,0 +1,56 @@
+import io
+
+import numpy as np
+from PIL import Image
+
+from result_cache import ResultCache, content_hash, hamming_distance, perceptual_hash
+
+
+def gradient(size=(64, 48), noise=0):
+    rng = np.random.default_rng(0)
+    x = np.linspace(0, 255, size[0])[None, :, None] * np.ones((size[1], 1, 3))
+    pixels = np.clip(x + rng.normal(0, noise, x.shape), 0, 255).astype(np.uint8)
+    return Image.fromarray(pixels, 'RGB')
+
+def test_lru_evicts_the_least_recently_used_entry():
+    cache = ResultCache(max_entries=2)
+    cache.put('a', 1)
+    cache.put('b', 2)
+    assert cache.get('a') == ('a', 1)
+    cache.put('c', 3)
+    assert cache.get('b') is None and cache.get('a') == ('a', 1)
+    assert cache.stats()['evictions'] == 1
+
+def test_entries_expire_after_the_ttl():
+    cache = ResultCache(ttl_seconds=0.0)
+    cache.put('a', 1)
+    cache._entries['a']['stored_at'] -= 1
+    assert cache.get('a') is None
+    assert cache.stats()['expirations'] == 1
+
+def test_a_disabled_cache_stores_nothing():
+    cache = ResultCache(max_entries=0)
+    cache.put('a', 1)
+    assert not cache.enabled and cache.get('a') is None
+
+def test_near_duplicates_match_by_perceptual_hash():
+    original = gradient()
+    buffer = io.BytesIO()
+    original.save(buffer, format='JPEG', quality=60)
+    reencoded = Image.open(io.BytesIO(buffer.getvalue())).convert('RGB')
+    assert hamming_distance(perceptual_hash(original), perceptual_hash(reencoded)) <= 4
+
+    cache = ResultCache(max_distance=4)
+    cache.put(content_hash(b'original'), 'Blight', phash=perceptual_hash(original))
+    assert cache.get_similar(perceptual_hash(reencoded)) == (content_hash(b'original'), 'Blight')
+    assert cache.get_similar(perceptual_hash(gradient().transpose(Image.FLIP_LEFT_RIGHT))) is None
+
+def test_alerts_for_the_same_image_are_suppressed_within_the_window():
+    cache = ResultCache()
+    cache.put('a', 1)
+    assert cache.should_alert('a', 60)
+    assert not cache.should_alert('a', 60)
+    cache.put('a', 1)  # a refreshed result keeps the alert time
+    assert not cache.should_alert('a', 60)
+    assert cache.should_alert('a', 0)
+    assert cache.stats()['alerts_suppressed'] == 2
@@ -0,0 +1,59 @@
+import numpy as np
+import pytest
+
+from inference import Calibration
+from score import UNCERTAINTY_COLUMNS, CsvWriter, build_rows, fingerprint, load_checkpoint, parse_args, save_checkpoint
+
+CLASSES = {0: 'Tomato___Late_blight', 1: 'Tomato___healthy'}
+
+
+def row(path):
+    return {'path': path, 'status': 'ok', 'predicted_class': 'Tomato___healthy', 'class_index': 1,
+            'confidence': 0.9, 'error': None}
+
+def test_output_format_follows_the_extension():
+    assert parse_args(['photos', '-o', 'out.csv']).format == 'csv'
+    assert parse_args(['--manifest', 'images.txt', '-o', 'out.parquet']).format == 'parquet'
+    with pytest.raises(SystemExit):
+        parse_args(['photos', '--manifest', 'images.txt', '-o', 'out.csv'])
+
+def test_resuming_drops_rows_written_after_the_checkpoint(tmp_path):
+    output = str(tmp_path / 'out.csv')
+    writer = CsvWriter(output)
+    writer.write([row('a.jpg')])
+    state = writer.commit()
+    writer.write([row('b.jpg')])
+    writer.close()
+
+    writer = CsvWriter(output, resume_bytes=state['output_bytes'])
+    writer.write([row('c.jpg')])
+    writer.close()
+    with open(output, encoding='utf-8') as f:
+        assert [line.split(',')[0] for line in f.read().splitlines()] == ['path', 'a.jpg', 'c.jpg']
+
+def test_checkpoints_only_resume_the_same_inputs(tmp_path):
+    path = str(tmp_path / 'out.csv.checkpoint.json')
+    save_checkpoint(path, {"fingerprint": fingerprint(['a.jpg', 'b.jpg']), "completed": 1})
+    assert load_checkpoint(path, fingerprint(['a.jpg', 'b.jpg']))['completed'] == 1
+    with pytest.raises(SystemExit):
+        load_checkpoint(path, fingerprint(['a.jpg', 'c.jpg']))
+
+def test_mc_samples_need_the_keras_runtime(capsys):
+    with pytest.raises(SystemExit):
+        parse_args(['photos', '-o', 'out.csv', '--runtime', 'tflite', '--mc-samples', '10'])
+    assert '--mc-samples needs the Keras runtime' in capsys.readouterr().err
+    assert parse_args(['photos', '-o', 'out.csv', '--mc-samples', '10']).mc_samples == 10
+
+def test_rows_carry_uncertainty_only_for_monte_carlo_runs():
+    outputs = np.array([[0.9, 0.1], [0.0, 0.0]], dtype=np.float32)
+    variances = np.array([[0.04, 0.01], [0.0, 0.0]], dtype=np.float32)
+    errors = [None, "The image is too dark."]
+
+    rows = build_rows(['a.jpg', 'b.jpg'], outputs, errors, CLASSES, Calibration())
+    assert 'uncertainty' not in rows[0]
+
+    rows = build_rows(['a.jpg', 'b.jpg'], outputs, errors, CLASSES, Calibration(), variances)
+    assert set(rows[0]) == set(UNCERTAINTY_COLUMNS)
+    assert rows[0]['predicted_class'] == 'Tomato___Late_blight'
+    assert rows[0]['uncertainty'] == pytest.approx(0.2)
+    assert rows[1]['status'] == 'rejected' and rows[1]['uncertainty'] is None
@@ -0,0 +1,53 @@
+import base64
+import json
+import threading
+
+import pytest
+
+from side_effects import SideEffectPipeline, StubSink
+
+
+def make_pipeline(tmp_path, **kw):
+    kw.setdefault('backoff_base', 0.0)
+    return SideEffectPipeline(dead_letter_path=str(tmp_path / 'dead_letter.jsonl'), **kw)
+
+def test_jobs_run_in_the_background(tmp_path):
+    sink = StubSink()
+    pipeline = make_pipeline(tmp_path).register('stub', sink)
+    for i in range(5):
+        assert pipeline.submit('stub', {"n": i})
+    pipeline.stop(drain=True)
+    assert sorted(payload["n"] for payload in sink.calls) == list(range(5))
+    assert pipeline.stats()['sinks']['stub']['succeeded'] == 5
+
+def test_transient_failures_are_retried(tmp_path):
+    sink = StubSink(fail_times=2)
+    pipeline = make_pipeline(tmp_path, max_retries=3).register('stub', sink)
+    pipeline.submit('stub', {"n": 1})
+    pipeline.stop(drain=True)
+    stats = pipeline.stats()['sinks']['stub']
+    assert sink.count == 1 and stats['retries'] == 2 and stats['dead_lettered'] == 0
+
+def test_jobs_that_keep_failing_are_dead_lettered_with_their_bytes(tmp_path):
+    sink = StubSink(fail_times=10)
+    pipeline = make_pipeline(tmp_path, max_retries=1).register('telegram', sink)
+    pipeline.submit('telegram', {"photo": b'\xff\xd8jpeg', "lang": 'en'})
+    pipeline.stop(drain=True)
+    with open(pipeline.dead_letter_path, encoding='utf-8') as f:
+        record = json.loads(f.readline())
+    assert record['sink'] == 'telegram' and record['attempts'] == 2
+    assert base64.b64decode(record['payload']['photo']['__bytes__']) == b'\xff\xd8jpeg'
+    assert pipeline.stats()['sinks']['telegram']['dead_lettered'] == 1
+
+def test_a_full_queue_drops_instead_of_blocking(tmp_path):
+    release = threading.Event()
+    pipeline = make_pipeline(tmp_path, max_queue_size=1, workers=1).register('slow', lambda payload: release.wait(5))
+    results = [pipeline.submit('slow', {"n": i}) for i in range(5)]
+    release.set()
+    pipeline.stop(drain=True)
+    assert results.count(False) >= 3
+    assert pipeline.stats()['dropped'] == results.count(False)
+
+def test_unknown_sinks_are_rejected(tmp_path):
+    with pytest.raises(KeyError):
+        make_pipeline(tmp_path).submit('missing', {})
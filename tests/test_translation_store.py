@@ -0,0 +1,62 @@
+from translation_store import StubTranslator, TranslationStore
+
+ENTRY = {'overview': "Leaf spots.", 'treatment': ["Remove leaves."], 'prevention': ["Rotate crops."]}
+
+
+def translate(text, lang):
+    return StubTranslator().translate(text, dest=lang).text
+
+def make_store(tmp_path, lru_size=16):
+    return TranslationStore(str(tmp_path / 'translations.sqlite3'), lru_size=lru_size)
+
+def test_translations_are_cached_after_the_first_call(tmp_path):
+    store = make_store(tmp_path)
+    first = store.translate_recommendations('Blight', ENTRY, 'sw', translate)
+    again = store.translate_recommendations('Blight', ENTRY, 'sw', lambda text, lang: 1 / 0)
+    assert first == again == {'overview': "[sw] Leaf spots.", 'treatment': ["[sw] Remove leaves."],
+                              'prevention': ["[sw] Rotate crops."]}
+    assert store.live_calls == 3
+    assert store.has_translations('Blight', ENTRY, 'sw')
+
+def test_failed_translations_fall_back_to_english_and_are_not_cached(tmp_path):
+    store = make_store(tmp_path)
+
+    def failing(text, lang):
+        raise RuntimeError("service down")
+
+    assert store.translate_field('Blight', 'overview', "Leaf spots.", 'sw', failing) == "Leaf spots."
+    assert store.get('Blight', 'overview', 'sw', "Leaf spots.") is None
+
+def test_edited_source_makes_the_entry_stale(tmp_path):
+    store = make_store(tmp_path)
+    store.put('Blight', 'overview', 'sw', "Leaf spots.", "[sw] Leaf spots.")
+    assert store.get('Blight', 'overview', 'sw', "Brown leaf spots.") is None
+
+def test_prune_drops_removed_classes_and_edited_fields(tmp_path):
+    store = make_store(tmp_path)
+    store.translate_recommendations('Blight', ENTRY, 'sw', translate)
+    store.translate_recommendations('Rust', ENTRY, 'sw', translate)
+    edited = dict(ENTRY, overview="Brown leaf spots.")
+    assert store.prune({'Blight': edited}) == 4
+    assert store.get('Blight', 'treatment', 'sw', ENTRY['treatment']) == ["[sw] Remove leaves."]
+    assert store.get('Blight', 'overview', 'sw', ENTRY['overview']) is None
+    assert store.get('Rust', 'overview', 'sw', ENTRY['overview']) is None
+
+def test_prune_keeps_classes_of_every_resident_store(tmp_path):
+    # Active and shadow model versions with different class sets must not wipe each other's entries
+    store = make_store(tmp_path)
+    store.translate_recommendations('Blight', ENTRY, 'sw', translate)
+    store.translate_recommendations('Rust', ENTRY, 'sw', translate)
+    assert store.prune({'Blight': ENTRY}, {'Rust': ENTRY}) == 0
+    assert store.has_translations('Blight', ENTRY, 'sw')
+    assert store.has_translations('Rust', ENTRY, 'sw')
+    assert store.prune({'Rust': ENTRY}) == 3
+
+def test_probing_for_translations_does_not_move_the_hit_ratio(tmp_path):
+    store = make_store(tmp_path)
+    store.translate_recommendations('Blight', ENTRY, 'sw', translate)
+    before = store.stats()
+    assert store.has_translations('Blight', ENTRY, 'sw')
+    assert not store.has_translations('Rust', ENTRY, 'sw')
+    after = store.stats()
+    assert (after['hits'], after['misses']) == (before['hits'], before['misses'])
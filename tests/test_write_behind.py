@@ -0,0 +1,103 @@
+from write_behind import InMemoryDatabase, PushIdGenerator, WriteBehindLog
+
+
+class RejectingDatabase(InMemoryDatabase):
+    """Rejects every update that contains a value marked as poison; `down` fails them all."""
+
+    def __init__(self):
+        super().__init__()
+        self.down = False
+        self.reject_poison = True
+        self.calls = 0
+
+    def reference(self, path='/'):
+        reference = super().reference(path)
+        update = reference.update
+
+        def checked_update(values):
+            self.calls += 1
+            if self.down:
+                raise ConnectionError("database unreachable")
+            if self.reject_poison and any(isinstance(value, dict) and value.get('poison') for value in values.values()):
+                raise ValueError("Permission denied")
+            update(values)
+
+        reference.update = checked_update
+        return reference
+
+
+def make_log(tmp_path, db, **kw):
+    kw.setdefault('backoff_base', 0.0)
+    kw.setdefault('backoff_max', 0.0)
+    return WriteBehindLog(db, path=str(tmp_path / 'outbox.sqlite3'), **kw)
+
+def drain(log, rounds=50):
+    for _ in range(rounds):
+        log.flush()
+        if not log.pending():
+            return
+
+def test_push_ids_sort_by_creation():
+    generate = PushIdGenerator()
+    ids = [generate() for _ in range(200)]
+    assert ids == sorted(ids) and len(set(ids)) == 200
+
+def test_records_are_written_in_one_update_per_batch(tmp_path):
+    db = InMemoryDatabase()
+    log = make_log(tmp_path, db, max_batch=10)
+    keys = [log.append('/predictions', {"n": i}) for i in range(15)]
+    assert log.flush() == 10 and log.flush() == 5 and log.flush() == 0
+    assert db.updates == 2
+    assert db.reference('/predictions').get()[keys[14]] == {"n": 14}
+
+def test_unsent_records_survive_a_restart(tmp_path):
+    db = RejectingDatabase()
+    db.down = True
+    log = make_log(tmp_path, db)
+    log.append('/predictions', {"n": 1})
+    assert log.flush() == 0
+
+    db.down = False
+    restarted = make_log(tmp_path, db)
+    assert restarted.pending() == 1 and restarted.flush() == 1
+
+def test_poison_record_is_isolated_and_dead_lettered(tmp_path):
+    db = RejectingDatabase()
+    log = make_log(tmp_path, db, max_batch=8, max_attempts=3)
+    log.append('/predictions', {"n": 0})
+    poison = log.append('/predictions', {"poison": True})
+    for i in range(1, 8):
+        log.append('/predictions', {"n": i})
+    log.append('/jobs', {"late": True})
+
+    drain(log)
+    written = db.reference('/predictions').get()
+    assert len(written) == 8 and poison not in written
+    assert db.reference('/jobs').get()
+    stats = log.stats()
+    assert stats['pending'] == 0 and stats['dead_lettered'] == 1 and stats['dead_letters'] == 1
+
+    # Once the rule that rejected it is fixed, the record can be sent again
+    db.reject_poison = False
+    assert log.requeue_dead_letters() == 1
+    drain(log)
+    assert poison in db.reference('/predictions').get()
+    assert log.stats()['dead_letters'] == 0
+
+def test_failed_batches_shrink_until_the_database_recovers(tmp_path):
+    db = RejectingDatabase()
+    db.down = True
+    log = make_log(tmp_path, db, max_batch=8, max_attempts=10)
+    for i in range(8):
+        log.append('/predictions', {"n": i})
+    sizes = []
+    for _ in range(3):
+        rows = log._lease_batch()
+        sizes.append(len(rows))
+        log._release(rows, ConnectionError("down"))
+    assert sizes == [8, 4, 2]
+
+    db.down = False
+    drain(log)
+    assert len(db.reference('/predictions').get()) == 8
+    assert log.stats()['dead_lettered'] == 0
@@ -0,0 +1,205 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from types import SimpleNamespace
+
+RECOMMENDATION_FIELDS = ('overview', 'treatment', 'prevention')
+
+
+def source_hash(value):
+    """Short, stable fingerprint of an English source field (a string or a list of strings)."""
+    encoded = json.dumps(value, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+    return hashlib.blake2b(encoded, digest_size=8).hexdigest()
+
+
+class TranslationStore:
+    """Persistent cache of translated recommendation fields keyed by (class, field, language).
+
+    Entries live in a small SQLite file shared by all workers, with an in-memory LRU in front.
+    Each entry remembers a hash of the English source it was translated from, so editing an
+    entry in recommendations.json makes its cached translations stale automatically.
+    """
+
+    def __init__(self, path='translations.sqlite3', lru_size=1024):
+        self.path = path
+        self.lru_size = int(lru_size)
+        self._lru = OrderedDict()
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self.hits = 0
+        self.misses = 0
+        self.live_calls = 0
+
+        conn = self._connection()
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS translations ("
+            " class_name TEXT NOT NULL, field TEXT NOT NULL, lang TEXT NOT NULL,"
+            " source_hash TEXT NOT NULL, value TEXT NOT NULL,"
+            " PRIMARY KEY (class_name, field, lang)) WITHOUT ROWID"
+        )
+        conn.commit()
+
+    def _connection(self):
+        # One connection per thread, reopened after a fork (SQLite handles must not cross processes)
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=5.0)
+            conn.execute("PRAGMA journal_mode=WAL")
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    # --- Lookups ---
+    def get(self, class_name, field, lang, source, count=True):
+        """Returns the cached translation, or None if it is missing or stale.
+
+        `count=False` is a probe (see has_translations): it leaves the hit/miss counters alone.
+        """
+        key = (class_name, field, lang)
+        expected = source_hash(source)
+        with self._lock:
+            cached = self._lru.get(key)
+            if cached is not None and cached[0] == expected:
+                self._lru.move_to_end(key)
+                self.hits += count
+                return cached[1]
+
+        row = self._connection().execute(
+            "SELECT source_hash, value FROM translations WHERE class_name=? AND field=? AND lang=?", key
+        ).fetchone()
+        if row is None or row[0] != expected:
+            with self._lock:
+                self.misses += count
+            return None
+
+        value = json.loads(row[1])
+        self._remember(key, expected, value)
+        with self._lock:
+            self.hits += count
+        return value
+
+    def put(self, class_name, field, lang, source, value):
+        key = (class_name, field, lang)
+        digest = source_hash(source)
+        conn = self._connection()
+        conn.execute(
+            "INSERT OR REPLACE INTO translations VALUES (?, ?, ?, ?, ?)",
+            key + (digest, json.dumps(value, ensure_ascii=False, separators=(',', ':')))
+        )
+        conn.commit()
+        self._remember(key, digest, value)
+
+    def _remember(self, key, digest, value):
+        with self._lock:
+            self._lru[key] = (digest, value)
+            self._lru.move_to_end(key)
+            while len(self._lru) > self.lru_size:
+                self._lru.popitem(last=False)
+
+    # --- Recommendation helpers ---
+    def translate_field(self, class_name, field, source, lang, translate_fn):
+        """Returns `source` translated to `lang`, calling `translate_fn(text, lang)` only on a miss.
+
+        `translate_fn` must raise on failure; failed translations fall back to the English
+        text and are not cached, so they are retried on the next request.
+        """
+        if lang == 'en':
+            return source
+        cached = self.get(class_name, field, lang, source)
+        if cached is not None:
+            return cached
+
+        try:
+            if isinstance(source, list):
+                value = [translate_fn(item, lang) for item in source]
+            else:
+                value = translate_fn(source, lang)
+        except Exception as e:
+            print(f"Error during translation of {class_name}/{field} to {lang}: {e}. Returning original text.")
+            return source
+
+        with self._lock:
+            self.live_calls += len(source) if isinstance(source, list) else 1
+        self.put(class_name, field, lang, source, value)
+        return value
+
+    def translate_recommendations(self, class_name, recommendations, lang, translate_fn):
+        return {
+            field: self.translate_field(class_name, field, recommendations[field], lang, translate_fn)
+            for field in RECOMMENDATION_FIELDS
+        }
+
+    def has_translations(self, class_name, recommendations, lang):
+        """True if every field of an entry is stored for `lang` (always true for English).
+
+        Not counted as hits or misses: the exported hit ratio only reflects real lookups.
+        """
+        if lang == 'en':
+            return True
+        return all(self.get(class_name, field, lang, recommendations[field], count=False) is not None
+                   for field in RECOMMENDATION_FIELDS)
+
+    def build(self, recommendations_db, languages, translate_fn):
+        """Fills the store for every (class, field, language). Returns the number of live translations made."""
+        before = self.live_calls
+        for class_name, recommendations in recommendations_db.items():
+            for lang in languages:
+                if lang == 'en':
+                    continue
+                self.translate_recommendations(class_name, recommendations, lang, translate_fn)
+        return self.live_calls - before
+
+    def prune(self, *recommendation_stores):
+        """Drops entries whose class was removed or whose English source has changed.
+
+        With several stores (one per loaded model version), an entry is kept if any of them
+        still has its class with the same English text.
+        """
+        conn = self._connection()
+        rows = conn.execute("SELECT class_name, field, lang, source_hash FROM translations").fetchall()
+        stale = []
+        for class_name, field, lang, digest in rows:
+            if not any(_is_current(store.get(class_name), field, digest) for store in recommendation_stores):
+                stale.append((class_name, field, lang))
+        if stale:
+            conn.executemany("DELETE FROM translations WHERE class_name=? AND field=? AND lang=?", stale)
+            conn.commit()
+            with self._lock:
+                for key in stale:
+                    self._lru.pop(key, None)
+        return len(stale)
+
+    def stats(self):
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": (self.hits / total) if total else 0.0,
+                "live_translations": self.live_calls,
+                "lru_entries": len(self._lru),
+            }
+
+
+def _is_current(entry, field, digest):
+    return entry is not None and field in entry and source_hash(entry[field]) == digest
+
+
+class StubTranslator:
+    """Offline stand-in for googletrans' Translator: tags the text with the target language.
+
+    Used for benchmarks and local runs (TRANSLATOR_BACKEND=stub); `latency` simulates the
+    round trip of a live translation.
+    """
+
+    def __init__(self, latency=0.0):
+        self.latency = latency
+
+    def translate(self, text, dest='en', src='auto'):
+        if self.latency:
+            time.sleep(self.latency)
+        return SimpleNamespace(text=f"[{dest}] {text}", src=src, dest=dest)
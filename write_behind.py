@@ -0,0 +1,360 @@
+import json
+import os
+import random
+import sqlite3
+import threading
+import time
+
+from metrics import stage
+
+# Alphabet of Firebase push IDs, in ascending ASCII order so the IDs sort by creation time
+PUSH_CHARS = '-0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZ_abcdefghijklmnopqrstuvwxyz'
+
+
+class PushIdGenerator:
+    """Generates Firebase-style push IDs locally: 8 characters of millisecond timestamp plus 12
+    random characters, incremented (not redrawn) within the same millisecond so IDs made by
+    one process stay strictly ordered. Writing a record under its own ID makes a retried
+    write idempotent, unlike `ref.push()`, which would create a duplicate.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._last_ms = 0
+        self._last_random = [0] * 12
+
+    def __call__(self):
+        with self._lock:
+            now_ms = int(time.time() * 1000)
+            if now_ms == self._last_ms:
+                for i in range(11, -1, -1):
+                    if self._last_random[i] != 63:
+                        self._last_random[i] += 1
+                        break
+                    self._last_random[i] = 0
+            else:
+                self._last_ms = now_ms
+                self._last_random = [random.randrange(64) for _ in range(12)]
+            digits = []
+            for _ in range(8):
+                digits.append(PUSH_CHARS[now_ms % 64])
+                now_ms //= 64
+            return ''.join(reversed(digits)) + ''.join(PUSH_CHARS[i] for i in self._last_random)
+
+
+class WriteBehindLog:
+    """Durable write-behind buffer for Realtime Database writes.
+
+    `append()` stores a record in a local SQLite outbox (WAL mode, one small transaction) and
+    returns its push ID without touching the network. A flusher thread sends pending records
+    as one multi-location `update()` per batch, when `flush_size` records are waiting or every
+    `flush_interval` seconds, and deletes them once the update succeeds. A failed batch stays
+    in the outbox and is retried with backoff, in halves each time it fails again, so one
+    record the database rejects ends up alone and the others in its batch go through. A record
+    that has failed on its own `max_attempts` times is moved to the `dead_letter` table of the
+    same file (see `requeue_dead_letters()`). Records left over from a crash or restart are
+    replayed by the next flush. Several processes may share one outbox: a batch is leased to
+    one flusher, and a lease that expires (its process died) is picked up by another.
+
+    `db_module` is anything with firebase_admin.db's `reference(path)` API, so a fake (see
+    InMemoryDatabase) or an emulator-backed module can be injected.
+    """
+
+    def __init__(self, db_module, path='firebase_outbox.sqlite3', flush_size=200, flush_interval=2.0,
+                 max_batch=500, lease_seconds=60.0, backoff_base=1.0, backoff_max=60.0, max_attempts=10):
+        self.db = db_module
+        self.path = path
+        self.flush_size = max(int(flush_size), 1)
+        self.flush_interval = float(flush_interval)
+        self.max_batch = max(int(max_batch), 1)
+        self.lease_seconds = float(lease_seconds)
+        self.backoff_base = float(backoff_base)
+        self.backoff_max = float(backoff_max)
+        self.max_attempts = max(int(max_attempts), 1)
+        self.push_id = PushIdGenerator()
+
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stopping = threading.Event()
+        self._thread = None
+        self._owner = None
+        self._failures_in_a_row = 0
+        self._pending_hint = 0
+        self.appended = 0
+        self.flushed = 0
+        self.batches = 0
+        self.failed_batches = 0
+        self.dead_lettered = 0
+        self.last_flush_ms = 0.0
+        self.last_error = None
+
+        conn = self._connection()
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS outbox ("
+            " seq INTEGER PRIMARY KEY AUTOINCREMENT, path TEXT NOT NULL, value TEXT NOT NULL,"
+            " created_at REAL NOT NULL, attempts INTEGER NOT NULL DEFAULT 0,"
+            " leased_by TEXT, leased_until REAL NOT NULL DEFAULT 0)"
+        )
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS dead_letter ("
+            " seq INTEGER PRIMARY KEY, path TEXT NOT NULL, value TEXT NOT NULL, created_at REAL NOT NULL,"
+            " attempts INTEGER NOT NULL, error TEXT, failed_at REAL NOT NULL)"
+        )
+        conn.commit()
+
+    def _connection(self):
+        # One connection per thread, reopened after a fork (SQLite handles must not cross processes)
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=5.0, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            # Durable against a process crash; an OS crash may lose the last few appends
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    # --- Lifecycle ---
+    def start(self):
+        """Starts this process's flusher; records left in the outbox are replayed by its first flush."""
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive() and self._owner == os.getpid():
+                return self
+            self._owner = os.getpid()
+            self._stopping.clear()
+            self._thread = threading.Thread(target=self._run, name="firebase-write-behind", daemon=True)
+            self._thread.start()
+        pending = self.pending()
+        if pending:
+            print(f"Firebase outbox: replaying {pending} unsent record(s) from {self.path}.")
+        return self
+
+    def stop(self, flush=True, timeout=10.0):
+        """Stops the flusher, by default after a last attempt to send what is pending."""
+        self._stopping.set()
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join(max(timeout, 0.1))
+            self._thread = None
+        if flush:
+            deadline = time.time() + timeout
+            while time.time() < deadline and self.flush() > 0:
+                pass
+
+    # --- Public API ---
+    def append(self, path, value):
+        """Stores `value` for writing under `path` (e.g. '/predictions') and returns its push ID."""
+        key = self.push_id()
+        record_path = f"{path.strip('/')}/{key}"
+        self._connection().execute(
+            "INSERT INTO outbox (path, value, created_at) VALUES (?, ?, ?)",
+            (record_path, json.dumps(value, ensure_ascii=False, default=str), time.time())
+        )
+        with self._lock:
+            self.appended += 1
+            self._pending_hint += 1
+            wake = self._pending_hint >= self.flush_size
+        if wake:
+            self._wake.set()
+        return key
+
+    def flush(self):
+        """Sends one batch of pending records. Returns the number written, 0 if none or on failure."""
+        with self._flush_lock:
+            rows = self._lease_batch()
+            if not rows:
+                with self._lock:
+                    self._pending_hint = 0
+                return 0
+            updates = {path: json.loads(value) for _, path, value, _ in rows}
+            started = time.perf_counter()
+            try:
+                with stage('firebase_flush'):
+                    self.db.reference('/').update(updates)
+            except Exception as e:
+                self._release(rows, e)
+                return 0
+            elapsed_ms = (time.perf_counter() - started) * 1000.0
+
+            conn = self._connection()
+            conn.executemany("DELETE FROM outbox WHERE seq=?", [(seq,) for seq, _, _, _ in rows])
+            with self._lock:
+                self.flushed += len(rows)
+                self.batches += 1
+                self.last_flush_ms = elapsed_ms
+                self._pending_hint = max(self._pending_hint - len(rows), 0)
+                self._failures_in_a_row = 0
+            return len(rows)
+
+    def pending(self):
+        return self._connection().execute("SELECT COUNT(*) FROM outbox").fetchone()[0]
+
+    def requeue_dead_letters(self):
+        """Moves every dead-lettered record back into the outbox (e.g. after fixing the rule that
+        rejected it). Returns how many."""
+        conn = self._connection()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            moved = conn.execute(
+                "INSERT INTO outbox (path, value, created_at) SELECT path, value, created_at FROM dead_letter ORDER BY seq"
+            ).rowcount
+            conn.execute("DELETE FROM dead_letter")
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        if moved:
+            self._wake.set()
+        return moved
+
+    def stats(self):
+        conn = self._connection()
+        pending, oldest = conn.execute("SELECT COUNT(*), MIN(created_at) FROM outbox").fetchone()
+        dead_letters = conn.execute("SELECT COUNT(*) FROM dead_letter").fetchone()[0]
+        with self._lock:
+            return {
+                "pending": pending,
+                "oldest_pending_age_s": (time.time() - oldest) if oldest is not None else 0.0,
+                "appended": self.appended,
+                "flushed": self.flushed,
+                "batches": self.batches,
+                "failed_batches": self.failed_batches,
+                "dead_lettered": self.dead_lettered,
+                "dead_letters": dead_letters,
+                "last_flush_ms": self.last_flush_ms,
+                "last_error": self.last_error,
+                "flusher_alive": self._thread is not None and self._thread.is_alive(),
+            }
+
+    # --- Flusher ---
+    def _lease_id(self):
+        return f"{os.getpid()}:{id(self)}"
+
+    def _lease_batch(self):
+        """Claims unleased (or expired) records for this process, oldest first.
+
+        Up to max_batch records, halved for each time the oldest of them has already failed.
+        Returns (seq, path, value, attempts including this one) rows.
+        """
+        conn = self._connection()
+        now = time.time()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            rows = conn.execute(
+                "SELECT seq, path, value, attempts + 1 FROM outbox WHERE leased_until < ? ORDER BY seq LIMIT ?",
+                (now, self.max_batch)
+            ).fetchall()
+            if rows:
+                rows = rows[:max(self.max_batch >> (rows[0][3] - 1), 1)]
+                conn.executemany(
+                    "UPDATE outbox SET leased_by=?, leased_until=?, attempts=attempts+1 WHERE seq=?",
+                    [(self._lease_id(), now + self.lease_seconds, seq) for seq, _, _, _ in rows]
+                )
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        return rows
+
+    def _release(self, rows, error):
+        """Returns a failed batch to the outbox, retryable after the backoff delay.
+
+        A record that failed on its own max_attempts times is moved to the dead-letter table
+        instead, so it cannot hold up the records behind it forever.
+        """
+        with self._lock:
+            self.failed_batches += 1
+            self._failures_in_a_row += 1
+            self.last_error = str(error)
+            delay = min(self.backoff_base * (2 ** (self._failures_in_a_row - 1)), self.backoff_max)
+        conn = self._connection()
+        if len(rows) == 1 and rows[0][3] >= self.max_attempts:
+            seq, path, _, attempts = rows[0]
+            print(f"❌ Firebase record {path} failed {attempts} time(s); moving it to the dead-letter table: {error}")
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                conn.execute(
+                    "INSERT OR REPLACE INTO dead_letter"
+                    " SELECT seq, path, value, created_at, attempts, ?, ? FROM outbox WHERE seq=?",
+                    (str(error), time.time(), seq)
+                )
+                conn.execute("DELETE FROM outbox WHERE seq=?", (seq,))
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+            with self._lock:
+                self.dead_lettered += 1
+            return
+        print(f"❌ Firebase batch of {len(rows)} record(s) failed, retrying in {delay:.1f}s: {error}")
+        conn.executemany(
+            "UPDATE outbox SET leased_by=NULL, leased_until=? WHERE seq=?",
+            [(time.time() + delay, seq) for seq, _, _, _ in rows]
+        )
+
+    def _run(self):
+        while not self._stopping.is_set():
+            self._wake.wait(self.flush_interval)
+            self._wake.clear()
+            if self._stopping.is_set():
+                break
+            try:
+                # Keep going while full batches are waiting
+                while self.flush() == self.max_batch and not self._stopping.is_set():
+                    pass
+            except Exception as e:
+                print(f"Error flushing the Firebase outbox: {e}")
+
+
+class InMemoryDatabase:
+    """Stand-in for firebase_admin.db holding the tree in a dict (tests, benchmarks, local runs)."""
+
+    def __init__(self, latency=0.0):
+        self.latency = latency
+        self.data = {}
+        self.updates = 0
+        self._lock = threading.Lock()
+
+    def reference(self, path='/'):
+        return _InMemoryReference(self, [part for part in path.split('/') if part])
+
+
+class _InMemoryReference:
+    def __init__(self, database, parts):
+        self.database = database
+        self.parts = parts
+
+    def _node(self, parts, create=False):
+        node = self.database.data
+        for part in parts:
+            if part not in node:
+                if not create:
+                    return None
+                node[part] = {}
+            node = node[part]
+        return node
+
+    def get(self):
+        with self.database._lock:
+            return self._node(self.parts)
+
+    def set(self, value):
+        with self.database._lock:
+            self._node(self.parts[:-1], create=True)[self.parts[-1]] = value
+
+    def update(self, values):
+        """Multi-location update: every 'a/b/c' key is written, atomically, relative to this node."""
+        if self.database.latency:
+            time.sleep(self.database.latency)
+        with self.database._lock:
+            for key, value in values.items():
+                parts = self.parts + [part for part in key.split('/') if part]
+                self._node(parts[:-1], create=True)[parts[-1]] = value
+            self.database.updates += 1
+
+    def push(self, value):
+        key = PushIdGenerator()()
+        _InMemoryReference(self.database, self.parts + [key]).set(value)
+        return _InMemoryReference(self.database, self.parts + [key])